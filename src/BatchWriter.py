@@ -0,0 +1,157 @@
+"""
+Name:       BatchWriter.py
+Purpose:    Wraps a py2neo WriteBatch for the GraphBuilder writers. Batches are
+            submitted when either the operation count or the estimated payload
+            size is reached, and the target operation count is adjusted from
+            the observed submit time so batches are neither tiny nor so large
+            that they time out.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/6/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import json, time
+from py2neo import neo4j
+
+# Values estimated at a fixed size, see estimate_size
+_scalar_types = frozenset([int, long, float, bool, type(None)])
+
+
+def estimate_size(item):
+    """Rough JSON size of a payload in bytes, from string lengths and a fixed size for other values.
+
+    Much cheaper than json.dumps for the flat parameter dictionaries the writers send.
+    """
+    kind = type(item)
+    if kind is str or kind is unicode:
+        return len(item) + 2
+    if kind is dict:
+        size = 2
+        for key, value in item.iteritems():
+            kind = type(value)
+            if kind is str or kind is unicode:
+                size += len(key) + len(value) + 6
+            elif kind is dict or kind is list or kind is tuple:
+                size += len(key) + 4 + estimate_size(value)
+            else:
+                size += len(key) + 12
+        return size
+    if kind is list or kind is tuple:
+        return sum(estimate_size(value) + 1 for value in item) + 2
+    if kind in _scalar_types:
+        return 10
+    return len(json.dumps(item, default=unicode))
+
+
+class BatchWriter(object):
+    """Self submitting WriteBatch with adaptive size and per batch timings.
+
+    Operations added must not refer to the results of other operations in the
+    same batch, since the batch may be submitted after any operation.
+    """
+
+    def __init__(self, graph, name='', target_ops=500, min_ops=50, max_ops=5000, max_bytes=2000000,
+                 target_seconds=2.0):
+        """Create a BatchWriter.
+
+        :param GraphDatabaseService graph: graph the batches are submitted to
+        :param str name: name used in status messages
+        :param int target_ops: initial operations per batch
+        :param int min_ops: smallest operations per batch allowed when adjusting
+        :param int max_ops: largest operations per batch allowed when adjusting
+        :param int max_bytes: submit when estimated payload reaches this many bytes
+        :param float target_seconds: desired time for the server to process one batch
+        :rtype BatchWriter:
+        """
+        self.graph = graph
+        self.name = name
+        self.target_ops = target_ops
+        self.min_ops = min_ops
+        self.max_ops = max_ops
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.batch = neo4j.WriteBatch(graph)
+        self.n_ops = 0
+        self.n_bytes = 0
+        self.timings = []               # (operations, bytes, seconds) for each batch submitted
+
+    def _added(self, *payload):
+        """Count an operation and its payload, submit if either limit is reached.
+
+        Payload sizes are estimated, items are serialized only once the batch is within
+        a tenth of max_bytes, where the estimate decides when to submit.
+        """
+        self.n_ops += 1
+        exact = self.n_bytes >= self.max_bytes * 0.9
+        for item in payload:
+            if item:
+                self.n_bytes += len(json.dumps(item, default=unicode)) if exact else estimate_size(item)
+        if self.n_ops >= self.target_ops or self.n_bytes >= self.max_bytes:
+            self.submit()
+
+    def append_cypher(self, query, params=None):
+        """Add a Cypher query with parameters to the batch."""
+        request = self.batch.append_cypher(query, params)
+        self._added(query, params)
+        return request
+
+    def get_or_create_path(self, *items):
+        """Add a get_or_create_path, items are nodes and (type, properties) tuples."""
+        request = self.batch.get_or_create_path(*items)
+        self._added(*[item[1] for item in items if isinstance(item, tuple)])
+        return request
+
+    def create(self, abstract):
+        """Add creation of an abstract node or relationship to the batch."""
+        request = self.batch.create(abstract)
+        self._added(abstract)
+        return request
+
+    def set_properties(self, entity, properties):
+        """Add replacement of an entity's properties to the batch."""
+        request = self.batch.set_properties(entity, properties)
+        self._added(properties)
+        return request
+
+    def submit(self):
+        """Submit the current batch, record its timing, adjust the target size and start a new batch."""
+        if self.n_ops == 0:
+            return []
+        t0 = time.time()
+        results = self.batch.submit()
+        seconds = time.time() - t0
+        self.timings.append((self.n_ops, self.n_bytes, seconds))
+        print 'Batch {} {}: {} ops, {} bytes, {:.2f} s'.format(self.name, len(self.timings), self.n_ops,
+                                                               self.n_bytes, seconds)
+        self.adjust(seconds)
+        self.batch = neo4j.WriteBatch(self.graph)
+        self.n_ops = 0
+        self.n_bytes = 0
+        return results
+
+    def adjust(self, seconds):
+        """Scale target_ops toward target_seconds, only full batches grow the target."""
+        if seconds > self.target_seconds:
+            ops = int(self.n_ops * self.target_seconds / seconds)
+        elif seconds < self.target_seconds / 2 and self.n_ops >= self.target_ops:
+            ops = int(self.target_ops * 1.5)
+        else:
+            return
+        self.target_ops = max(self.min_ops, min(self.max_ops, ops))
+
+    def close(self):
+        """Submit anything remaining and print a summary of all batches, return the summary."""
+        self.submit()
+        summary = self.summary()
+        print 'Batches {}: {batches} submitted, {ops} ops, {bytes} bytes, {seconds:.1f} s, ' \
+              'slowest {slowest:.2f} s'.format(self.name, **summary)
+        return summary
+
+    def summary(self):
+        """Totals over the batches submitted so far."""
+        return {'batches': len(self.timings),
+                'ops': sum(t[0] for t in self.timings),
+                'bytes': sum(t[1] for t in self.timings),
+                'seconds': sum(t[2] for t in self.timings),
+                'slowest': max([t[2] for t in self.timings] or [0.0])}
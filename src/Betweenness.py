@@ -0,0 +1,210 @@
+"""
+Name:       Betweenness.py
+Purpose:    Approximate betweenness centrality for finding brokers, the people
+            and firms that connect otherwise separate parts of the network.
+            Brandes' dependency accumulation is run from a random sample of
+            source nodes, each BFS level handled with NumPy, and the samples are
+            spread over a process pool. The adjacency is saved once as .npy
+            files that every worker memory maps, so the graph is shared through
+            the page cache rather than copied. Per node estimates come with
+            confidence bounds that hold whatever the distribution of the
+            dependencies, from the range a source's dependency on a node can
+            take (at most the component size - 2): the tighter of an empirical
+            Bernstein-Serfling bound, narrow for nodes with little spread in
+            the sample, and a Hoeffding-Serfling bound, both for sampling
+            sources without replacement.
+            Sampling is stratified by connected component: small components are
+            computed exactly and the sample budget goes to the large ones.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/19/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import math, os, shutil, tempfile, time
+import multiprocessing
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from src.PathFinder import expand
+
+# Adjacency memory mapped by each worker, set by _open_adjacency
+_shared = dict()
+
+
+def _open_adjacency(directory):
+    """Pool initializer, memory map the adjacency saved by ApproximateBetweenness."""
+    _shared['ptr'] = np.load(os.path.join(directory, 'ptr.npy'), mmap_mode='r')
+    _shared['nbr'] = np.load(os.path.join(directory, 'nbr.npy'), mmap_mode='r')
+
+
+def source_dependencies(ptr, nbr, source):
+    """Dependency of source on every node (Brandes), unweighted and undirected.
+
+    :rtype ndarray: delta, the sum over targets of the fraction of shortest paths from source through each node
+    """
+    n = len(ptr) - 1
+    distance = np.empty(n, dtype=np.int32)
+    distance.fill(-1)
+    distance[source] = 0
+    sigma = np.zeros(n)
+    sigma[source] = 1.0
+    frontier = np.array([source], dtype=np.int32)
+    levels = []
+    depth = 0
+    while len(frontier):
+        from_nodes, to_nodes, unused = expand(ptr, nbr, nbr, frontier)
+        new = to_nodes[distance[to_nodes] == -1]
+        distance[new] = depth + 1
+        # Edges of the shortest path DAG from this level to the next
+        on_path = distance[to_nodes] == depth + 1
+        from_nodes, to_nodes = from_nodes[on_path], to_nodes[on_path]
+        sigma += np.bincount(to_nodes, weights=sigma[from_nodes], minlength=n)
+        levels.append((from_nodes, to_nodes))
+        frontier = np.unique(new).astype(np.int32)
+        depth += 1
+    delta = np.zeros(n)
+    for from_nodes, to_nodes in reversed(levels):
+        delta += np.bincount(from_nodes, weights=sigma[from_nodes] / sigma[to_nodes] * (1.0 + delta[to_nodes]),
+                             minlength=n)
+    delta[source] = 0.0
+    return delta
+
+
+def _accumulate(sources):
+    """Sum and sum of squares of the dependencies of the sources, run in a worker."""
+    ptr, nbr = _shared['ptr'], _shared['nbr']
+    n = len(ptr) - 1
+    total, squares = np.zeros(n), np.zeros(n)
+    for source in sources:
+        delta = source_dependencies(ptr, nbr, source)
+        total += delta
+        squares += delta * delta
+    return total, squares
+
+
+class ApproximateBetweenness(object):
+    """Betweenness estimated from sampled BFS sources, with confidence bounds."""
+
+    def __init__(self, graph, samples=1000, types=None, seed=0, workers=None, chunk=50, confidence=0.95,
+                 exact_size=1000):
+        """Estimate betweenness.
+
+        Estimates are for undirected, unweighted shortest paths and on the scale of
+        exact betweenness (networkx betweenness_centrality with normalized=False).
+        Each node's exact betweenness is between low and high with at least the given
+        confidence (per node, not for all nodes at once). The bounds only assume that a
+        source's dependency on a node is between 0 and the component size - 2, so they are
+        conservative, and zero width in components computed exactly.
+
+        :param CompactGraph graph: graph, e.g. from CompactGraph.from_networkx or a snapshot
+        :param int samples: number of sources sampled from components larger than exact_size
+        :param list types: relationship types followed, all if None
+        :param int seed: random seed for the sample
+        :param int workers: processes, defaults to the number of CPUs, 1 runs in this process
+        :param int chunk: sources per task sent to a worker
+        :param float confidence: probability that low and high bound a node's exact value
+        :param int exact_size: components up to this size use every node as a source
+        """
+        self.graph = graph
+        t0 = time.time()
+        ptr, nbr = graph.simple_adjacency(types)
+        n = graph.n_nodes
+        random = np.random.RandomState(seed)
+        sources, self.component, self.component_sources = self.sample_sources(ptr, nbr, samples, exact_size, random)
+        self.samples = len(sources)
+        tasks = [sources[i:i + chunk] for i in xrange(0, len(sources), chunk)]
+        directory = tempfile.mkdtemp(prefix='betweenness')
+        try:
+            np.save(os.path.join(directory, 'ptr.npy'), ptr)
+            np.save(os.path.join(directory, 'nbr.npy'), nbr)
+            workers = workers or multiprocessing.cpu_count()
+            if workers > 1 and len(tasks) > 1:
+                pool = multiprocessing.Pool(workers, _open_adjacency, (directory,))
+                try:
+                    results = pool.map(_accumulate, tasks, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                _open_adjacency(directory)
+                results = map(_accumulate, tasks)
+        finally:
+            _shared.clear()
+            shutil.rmtree(directory, ignore_errors=True)
+        total = np.sum([result[0] for result in results], axis=0) if results else np.zeros(n)
+        squares = np.sum([result[1] for result in results], axis=0) if results else np.zeros(n)
+        # A node only depends on sources in its own component, each of which gives an unbiased
+        # estimate size * delta / 2 (paths are counted from both ends)
+        size = np.bincount(self.component).astype(np.float64)[self.component]
+        k = np.maximum(self.component_sources[self.component], 1).astype(np.float64)
+        mean = total / k
+        scale = size / 2.0
+        self.estimate = mean * scale
+        margin = self.sampling_margin(mean, squares / k - mean * mean, k, size, 1.0 - confidence) * scale
+        self.low = np.maximum(self.estimate - margin, 0.0)
+        self.high = np.minimum(self.estimate + margin, (size - 1) * (size - 2) / 2.0)
+        print 'Betweenness: {} sources of {} nodes, {} workers, {:.1f} s'.format(self.samples, n, workers,
+                                                                                 time.time() - t0)
+
+    @staticmethod
+    def sampling_margin(mean, variance, k, size, failure):
+        """Half width of a two sided bound on the mean dependency over all sources of a component.
+
+        The tighter of the empirical Bernstein-Serfling bound (Bardenet and Maillard 2015) and the
+        Hoeffding-Serfling bound (Serfling 1974) for k sources sampled without replacement from size,
+        each taken at failure / 2 so both hold together with probability 1 - failure.
+
+        :param ndarray mean: sample mean of the dependencies on each node
+        :param ndarray variance: sample variance (divided by k) of the dependencies on each node
+        :param ndarray k: sources sampled in each node's component
+        :param ndarray size: nodes in each node's component, the dependencies are between 0 and size - 2
+        :param float failure: probability that the bound does not hold
+        :rtype ndarray: half width, 0 where every source was used
+        """
+        spread = np.maximum(size - 2, 0.0)
+        # Bernstein-Serfling finite population factor, one side at failure / 4
+        rho = np.where(k <= size / 2.0, 1.0 - (k - 1) / size, (1.0 - k / size) * (1.0 + 1.0 / k))
+        log_b = math.log(20.0 / failure)
+        bernstein = np.sqrt(np.maximum(variance, 0.0) * 2.0 * rho * log_b / k) + \
+            (7.0 / 3 + 3.0 / math.sqrt(2)) * spread * log_b / k
+        hoeffding = spread * np.sqrt((1.0 - (k - 1) / size) * math.log(4.0 / failure) / (2.0 * k))
+        return np.where(k >= size, 0.0, np.minimum(bernstein, hoeffding))
+
+    def sample_sources(self, ptr, nbr, samples, exact_size, random):
+        """Sources stratified by connected component.
+
+        :rtype tuple: sorted sources, component of each node, number of sources in each component
+        """
+        n = len(ptr) - 1
+        matrix = sparse.csr_matrix((np.ones(len(nbr), dtype=np.int8), nbr, ptr), shape=(n, n))
+        n_components, component = csgraph.connected_components(matrix, directed=False)
+        sizes = np.bincount(component, minlength=n_components)
+        large = sizes > exact_size
+        counts = sizes.copy()
+        if large.any():
+            share = samples * sizes[large] / float(sizes[large].sum())
+            counts[large] = np.minimum(sizes[large], np.maximum(2, np.round(share).astype(np.int64)))
+        sources = []
+        order = np.argsort(component, kind='mergesort')
+        starts = np.concatenate([[0], np.cumsum(sizes)])
+        for c in np.nonzero(large)[0]:
+            members = order[starts[c]:starts[c + 1]]
+            sources.append(members[random.permutation(len(members))[:counts[c]]])
+        sources.append(np.nonzero(~large[component])[0])
+        return np.sort(np.concatenate(sources)).astype(np.int32), component, counts
+
+    def top(self, k=20, label=None):
+        """The k nodes with the highest estimates as (permalink, estimate, low, high), optionally one label."""
+        nodes = np.arange(self.graph.n_nodes)
+        if label is not None:
+            nodes = nodes[self.graph.node_attributes['label'] == self.graph.category_code('label', label)]
+        best = nodes[np.argsort(-self.estimate[nodes], kind='mergesort')[:k]]
+        return [(self.graph.permalinks[node], self.estimate[node], self.low[node], self.high[node]) for node in best]
+
+    def normalized(self):
+        """Estimates divided by the number of pairs of other nodes, as networkx normalized=True."""
+        n = self.graph.n_nodes
+        pairs = (n - 1) * (n - 2) / 2.0
+        return self.estimate / pairs if pairs > 0 else self.estimate
@@ -0,0 +1,177 @@
+"""
+Name:       CoInvestment.py
+Purpose:    Projects the bipartite funder -> company funded graph onto a weighted
+            funder <-> funder co-investment graph. Pair weights are the number
+            of portfolio companies (and optionally funding rounds) two funders
+            share, computed as a sparse matrix product one block of funders at
+            a time so memory is bounded by the block and the threshold rather
+            than by the most popular companies. Results can be written as a
+            Gephi tab file, GEXF/GraphML, or relationships in Neo4j.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/17/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import csv, time
+import numpy as np
+from scipy import sparse
+
+from src.GephiWriter import open_writer
+
+
+def incidence_matrix(rows, columns, n_rows, n_columns):
+    """0/1 CSR matrix with a one at each (row, column), duplicates counted once."""
+    matrix = sparse.coo_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                               shape=(n_rows, n_columns)).tocsr()
+    matrix.data[:] = 1
+    return matrix
+
+
+def round_ids(graph, edges):
+    """Integer id of the funding round of each edge: company, funded_year and round_code if known."""
+    key = graph.targets[edges].astype(np.int64) << 32
+    if 'funded_year' in graph.edge_attributes:
+        key |= (graph.edge_attributes['funded_year'][edges].astype(np.int64) & 0xffff) << 16
+    if 'round_code' in graph.edge_attributes:
+        key |= graph.edge_attributes['round_code'][edges].astype(np.int64) & 0xffff
+    rounds, ids = np.unique(key, return_inverse=True)
+    return ids, len(rounds)
+
+
+class CoInvestment(object):
+    """Funder pairs that invested in the same companies, with shared company and round counts."""
+
+    def __init__(self, graph, min_shared=1, shared_rounds=False, block_rows=20000, max_funders=0):
+        """Compute the projection.
+
+        :param CompactGraph graph: graph with funded edges from funders (or people) to companies
+        :param int min_shared: pairs sharing fewer companies are dropped
+        :param bool shared_rounds: if True also count rounds both funders took part in
+        :param int block_rows: funders per block of the sparse product
+        :param int max_funders: if > 0, companies with more funders than this are ignored, they
+                                would connect every pair of their funders
+        """
+        self.graph = graph
+        self.min_shared = min_shared
+        t0 = time.time()
+        edges = np.nonzero(graph.edge_type_mask(['funded']))[0]
+        # Funders are renumbered 0..n-1 so the matrices have a row per funder only
+        self.funders, funder_rows = np.unique(graph.sources[edges], return_inverse=True)
+        companies = graph.targets[edges]
+        if max_funders:
+            by_company = incidence_matrix(funder_rows, companies, len(self.funders), graph.n_nodes).tocsc()
+            popular = np.nonzero(np.diff(by_company.indptr) > max_funders)[0]
+            keep = ~np.in1d(companies, popular)
+            edges, funder_rows, companies = edges[keep], funder_rows[keep], companies[keep]
+            self.n_ignored = len(popular)
+        else:
+            self.n_ignored = 0
+        self.company_matrix = incidence_matrix(funder_rows, companies, len(self.funders), graph.n_nodes)
+        self.round_matrix = None
+        if shared_rounds:
+            rounds, n_rounds = round_ids(graph, edges)
+            self.round_matrix = incidence_matrix(funder_rows, rounds, len(self.funders), n_rounds)
+        self.pairs, self.shared_companies, self.shared_rounds = self.project(block_rows)
+        print 'Co-investment: {} funders, {} pairs sharing at least {} companies, {} companies ignored, ' \
+              '{:.1f} s'.format(len(self.funders), len(self.pairs), min_shared, self.n_ignored, time.time() - t0)
+
+    def project(self, block_rows):
+        """Sparse product of the incidence matrices with their transposes, one row block at a time.
+
+        Only pairs a < b meeting min_shared are kept from each block.
+        :rtype tuple: pairs (n x 2 funder rows), shared companies, shared rounds (None if not counted)
+        """
+        companies = self.company_matrix
+        companies_t = companies.T.tocsr()
+        rounds_t = self.round_matrix.T.tocsr() if self.round_matrix is not None else None
+        pairs, shared, shared_rounds = [], [], []
+        for lo in xrange(0, companies.shape[0], block_rows):
+            block = companies[lo:lo + block_rows].dot(companies_t).tocoo()
+            rows = block.row + lo
+            keep = (block.col > rows) & (block.data >= self.min_shared)
+            rows, cols = rows[keep], block.col[keep]
+            pairs.append(np.column_stack([rows, cols]).astype(np.int32))
+            shared.append(block.data[keep].astype(np.int32))
+            if rounds_t is not None:
+                round_block = self.round_matrix[lo:lo + block_rows].dot(rounds_t).tocoo()
+                shared_rounds.append(self.lookup(round_block, rows - lo, cols))
+        if not pairs:
+            return np.zeros((0, 2), dtype=np.int32), np.zeros(0, dtype=np.int32), None
+        return np.vstack(pairs), np.concatenate(shared), np.concatenate(shared_rounds) if shared_rounds else None
+
+    def lookup(self, matrix, rows, cols):
+        """Values of a COO matrix at (rows, cols), zero where it has no entry."""
+        if not matrix.nnz:
+            return np.zeros(len(rows), dtype=np.int32)
+        n_cols = np.int64(matrix.shape[1])
+        keys = matrix.row.astype(np.int64) * n_cols + matrix.col
+        order = np.argsort(keys)
+        keys, data = keys[order], matrix.data[order]
+        wanted = rows.astype(np.int64) * n_cols + cols
+        found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        return np.where(keys[found] == wanted, data[found], 0).astype(np.int32)
+
+    def rows(self):
+        """Yield (source permalink, target permalink, shared companies, shared rounds or None) per pair."""
+        permalinks = self.graph.permalinks
+        for i, (a, b) in enumerate(self.pairs):
+            rounds = int(self.shared_rounds[i]) if self.shared_rounds is not None else None
+            yield permalinks[self.funders[a]], permalinks[self.funders[b]], int(self.shared_companies[i]), rounds
+
+    def top(self, k=20):
+        """The k pairs sharing the most companies."""
+        best = np.argsort(-self.shared_companies, kind='mergesort')[:k]
+        return [(self.graph.permalinks[self.funders[self.pairs[i, 0]]],
+                 self.graph.permalinks[self.funders[self.pairs[i, 1]]], int(self.shared_companies[i]))
+                for i in best]
+
+    def write_tab(self, out_file='coinvest_relations.tab'):
+        """Write pairs as a tab edge file (source, target, type, weight, ...) for Gephi."""
+        with open(out_file, 'wb') as fil:
+            writer = csv.writer(fil, dialect='excel-tab')
+            writer.writerow(['source', 'target', 'type', 'weight', 'shared_companies', 'shared_rounds'])
+            for source, target, companies, rounds in self.rows():
+                writer.writerow([source.encode('utf-8'), target.encode('utf-8'), 'Undirected', companies,
+                                 companies, '' if rounds is None else rounds])
+        print 'Co-investment pairs written to', out_file
+        return len(self.pairs)
+
+    def write_graph(self, out_file='coinvest_graph.gexf', layout=None):
+        """Write funders and pairs to an undirected GEXF or GraphML file, weight is shared companies.
+
+        :param dict layout: permalink -> (x, y), e.g. from ForceLayout.cached, written as x/y attributes
+        """
+        graph = self.graph
+        labels = graph.node_attributes.get('label')
+        node_attributes = [('type', 'string')] + ([('x', 'double'), ('y', 'double')] if layout is not None else [])
+        edge_attributes = [('shared_companies', 'int'), ('shared_rounds', 'int')]
+        with open_writer(out_file, node_attributes, edge_attributes, directed=False) as writer:
+            for node in self.funders:
+                label = graph.categories['label'][labels[node]] if labels is not None and labels[node] >= 0 \
+                    else None
+                position = layout.get(graph.permalinks[node]) if layout is not None else None
+                attributes = {'type': label}
+                if position is not None:
+                    attributes['x'], attributes['y'] = position
+                writer.add_node(graph.permalinks[node], graph.permalinks[node], attributes, position=position)
+            for source, target, companies, rounds in self.rows():
+                writer.add_edge(source, target, {'shared_companies': companies, 'shared_rounds': rounds},
+                                weight=companies)
+        return writer.n_nodes, writer.n_edges
+
+    def write_to_neo4j(self, graph_builder, rel_type='co_invested'):
+        """Create or update co_invested relationships between funders, see GraphBuilder.write_relationships."""
+        graph = self.graph
+        labels = graph.node_attributes['label']
+
+        def label(row):
+            code = labels[self.funders[row]]
+            return graph.categories['label'][code] if code >= 0 else None
+
+        relationships = ((label(a), graph.permalinks[self.funders[a]], label(b), graph.permalinks[self.funders[b]],
+                          [int(self.shared_companies[i]),
+                           int(self.shared_rounds[i]) if self.shared_rounds is not None else None])
+                         for i, (a, b) in enumerate(self.pairs))
+        return graph_builder.write_relationships(relationships, rel_type, ['shared_companies', 'shared_rounds'],
+                                                 name='co-investment')
@@ -0,0 +1,196 @@
+"""
+Name:       ColumnarExport.py
+Purpose:    Columnar node and edge tables for analytics. Nodes are stored as typed
+            columns (permalink, label, name, founded_year, total_money_raised, ...)
+            and edges as integer source/target index arrays with typed property
+            columns. Tables are saved as uncompressed .npz, which loads without
+            parsing, and optionally as Parquet when pyarrow is installed.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/11/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import re
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Integer columns use -1 for missing values, float columns use NaN
+MISSING_INT = -1
+
+_money_pattern = re.compile(r'^\D*?([\d.,]+)\s*([kmb]?)', re.I)
+_money_scale = {'': 1.0, 'k': 1e3, 'm': 1e6, 'b': 1e9}
+
+
+def money_to_float(text):
+    """Convert Crunchbase money strings such as '$1.2M' or '500k' to a float, NaN if not parseable."""
+    if text is None:
+        return np.nan
+    if isinstance(text, (int, long, float)):
+        return float(text)
+    match = _money_pattern.match(text)
+    if not match:
+        return np.nan
+    try:
+        return float(match.group(1).replace(',', '')) * _money_scale[match.group(2).lower()]
+    except ValueError:
+        return np.nan
+
+
+def to_int(value):
+    """Int value or MISSING_INT."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_INT
+
+
+def to_float(value):
+    """Float value or NaN."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class Categories(object):
+    """Maps category values (e.g. round_code) to small integer codes, None maps to -1."""
+
+    def __init__(self):
+        self.codes = dict()
+        self.values = []
+
+    def code(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def array(self):
+        return np.array(self.values, dtype=unicode)
+
+
+class ColumnarGraphWriter(object):
+    """Collects node and edge rows and saves them as columns.
+
+    Nodes are identified by any hashable key (e.g. Neo4j id), edges refer to
+    nodes by key and are stored as int32 indexes into the node columns.
+    """
+
+    def __init__(self):
+        self.index = dict()                 # node key -> row
+        self.permalinks = []
+        self.names = []
+        self.labels = Categories()
+        self.label_codes = []
+        self.founded_years = []
+        self.money_raised = []
+        self.category_codes = []
+        self.categories = Categories()
+        self.sources = []
+        self.targets = []
+        self.raised_amounts = []
+        self.funded_years = []
+        self.round_codes = []
+        self.rounds = Categories()
+        self.currency_codes = []
+        self.currencies = Categories()
+        self.n_skipped = 0
+
+    def add_node(self, key, permalink, label, name=None, founded_year=None, total_money_raised=None,
+                 category_code=None):
+        """Add a node row, return its index."""
+        row = self.index[key] = len(self.permalinks)
+        self.permalinks.append(permalink or u'')
+        self.names.append(name or u'')
+        self.label_codes.append(self.labels.code(label))
+        self.founded_years.append(to_int(founded_year))
+        self.money_raised.append(money_to_float(total_money_raised))
+        self.category_codes.append(self.categories.code(category_code))
+        return row
+
+    def add_edge(self, source_key, target_key, raised_amount=None, funded_year=None, round_code=None,
+                 raised_currency_code=None):
+        """Add an edge between two nodes already added, edges to unknown nodes are counted and skipped."""
+        source = self.index.get(source_key)
+        target = self.index.get(target_key)
+        if source is None or target is None:
+            self.n_skipped += 1
+            return
+        self.sources.append(source)
+        self.targets.append(target)
+        self.raised_amounts.append(to_float(raised_amount))
+        self.funded_years.append(to_int(funded_year))
+        self.round_codes.append(self.rounds.code(round_code))
+        self.currency_codes.append(self.currencies.code(raised_currency_code))
+
+    def columns(self):
+        """Return a dict of numpy arrays, node_* and edge_* columns plus *_categories lookups."""
+        return {'node_permalink': np.array(self.permalinks, dtype=unicode),
+                'node_name': np.array(self.names, dtype=unicode),
+                'node_label': np.array(self.label_codes, dtype=np.int8),
+                'node_label_categories': self.labels.array(),
+                'node_founded_year': np.array(self.founded_years, dtype=np.int16),
+                'node_total_money_raised': np.array(self.money_raised, dtype=np.float64),
+                'node_category_code': np.array(self.category_codes, dtype=np.int16),
+                'node_category_code_categories': self.categories.array(),
+                'edge_source': np.array(self.sources, dtype=np.int32),
+                'edge_target': np.array(self.targets, dtype=np.int32),
+                'edge_raised_amount': np.array(self.raised_amounts, dtype=np.float64),
+                'edge_funded_year': np.array(self.funded_years, dtype=np.int16),
+                'edge_round_code': np.array(self.round_codes, dtype=np.int16),
+                'edge_round_code_categories': self.rounds.array(),
+                'edge_raised_currency_code': np.array(self.currency_codes, dtype=np.int16),
+                'edge_raised_currency_code_categories': self.currencies.array()}
+
+    def save(self, out_file, parquet=False):
+        """Save columns to out_file (.npz), and to <out_file>_nodes/_edges.parquet if parquet is True.
+
+        :rtype dict: the columns saved
+        """
+        columns = self.columns()
+        np.savez(out_file, **columns)
+        print 'Columnar export: {} nodes, {} edges written to {} ({} edges skipped)'.format(
+            len(self.permalinks), len(self.sources), out_file, self.n_skipped)
+        if parquet:
+            save_parquet(columns, out_file.rsplit('.', 1)[0])
+        return columns
+
+
+def save_parquet(columns, prefix):
+    """Write node and edge columns to <prefix>_nodes.parquet and <prefix>_edges.parquet, categories as dictionaries."""
+    if pyarrow is None:
+        print 'pyarrow is not installed, Parquet files not written'
+        return
+    for kind in ('node', 'edge'):
+        names, arrays = [], []
+        for name in sorted(columns):
+            if not name.startswith(kind + '_') or name.endswith('_categories'):
+                continue
+            values = columns[name]
+            if name + '_categories' in columns:
+                values = pyarrow.DictionaryArray.from_arrays(
+                    pyarrow.array(values.astype(np.int32), mask=values < 0),
+                    pyarrow.array(columns[name + '_categories'].tolist()))
+            else:
+                values = pyarrow.array(values.tolist() if values.dtype.kind == 'U' else values)
+            names.append(name[len(kind) + 1:])
+            arrays.append(values)
+        pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, names), prefix + '_' + kind + 's.parquet')
+
+
+def load_columnar(npz_file):
+    """Load columns saved by ColumnarGraphWriter.save, return a dict of numpy arrays."""
+    data = np.load(npz_file)
+    try:
+        return dict((name, data[name]) for name in data.files)
+    finally:
+        data.close()
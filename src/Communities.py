@@ -0,0 +1,400 @@
+"""
+Name:       Communities.py
+Purpose:    Community detection over a CompactGraph: label propagation and
+            Louvain modularity optimization. Edge direction is ignored and the
+            funding and role relationships are combined into one weighted graph.
+            Louvain's local moving is vectorized over random groups of nodes,
+            as label propagation is, so it scales to the giant component.
+            Connected components are independent and are spread over a process
+            pool. A component of at least parallel_size nodes is run here with
+            each group of nodes split over the pool: the adjacency and the
+            community of each node are memory mapped from a temporary directory,
+            workers return the moves for their slice and the moves are applied
+            here before the next group. Node order and tie breaking come from a
+            seeded random state, so results repeat for the same seed whatever
+            the number of workers. Community ids can be written to a tab file
+            or to Neo4j, where export_funding_graph picks them up for Gephi.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/18/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import csv, os, shutil, tempfile, time
+import multiprocessing
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+def symmetric_matrix(graph, types=None, weight=None):
+    """Symmetric weighted CSR matrix of the graph, parallel edges summed, self loops dropped.
+
+    :param CompactGraph graph: graph
+    :param list types: relationship types used, all if None
+    :param str weight: edge attribute used as weight, None for 1.0 per edge
+    """
+    mask = graph.edge_type_mask(types) & (graph.sources != graph.targets)
+    edges = np.nonzero(mask)[0]
+    if weight is None:
+        weights = np.ones(len(edges))
+    else:
+        weights = np.nan_to_num(graph.edge_attributes[weight][edges].astype(np.float64))
+    rows = np.concatenate([graph.sources[edges], graph.targets[edges]])
+    cols = np.concatenate([graph.targets[edges], graph.sources[edges]])
+    return sparse.coo_matrix((np.concatenate([weights, weights]), (rows, cols)),
+                             shape=(graph.n_nodes, graph.n_nodes)).tocsr()
+
+
+# Arrays memory mapped by each worker, set by _run_slice
+_shared = dict()
+
+
+class _ChunkPool(object):
+    """Arrays read by the vectorized moves of a component, and the pool the moves of a group are split over.
+
+    Without a pool the arrays are used as they are. With one they are saved as .npy files in a
+    temporary directory that workers memory map, the state arrays (community or label of each node)
+    writable here so moves applied between groups are seen by the workers without copying.
+    """
+
+    def __init__(self, arrays, state=(), pool=None, workers=1, min_slice=1000):
+        self.pool = pool
+        self.workers = workers
+        self.min_slice = min_slice
+        self.directory = None
+        self.arrays = arrays
+        if pool is None:
+            return
+        self.directory = tempfile.mkdtemp(prefix='communities')
+        self.arrays = dict()
+        for name, array in arrays.iteritems():
+            np.save(os.path.join(self.directory, name + '.npy'), array)
+            self.arrays[name] = np.load(os.path.join(self.directory, name + '.npy'),
+                                        mmap_mode='r+' if name in state else 'r')
+
+    def map(self, function, nodes, *args):
+        """function(arrays, nodes, *args) -> tuple of arrays over nodes, in slices over the pool if there is one."""
+        if self.pool is None or len(nodes) < 2 * self.min_slice:
+            return function(self.arrays, nodes, *args)
+        slices = np.array_split(nodes, min(self.workers, len(nodes) // self.min_slice))
+        results = self.pool.map(_run_slice, [(function, self.directory, part, args) for part in slices], chunksize=1)
+        return tuple(np.concatenate(columns) for columns in zip(*results))
+
+    def close(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _run_slice(task):
+    """Run a vectorized move on a slice of a group of nodes, in a worker."""
+    function, directory, nodes, args = task
+    if _shared.get('directory') != directory:
+        _shared.clear()
+        for name in os.listdir(directory):
+            _shared[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode='r')
+        _shared['directory'] = directory
+    return function(_shared, nodes, *args)
+
+
+def split_components(matrix, min_size=3):
+    """Split a symmetric matrix into connected components.
+
+    :rtype tuple: component of each node, list of (node ids, local CSR matrix) for components of at
+                  least min_size nodes, largest first
+    """
+    n_components, component = csgraph.connected_components(matrix, directed=False)
+    sizes = np.bincount(component, minlength=n_components)
+    order = np.argsort(component, kind='mergesort')
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    local = np.empty(matrix.shape[0], dtype=np.int64)
+    local[order] = np.arange(matrix.shape[0]) - starts[component[order]]
+    coo = matrix.tocoo()
+    entry_component = component[coo.row]
+    entry_order = np.argsort(entry_component, kind='mergesort')
+    entry_starts = np.concatenate([[0], np.cumsum(np.bincount(entry_component, minlength=n_components))])
+    parts = []
+    for c in np.argsort(-sizes, kind='mergesort'):
+        if sizes[c] < min_size:
+            break
+        entries = entry_order[entry_starts[c]:entry_starts[c + 1]]
+        local_matrix = sparse.coo_matrix((coo.data[entries], (local[coo.row[entries]], local[coo.col[entries]])),
+                                         shape=(sizes[c], sizes[c])).tocsr()
+        parts.append((order[starts[c]:starts[c + 1]], local_matrix))
+    return component, parts
+
+
+def modularity(matrix, membership):
+    """Modularity of a membership over a symmetric weighted matrix."""
+    total = matrix.sum()
+    if total == 0:
+        return 0.0
+    degree = np.asarray(matrix.sum(axis=1)).ravel()
+    coo = matrix.tocoo()
+    inside = membership[coo.row] == membership[coo.col]
+    n_communities = membership.max() + 1
+    internal = np.bincount(membership[coo.row[inside]], weights=coo.data[inside], minlength=n_communities)
+    totals = np.bincount(membership, weights=degree, minlength=n_communities)
+    return float((internal / total - (totals / total) ** 2).sum())
+
+
+def label_propagation(matrix, seed=0, max_iter=100, n_chunks=4, pool=None, workers=1):
+    """Weighted label propagation, vectorized.
+
+    Nodes are split at random into n_chunks groups updated one after another, each
+    group all at once, which avoids the oscillation of fully synchronous updates on
+    bipartite graphs such as funder -> company. Ties keep the current label, then
+    go to the label with the lowest random rank.
+
+    :param csr_matrix matrix: symmetric weighted adjacency
+    :param Pool pool: process pool each group is split over, None to run in this process
+    :param int workers: processes in pool
+    :rtype ndarray: label of each node (not renumbered)
+    """
+    random = np.random.RandomState(seed)
+    n = matrix.shape[0]
+    rank = random.permutation(n)
+    chunk_of = random.randint(0, n_chunks, n)
+    degree = np.diff(matrix.indptr)
+    chunks = [np.nonzero((chunk_of == chunk) & (degree > 0))[0] for chunk in xrange(n_chunks)]
+    shared = _ChunkPool({'indptr': matrix.indptr, 'indices': matrix.indices, 'data': matrix.data,
+                         'labels': np.arange(n), 'rank': rank}, ['labels'], pool, workers)
+    try:
+        labels = shared.arrays['labels']
+        for iteration in xrange(max_iter):
+            changed = 0
+            for nodes in chunks:
+                if not len(nodes):
+                    continue
+                label_nodes, new_labels = shared.map(_best_labels, nodes)
+                changed += (labels[label_nodes] != new_labels).sum()
+                labels[label_nodes] = new_labels
+            if not changed:
+                break
+        return np.array(labels)
+    finally:
+        shared.close()
+
+
+def _best_labels(arrays, nodes):
+    """Label with the most neighbor weight for each of nodes, given the current labels.
+
+    :rtype tuple: nodes, their new labels
+    """
+    indptr, indices, data, labels, rank = [arrays[name] for name in ('indptr', 'indices', 'data', 'labels', 'rank')]
+    n = len(labels)
+    counts = indptr[nodes + 1] - indptr[nodes]
+    offsets = np.repeat(indptr[nodes] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    owner = np.repeat(nodes, counts)
+    neighbor_labels = labels[indices[offsets]]
+    # Total weight per (node, label)
+    keys = owner.astype(np.int64) * n + neighbor_labels
+    pair_keys, inverse = np.unique(keys, return_inverse=True)
+    weights = np.bincount(inverse, weights=data[offsets])
+    pair_nodes, pair_labels = pair_keys // n, pair_keys % n
+    current = (labels[pair_nodes] == pair_labels).astype(np.int8)
+    order = np.lexsort((rank[pair_labels], -current, -weights, pair_nodes))
+    first = np.concatenate([[True], pair_nodes[order][1:] != pair_nodes[order][:-1]])
+    best = order[first]
+    return pair_nodes[best], pair_labels[best]
+
+
+def louvain(matrix, seed=0, max_levels=20, min_gain=1e-7, pool=None, workers=1):
+    """Louvain modularity optimization: local moving of nodes then aggregation of communities.
+
+    :param csr_matrix matrix: symmetric weighted adjacency
+    :param Pool pool: process pool each group of local moving is split over, None to run in this process
+    :param int workers: processes in pool
+    :rtype ndarray: community of each node (not renumbered)
+    """
+    random = np.random.RandomState(seed)
+    membership = np.arange(matrix.shape[0])
+    current = matrix.tocsr()
+    total = current.sum()
+    if total == 0:
+        return membership
+    previous_quality = modularity(current, np.arange(current.shape[0]))
+    for level in xrange(max_levels):
+        communities = _local_moving(current, total, random, pool=pool, workers=workers)
+        communities = np.unique(communities, return_inverse=True)[1]
+        quality = modularity(current, communities)
+        if communities.max() + 1 == current.shape[0] or quality - previous_quality < min_gain:
+            break
+        previous_quality = quality
+        membership = communities[membership]
+        assign = sparse.coo_matrix((np.ones(len(communities)), (np.arange(len(communities)), communities)),
+                                   shape=(len(communities), communities.max() + 1)).tocsr()
+        current = (assign.T.dot(current).dot(assign)).tocsr()
+    return membership
+
+
+def _local_moving(matrix, total, random, n_chunks=8, max_sweeps=100, min_gain=1e-7, pool=None, workers=1):
+    """Move nodes to the neighboring community with the best modularity gain until modularity stops improving.
+
+    Vectorized like label_propagation: nodes are split at random into n_chunks groups moved
+    one after another, each group all at once using community totals from before the group.
+    Ties keep the current community, then go to the lowest community id. A sweep that lowers
+    modularity (nodes of one group moving into each other's communities) is undone and ends
+    the moving.
+    """
+    n = matrix.shape[0]
+    counts_all = np.diff(matrix.indptr)
+    degree = np.asarray(matrix.sum(axis=1)).ravel()
+    chunk_of = random.randint(0, n_chunks, n)
+    chunks = [np.nonzero((chunk_of == chunk) & (counts_all > 0))[0] for chunk in xrange(n_chunks)]
+    shared = _ChunkPool({'indptr': matrix.indptr, 'indices': matrix.indices, 'data': matrix.data, 'degree': degree,
+                         'community': np.arange(n), 'community_total': degree.copy()},
+                        ['community', 'community_total'], pool, workers)
+    try:
+        community, community_total = shared.arrays['community'], shared.arrays['community_total']
+        quality = modularity(matrix, community)
+        for sweep in xrange(max_sweeps):
+            previous = np.array(community)
+            previous_total = np.array(community_total)
+            moved = 0
+            for nodes in chunks:
+                if not len(nodes):
+                    continue
+                best_nodes, best_communities = shared.map(_best_moves, nodes, total)
+                if not len(best_nodes):
+                    continue
+                community_total -= np.bincount(community[best_nodes], weights=degree[best_nodes], minlength=n)
+                community_total += np.bincount(best_communities, weights=degree[best_nodes], minlength=n)
+                community[best_nodes] = best_communities
+                moved += len(best_nodes)
+            if not moved:
+                break
+            new_quality = modularity(matrix, community)
+            if new_quality < quality:
+                community[:], community_total[:] = previous, previous_total
+                break
+            if new_quality - quality < min_gain:
+                break
+            quality = new_quality
+        return np.array(community)
+    finally:
+        shared.close()
+
+
+def _best_moves(arrays, nodes, total):
+    """Neighboring community with the best modularity gain for each of nodes, given the current communities.
+
+    :rtype tuple: nodes that move, their new communities
+    """
+    indptr, indices, data, degree, community, community_total = \
+        [arrays[name] for name in ('indptr', 'indices', 'data', 'degree', 'community', 'community_total')]
+    n = len(community)
+    counts = indptr[nodes + 1] - indptr[nodes]
+    offsets = np.repeat(indptr[nodes] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    owner = np.repeat(nodes, counts)
+    neighbors = indices[offsets]
+    outside = neighbors != owner
+    # Link weight per (node, community), with a zero entry so staying is always a candidate
+    keys = np.concatenate([owner[outside].astype(np.int64) * n + community[neighbors[outside]],
+                           nodes.astype(np.int64) * n + community[nodes]])
+    pair_keys, inverse = np.unique(keys, return_inverse=True)
+    links = np.bincount(inverse, weights=np.concatenate([data[offsets][outside], np.zeros(len(nodes))]))
+    pair_nodes, pair_communities = pair_keys // n, pair_keys % n
+    node_degree = degree[pair_nodes]
+    current = pair_communities == community[pair_nodes]
+    others = community_total[pair_communities] - np.where(current, node_degree, 0.0)
+    gain = links - others * node_degree / total + np.where(current, 1e-12, 0.0)
+    # Pairs are sorted by node then community, so the first best pair of a node has the lowest id
+    starts = np.concatenate([[0], np.nonzero(pair_nodes[1:] != pair_nodes[:-1])[0] + 1])
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(pair_nodes))))
+    candidates = np.nonzero(gain >= np.maximum.reduceat(gain, starts)[group])[0]
+    best = candidates[np.concatenate([[True], group[candidates][1:] != group[candidates][:-1]])]
+    best_nodes, best_communities = pair_nodes[best], pair_communities[best]
+    move = best_communities != community[best_nodes]
+    return best_nodes[move], best_communities[move]
+
+
+def _detect(task, pool=None, workers=1):
+    """Run one algorithm on one component, in a worker of the process pool or here spread over it."""
+    method, matrix, seed = task
+    if method == 'louvain':
+        return louvain(matrix, seed, pool=pool, workers=workers)
+    return label_propagation(matrix, seed, pool=pool, workers=workers)
+
+
+class Communities(object):
+    """Community of every node of a CompactGraph."""
+
+    def __init__(self, graph, method='louvain', types=None, weight=None, seed=0, workers=1, parallel_size=20000):
+        """Detect communities.
+
+        :param CompactGraph graph: graph
+        :param str method: 'louvain' or 'label_propagation'
+        :param list types: relationship types used, all (funded and roles) if None
+        :param str weight: edge attribute used as weight, None for 1.0 per relationship
+        :param int seed: random seed, the same seed gives the same communities
+        :param int workers: processes used for the components and within the largest ones
+        :param int parallel_size: components of at least this many nodes are split over the workers
+        """
+        self.graph = graph
+        self.method = method
+        t0 = time.time()
+        matrix = symmetric_matrix(graph, types, weight)
+        component, parts = split_components(matrix)
+        tasks = [(method, local_matrix, seed) for nodes, local_matrix in parts]
+        if workers > 1 and tasks:
+            # Parts are largest first: the large ones one at a time split over the pool, the rest one per worker
+            n_large = sum(1 for nodes, local_matrix in parts if len(nodes) >= parallel_size)
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = [_detect(task, pool, workers) for task in tasks[:n_large]]
+                results += pool.map(_detect, tasks[n_large:], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_detect, tasks)
+        # Small components are communities, larger ones are offset so ids do not collide
+        raw = component.astype(np.int64) * graph.n_nodes
+        for (nodes, local_matrix), local_membership in zip(parts, results):
+            raw[nodes] += local_membership
+        self.membership = self.renumber(raw)
+        self.modularity = modularity(matrix, self.membership)
+        print 'Communities ({}): {} communities in {} components, modularity {:.4f}, {:.1f} s'.format(
+            method, self.membership.max() + 1 if graph.n_nodes else 0, component.max() + 1 if graph.n_nodes else 0,
+            self.modularity, time.time() - t0)
+
+    def renumber(self, raw):
+        """Community ids 0, 1, ... by decreasing size, ties by lowest node id."""
+        values, inverse = np.unique(raw, return_inverse=True)
+        sizes = np.bincount(inverse)
+        first = np.argsort(inverse, kind='mergesort')[np.concatenate([[0], np.cumsum(sizes)[:-1]])]
+        order = np.lexsort((first, -sizes))
+        new_id = np.empty(len(values), dtype=np.int32)
+        new_id[order] = np.arange(len(values), dtype=np.int32)
+        return new_id[inverse]
+
+    def sizes(self):
+        """Number of nodes in each community."""
+        return np.bincount(self.membership)
+
+    def members(self, community):
+        """Permalinks of the nodes in a community."""
+        return self.graph.permalinks[self.membership == community]
+
+    def rows(self):
+        """Yield (label, permalink, [community]) for every node."""
+        labels = self.graph.node_attributes.get('label')
+        for node in xrange(self.graph.n_nodes):
+            label = self.graph.categories['label'][labels[node]] if labels is not None and labels[node] >= 0 \
+                else None
+            yield label, self.graph.permalinks[node], [int(self.membership[node])]
+
+    def write_tab(self, out_file='communities.tab'):
+        """Write nodes, label and community to a tab file for Gephi."""
+        with open(out_file, 'wb') as fil:
+            writer = csv.writer(fil, dialect='excel-tab')
+            writer.writerow(['nodes', 'label', 'community'])
+            for label, permalink, values in self.rows():
+                writer.writerow([permalink.encode('utf-8'), label or ''] + values)
+        print 'Communities written to', out_file
+        return self.graph.n_nodes
+
+    def write_to_neo4j(self, graph_builder):
+        """Set community as a node property in Neo4j, included in export_funding_graph from then on."""
+        return graph_builder.write_node_properties(self.rows(), ['community'], name='communities')
@@ -0,0 +1,468 @@
+"""
+Name:       CompactGraph.py
+Purpose:    Array backed graph for the Crunchbase network. Nodes are interned to
+            integer ids with a permalink <-> id dictionary, adjacency is stored
+            as CSR (out edges) and CSC (in edges) index arrays, and node and edge
+            attributes are typed NumPy arrays. Much smaller than a networkx graph
+            holding Python dicts, and traversals run over NumPy arrays.
+
+            Can be built from the Gephi .tab exports, the JSON page files, the
+            columnar .npz export, or Neo4j, and converted to networkx on demand.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/12/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import csv, datetime, json, re
+import numpy as np
+
+from src.ColumnarExport import load_columnar, to_int, to_float, money_to_float, MISSING_INT
+from src.RoleClassifier import RoleClassifier
+
+# Relationship types in the Crunchbase graph, edge 'type' codes index this list
+default_edge_types = ['funded', 'Founder', 'CEO', 'VP', 'Adviser']
+
+_permalink_pattern = re.compile(r'"permalink":"([^"]*)"')
+
+
+def date_key(value):
+    """Sortable integer yyyymmdd for a date, MISSING_INT if the year is not known.
+
+    Accepts a funded_date string 'yyyy-m-d' as written by date_from_dictionary, a (year, month, day)
+    tuple, a date, a year, or an integer already in yyyymmdd form. An unknown month or day is 0,
+    so a partial date sorts first within its year or month.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.year * 10000 + value.month * 100 + value.day
+    if isinstance(value, basestring):
+        value = value.split('-')
+    if isinstance(value, (tuple, list)):
+        parts = [to_int(part) for part in value[:3]] + [0, 0]
+        if parts[0] <= 0:
+            return MISSING_INT
+        return parts[0] * 10000 + max(parts[1], 0) * 100 + max(parts[2], 0)
+    value = to_int(value)
+    if value <= 0:
+        return MISSING_INT
+    return value * 10000 if value < 10000 else value
+
+
+def compressed_index(keys, values, n):
+    """Sort values by keys into compressed sparse form.
+
+    :param ndarray keys: row of each entry, 0 <= key < n
+    :param ndarray values: value of each entry (e.g. the other endpoint)
+    :param int n: number of rows
+    :rtype tuple: ptr (n+1 int64), values sorted by key (int32), original position of each entry (int32)
+    """
+    order = np.argsort(keys, kind='mergesort')
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=ptr[1:])
+    return ptr, values[order].astype(np.int32), order.astype(np.int32)
+
+
+class CompactGraph(object):
+    """Directed multigraph with CSR/CSC adjacency and typed attribute arrays.
+
+    Node ids are 0..n_nodes-1, edge ids are 0..n_edges-1 in the order edges were given.
+    Categorical attributes (e.g. node 'label', edge 'type') are stored as integer codes,
+    the labels for the codes are in categories[name].
+    """
+
+    # Arrays making up the graph apart from the attributes, in the order adjacency is given to __init__
+    adjacency_names = ['out_ptr', 'out_nbr', 'out_edge', 'in_ptr', 'in_nbr', 'in_edge']
+
+    def __init__(self, permalinks, sources, targets, node_attributes=None, edge_attributes=None,
+                 categories=None, adjacency=None):
+        """Build adjacency from edge arrays.
+
+        :param list permalinks: permalink of each node, the position is the node id
+        :param ndarray sources: source node id of each edge
+        :param ndarray targets: target node id of each edge
+        :param dict node_attributes: name -> array with one value per node
+        :param dict edge_attributes: name -> array with one value per edge
+        :param dict categories: name -> array of labels for categorical codes
+        :param tuple adjacency: arrays named in adjacency_names (e.g. from a snapshot), built if None
+        """
+        self.permalinks = np.asarray(permalinks, dtype=unicode)
+        self.sources = np.asarray(sources, dtype=np.int32)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.node_attributes = node_attributes or dict()
+        self.edge_attributes = edge_attributes or dict()
+        self.categories = categories or dict()
+        self.metadata = dict()
+        self._index = None
+        self._undirected = None
+        if adjacency is None:
+            n = self.n_nodes
+            adjacency = compressed_index(self.sources, self.targets, n) + compressed_index(self.targets,
+                                                                                          self.sources, n)
+        self.out_ptr, self.out_nbr, self.out_edge, self.in_ptr, self.in_nbr, self.in_edge = adjacency
+
+    @property
+    def n_nodes(self):
+        return len(self.permalinks)
+
+    @property
+    def n_edges(self):
+        return len(self.sources)
+
+    @property
+    def index(self):
+        """Dictionary permalink -> node id, built on first use."""
+        if self._index is None:
+            self._index = dict((p, i) for i, p in enumerate(self.permalinks.tolist()))
+        return self._index
+
+    def node_id(self, permalink):
+        """Node id for a permalink, KeyError if it is not in the graph."""
+        return self.index[permalink]
+
+    def node_ids(self, permalinks):
+        """Array of node ids for a list of permalinks."""
+        index = self.index
+        return np.array([index[p] for p in permalinks], dtype=np.int32)
+
+    def successors(self, node):
+        """Node ids of out neighbors (one entry per edge)."""
+        return self.out_nbr[self.out_ptr[node]:self.out_ptr[node + 1]]
+
+    def predecessors(self, node):
+        """Node ids of in neighbors (one entry per edge)."""
+        return self.in_nbr[self.in_ptr[node]:self.in_ptr[node + 1]]
+
+    def out_degree(self):
+        return np.diff(self.out_ptr)
+
+    def in_degree(self):
+        return np.diff(self.in_ptr)
+
+    def degree(self):
+        return self.out_degree() + self.in_degree()
+
+    def category_code(self, name, value):
+        """Integer code of a categorical value, e.g. category_code('type', 'funded'), -1 if unknown."""
+        values = self.categories.get(name, np.array([], dtype=unicode)).tolist()
+        return values.index(value) if value in values else -1
+
+    def edge_type_mask(self, types=None):
+        """Boolean mask of edges whose 'type' is in types, all True if types is None."""
+        if types is None or 'type' not in self.edge_attributes:
+            return np.ones(self.n_edges, dtype=bool)
+        codes = [self.category_code('type', t) for t in types]
+        return np.in1d(self.edge_attributes['type'], codes)
+
+    def undirected(self, types=None):
+        """Undirected adjacency (ptr, neighbor, edge id), each edge appears in both directions.
+
+        :param list types: if given, only edges of these types are included
+        :rtype tuple:
+        """
+        if types is None and self._undirected is not None:
+            return self._undirected
+        edges = np.nonzero(self.edge_type_mask(types))[0].astype(np.int32)
+        keys = np.concatenate([self.sources[edges], self.targets[edges]])
+        nbrs = np.concatenate([self.targets[edges], self.sources[edges]])
+        ptr, nbr, order = compressed_index(keys, nbrs, self.n_nodes)
+        adjacency = (ptr, nbr, np.concatenate([edges, edges])[order])
+        if types is None:
+            self._undirected = adjacency
+        return adjacency
+
+    def simple_adjacency(self, types=None):
+        """Undirected adjacency with each neighbor once and no self loops, neighbors sorted.
+
+        :param list types: if given, only edges of these types are included
+        :rtype tuple: ptr (int64), neighbors (int32)
+        """
+        mask = self.edge_type_mask(types) & (self.sources != self.targets)
+        keys = np.concatenate([self.sources[mask], self.targets[mask]]).astype(np.int64)
+        nbrs = np.concatenate([self.targets[mask], self.sources[mask]])
+        pairs = np.unique(keys * self.n_nodes + nbrs)
+        ptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs // self.n_nodes, minlength=self.n_nodes), out=ptr[1:])
+        return ptr, (pairs % self.n_nodes).astype(np.int32)
+
+    def subgraph(self, nodes=None, edges=None):
+        """Return the CompactGraph induced by node ids, or formed by edge ids and their endpoints.
+
+        :param ndarray nodes: node ids to keep, with all edges among them
+        :param ndarray edges: edge ids to keep, nodes are their endpoints (ignored if nodes given)
+        :rtype CompactGraph:
+        """
+        if nodes is not None:
+            nodes = np.unique(np.asarray(nodes, dtype=np.int32))
+            keep = np.zeros(self.n_nodes, dtype=bool)
+            keep[nodes] = True
+            edges = np.nonzero(keep[self.sources] & keep[self.targets])[0]
+        else:
+            edges = np.asarray(edges, dtype=np.int32)
+            nodes = np.unique(np.concatenate([self.sources[edges], self.targets[edges]]))
+        new_id = np.empty(self.n_nodes, dtype=np.int32)
+        new_id[nodes] = np.arange(len(nodes), dtype=np.int32)
+        node_attributes = dict((name, values[nodes]) for name, values in self.node_attributes.iteritems())
+        edge_attributes = dict((name, values[edges]) for name, values in self.edge_attributes.iteritems())
+        return CompactGraph(self.permalinks[nodes], new_id[self.sources[edges]], new_id[self.targets[edges]],
+                            node_attributes, edge_attributes, dict(self.categories))
+
+    def _attribute_value(self, name, values, i):
+        value = values[i]
+        if name in self.categories:
+            return self.categories[name][value] if value >= 0 else None
+        return value.item() if hasattr(value, 'item') else value
+
+    def node_data(self, node):
+        """Dictionary of a node's attributes, categorical codes decoded."""
+        data = dict((name, self._attribute_value(name, values, node))
+                    for name, values in self.node_attributes.iteritems())
+        data['permalink'] = self.permalinks[node]
+        return data
+
+    def edge_data(self, edge):
+        """Dictionary of an edge's attributes with source and target permalinks, categorical codes decoded."""
+        data = dict((name, self._attribute_value(name, values, edge))
+                    for name, values in self.edge_attributes.iteritems())
+        data['source'] = self.permalinks[self.sources[edge]]
+        data['target'] = self.permalinks[self.targets[edge]]
+        return data
+
+    def to_networkx(self, nodes=None, multigraph=True):
+        """Convert to a networkx graph keyed on permalink, optionally only the subgraph induced by nodes.
+
+        :param ndarray nodes: node ids to include, all if None
+        :param bool multigraph: MultiDiGraph if True, otherwise DiGraph (parallel edges collapse)
+        :rtype networkx graph:
+        """
+        import networkx as nx
+        graph = self if nodes is None else self.subgraph(nodes=nodes)
+        nx_graph = nx.MultiDiGraph() if multigraph else nx.DiGraph()
+        for i in xrange(graph.n_nodes):
+            nx_graph.add_node(graph.permalinks[i], **graph.node_data(i))
+        for e in xrange(graph.n_edges):
+            data = graph.edge_data(e)
+            nx_graph.add_edge(data.pop('source'), data.pop('target'), **data)
+        return nx_graph
+
+    def nbytes(self):
+        """Bytes held in the graph's arrays."""
+        arrays = [self.permalinks, self.sources, self.targets, self.out_ptr, self.out_nbr, self.out_edge,
+                  self.in_ptr, self.in_nbr, self.in_edge]
+        arrays += self.node_attributes.values() + self.edge_attributes.values()
+        return sum(a.nbytes for a in arrays)
+
+    def __repr__(self):
+        return 'CompactGraph({} nodes, {} edges)'.format(self.n_nodes, self.n_edges)
+
+    # Builders
+
+    @classmethod
+    def from_columnar(cls, npz_file):
+        """Build from the .npz written by GraphBuilder.export_columnar (funded edges)."""
+        columns = load_columnar(npz_file)
+        categories = {'label': columns['node_label_categories'],
+                      'category_code': columns['node_category_code_categories'],
+                      'round_code': columns['edge_round_code_categories'],
+                      'raised_currency_code': columns['edge_raised_currency_code_categories'],
+                      'type': np.array(default_edge_types, dtype=unicode)}
+        node_attributes = {'label': columns['node_label'], 'name': columns['node_name'],
+                           'founded_year': columns['node_founded_year'],
+                           'total_money_raised': columns['node_total_money_raised'],
+                           'category_code': columns['node_category_code']}
+        n_edges = len(columns['edge_source'])
+        edge_attributes = {'type': np.zeros(n_edges, dtype=np.int8),
+                           'raised_amount': columns['edge_raised_amount'],
+                           'funded_year': columns['edge_funded_year'],
+                           'round_code': columns['edge_round_code'],
+                           'raised_currency_code': columns['edge_raised_currency_code']}
+        return cls(columns['node_permalink'], columns['edge_source'], columns['edge_target'],
+                   node_attributes, edge_attributes, categories)
+
+    @classmethod
+    def from_tab_files(cls, node_files, relation_files):
+        """Build from Gephi tab exports, e.g. person_nodes.tab and funded_relations.tab.
+
+        Node files need nodes (permalink) and label columns, and an id column when relation files
+        are keyed on node ids. Relation files need source and target, which may be node ids (the
+        default for GraphBuilder exports), permalinks, or the node representations of older exports.
+        """
+        builder = CompactGraphBuilder()
+        permalinks = dict()
+        for node_file in node_files:
+            with open(node_file, 'rb') as fil:
+                for row in csv.DictReader(fil, dialect='excel-tab'):
+                    permalink = row['nodes'].decode('utf-8')
+                    builder.add_node(permalink, row.get('label'), row.get('founded_year') or row.get('born_year'))
+                    if row.get('id'):
+                        permalinks[row['id']] = permalink
+        for relation_file in relation_files:
+            with open(relation_file, 'rb') as fil:
+                for row in csv.DictReader(fil, dialect='excel-tab'):
+                    source = permalinks.get(row['source']) or _tab_permalink(row['source'])
+                    target = permalinks.get(row['target']) or _tab_permalink(row['target'])
+                    builder.add_edge(source, target, row.get('type') or row.get('label') or 'funded',
+                                     row.get('raised_amount'), row.get('funded_year'), row.get('funded_date'))
+        return builder.build()
+
+    @classmethod
+    def from_page_files(cls, funder_file=None, person_file=None, company_file=None,
+                        role_classifier=None):
+        """Build from JSON page files (permalink -> Crunchbase document), as written by get_cb_info.py.
+
+        Investments become funded edges from the investor, relationships become role edges
+        from the person to the firm using RoleClassifier.
+        """
+        classifier = role_classifier or RoleClassifier()
+        builder = CompactGraphBuilder()
+        for label, page_file in (('funder', funder_file), ('person', person_file), ('company', company_file)):
+            if not page_file:
+                continue
+            with open(page_file, 'rb') as fil:
+                pages = json.load(fil)
+            for permalink, doc in pages.iteritems():
+                permalink = doc.get('permalink') or permalink
+                builder.add_node(permalink, label, founded_year=doc.get('founded_year') or doc.get('born_year'))
+                builder.add_page_edges(permalink, label, doc, classifier)
+        return builder.build()
+
+    @classmethod
+    def from_networkx(cls, nx_graph):
+        """Build from a networkx graph, e.g. one loaded by path_display.neo4j_to_networkx.
+
+        Nodes are identified by their permalink attribute if present, otherwise by the node key.
+        Edge types come from the type attribute (funded if missing).
+        """
+        builder = CompactGraphBuilder()
+        permalinks = dict()
+        for key, data in nx_graph.nodes_iter(data=True):
+            permalinks[key] = data.get('permalink') or unicode(key)
+            builder.add_node(permalinks[key], data.get('label') or data.get('type'), data.get('founded_year'))
+        for source, target, data in nx_graph.edges_iter(data=True):
+            builder.add_edge(permalinks[source], permalinks[target], data.get('type') or 'funded',
+                             data.get('raised_amount'), data.get('funded_year'), data.get('funded_date'))
+        return builder.build()
+
+    @classmethod
+    def from_neo4j(cls, graph, rel_types=None, limit=0):
+        """Build from Neo4j by streaming relationships with their endpoint permalinks and labels.
+
+        :param GraphDatabaseService graph: py2neo graph, e.g. a GraphBuilder
+        :param list rel_types: relationship types to load, all if None
+        :param int limit: if > 0, at most limit relationships
+        """
+        from py2neo import neo4j
+        builder = CompactGraphBuilder()
+        rel = '[r:' + '|'.join(rel_types) + ']' if rel_types else '[r]'
+        query_str = 'match (a)-' + rel + '->(b) return a.permalink, labels(a), type(r), b.permalink, labels(b), ' \
+                    'r.raised_amount, r.funded_year, r.funded_date'
+        if limit:
+            query_str += ' limit ' + str(limit)
+        n_skipped = 0
+        for record in neo4j.CypherQuery(graph, query_str + ';').stream():
+            source, source_labels, rel_type, target, target_labels, amount, year, date = record.values
+            # Endpoints without a permalink cannot be interned, skip the row before adding either node
+            if source is None or target is None:
+                n_skipped += 1
+                continue
+            builder.add_node(source, source_labels[0] if source_labels else None)
+            builder.add_node(target, target_labels[0] if target_labels else None)
+            builder.add_edge(source, target, rel_type, amount, year, date)
+        if n_skipped:
+            print 'Relationships skipped, endpoint without a permalink:', n_skipped
+        return builder.build()
+
+
+def _tab_permalink(value):
+    """Permalink from a tab export source/target column, either a permalink or a printed node."""
+    value = value.decode('utf-8')
+    if value.startswith('('):
+        match = _permalink_pattern.search(value.replace('""', '"'))
+        if match:
+            return match.group(1)
+    return value
+
+
+class CompactGraphBuilder(object):
+    """Interns permalinks and accumulates typed node and edge values, then builds a CompactGraph."""
+
+    def __init__(self, edge_types=default_edge_types):
+        self.index = dict()
+        self.permalinks = []
+        self.labels = []
+        self.label_codes = dict()
+        self.label_values = []
+        self.founded_years = []
+        self.sources = []
+        self.targets = []
+        self.types = []
+        self.type_codes = dict((t, i) for i, t in enumerate(edge_types))
+        self.edge_types = list(edge_types)
+        self.raised_amounts = []
+        self.funded_years = []
+        self.funded_dates = []
+
+    def _code(self, codes, values, value):
+        if value is None:
+            return -1
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def add_node(self, permalink, label=None, founded_year=None):
+        """Intern a node, return its id. Label and year are kept from the first time they are given."""
+        node = self.index.get(permalink)
+        if node is None:
+            node = self.index[permalink] = len(self.permalinks)
+            self.permalinks.append(permalink)
+            self.labels.append(-1)
+            self.founded_years.append(-1)
+        if label is not None and self.labels[node] < 0:
+            self.labels[node] = self._code(self.label_codes, self.label_values, label)
+        if founded_year is not None and self.founded_years[node] < 0:
+            self.founded_years[node] = to_int(founded_year)
+        return node
+
+    def add_edge(self, source, target, rel_type='funded', raised_amount=None, funded_year=None, funded_date=None):
+        """Add an edge between permalinks, nodes are interned if new. See date_key for funded_date."""
+        if not source or not target:
+            return
+        self.sources.append(self.add_node(source))
+        self.targets.append(self.add_node(target))
+        self.types.append(self._code(self.type_codes, self.edge_types, rel_type))
+        self.raised_amounts.append(to_float(raised_amount) if raised_amount != '' else np.nan)
+        self.funded_years.append(to_int(funded_year))
+        self.funded_dates.append(date_key(funded_year if funded_date in (None, '') else funded_date))
+
+    def add_page_edges(self, permalink, label, doc, classifier):
+        """Add funded and role edges from a Crunchbase document's investments and relationships."""
+        for investment in doc.get('investments') or []:
+            funding_round = investment.get('funding_round') or {}
+            company = funding_round.get('company') or {}
+            if company.get('permalink'):
+                self.add_node(company['permalink'], 'company')
+                self.add_edge(permalink, company['permalink'], 'funded', funding_round.get('raised_amount'),
+                              funding_round.get('funded_year'),
+                              (funding_round.get('funded_year'), funding_round.get('funded_month'),
+                               funding_round.get('funded_day')))
+        if label == 'person':
+            for relationship in doc.get('relationships') or []:
+                firm = relationship.get('firm') or {}
+                role = classifier.classify(relationship.get('title'))
+                if role and firm.get('permalink'):
+                    self.add_node(firm['permalink'], firm.get('type_of_entity') or 'company')
+                    self.add_edge(permalink, firm['permalink'], role)
+
+    def build(self):
+        """Return the CompactGraph."""
+        node_attributes = {'label': np.array(self.labels, dtype=np.int8),
+                           'founded_year': np.array(self.founded_years, dtype=np.int16)}
+        edge_attributes = {'type': np.array(self.types, dtype=np.int8),
+                           'raised_amount': np.array(self.raised_amounts, dtype=np.float64),
+                           'funded_year': np.array(self.funded_years, dtype=np.int16),
+                           'funded_date': np.array(self.funded_dates, dtype=np.int32)}
+        categories = {'label': np.array(self.label_values, dtype=unicode),
+                      'type': np.array(self.edge_types, dtype=unicode)}
+        return CompactGraph(self.permalinks, np.array(self.sources, dtype=np.int32),
+                            np.array(self.targets, dtype=np.int32), node_attributes, edge_attributes, categories)
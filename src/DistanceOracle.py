@@ -0,0 +1,201 @@
+"""
+Name:       DistanceOracle.py
+Purpose:    Landmark distance oracle for degrees of separation estimates. A few
+            well connected landmark nodes are chosen by degree or by a
+            centrality score, BFS hop distances from each landmark to every node
+            are stored as int16 arrays, and the distance between any two nodes is
+            bounded by the triangle inequality through the landmarks. Batches of
+            pairs are answered with array operations, microseconds per pair.
+            When the graph changes the distances are repaired from the changed
+            relationships instead of being rebuilt.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/20/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import time
+import numpy as np
+
+from src.PathFinder import expand
+
+# Distance stored for nodes a landmark cannot reach
+UNREACHABLE = np.iinfo(np.int16).max
+
+
+def bfs_distances(ptr, nbr, source):
+    """Hop distance from source to every node, UNREACHABLE where there is no path.
+
+    :rtype ndarray: int16 distances
+    """
+    distance = np.empty(len(ptr) - 1, dtype=np.int16)
+    distance.fill(UNREACHABLE)
+    distance[source] = 0
+    frontier = np.array([source], dtype=np.int32)
+    depth = 0
+    while len(frontier):
+        depth += 1
+        unused, to_nodes, unused = expand(ptr, nbr, nbr, frontier)
+        frontier = np.unique(to_nodes[distance[to_nodes] == UNREACHABLE])
+        distance[frontier] = depth
+    return distance
+
+
+def relax(ptr, nbr, distance, frontier):
+    """Lower distances after relationships were added, starting from nodes whose distance dropped.
+
+    :param ndarray distance: int16 distances from one landmark, updated in place
+    :param ndarray frontier: node ids whose distance is now lower
+    :rtype int: number of nodes whose distance changed
+    """
+    n_changed = 0
+    while len(frontier):
+        from_nodes, to_nodes, unused = expand(ptr, nbr, nbr, frontier)
+        candidate = distance[from_nodes].astype(np.int32) + 1
+        better = candidate < distance[to_nodes]
+        to_nodes, candidate = to_nodes[better], candidate[better]
+        order = np.lexsort((candidate, to_nodes))
+        to_nodes, candidate = to_nodes[order], candidate[order]
+        first = np.concatenate([[True], to_nodes[1:] != to_nodes[:-1]]) if len(to_nodes) else to_nodes.astype(bool)
+        frontier = to_nodes[first]
+        distance[frontier] = candidate[first]
+        n_changed += len(frontier)
+    return n_changed
+
+
+class DistanceOracle(object):
+    """Upper and lower hop distance bounds between nodes through landmark nodes, ignoring edge direction."""
+
+    def __init__(self, graph, n_landmarks=16, types=None, scores=None):
+        """Choose landmarks and compute their distance arrays.
+
+        :param CompactGraph graph: graph
+        :param int n_landmarks: number of landmarks
+        :param list types: relationship types followed, all if None
+        :param ndarray scores: node scores used to choose landmarks (e.g. PageRank or betweenness
+                               estimates), degree if None
+        """
+        self.types = types
+        self.n_landmarks = n_landmarks
+        self.set_graph(graph)
+        t0 = time.time()
+        self.landmarks = self.choose_landmarks(scores)
+        self.distances = np.vstack([bfs_distances(self.ptr, self.nbr, landmark) for landmark in self.landmarks]) \
+            if len(self.landmarks) else np.zeros((0, graph.n_nodes), dtype=np.int16)
+        print 'Distance oracle: {} landmarks over {} nodes, {:.1f} s'.format(len(self.landmarks), graph.n_nodes,
+                                                                             time.time() - t0)
+
+    def set_graph(self, graph):
+        self.graph = graph
+        self.ptr, self.nbr = graph.simple_adjacency(self.types)
+
+    def choose_landmarks(self, scores=None):
+        """Highest scoring nodes, skipping neighbors of landmarks already chosen so landmarks spread out."""
+        if scores is None:
+            scores = np.diff(self.ptr)
+        chosen, blocked = [], np.zeros(self.graph.n_nodes, dtype=bool)
+        for node in np.argsort(-np.asarray(scores), kind='mergesort'):
+            if len(chosen) >= self.n_landmarks or self.ptr[node + 1] == self.ptr[node]:
+                break
+            if blocked[node]:
+                continue
+            chosen.append(node)
+            blocked[self.nbr[self.ptr[node]:self.ptr[node + 1]]] = True
+        return np.array(chosen, dtype=np.int32)
+
+    def bounds_by_id(self, sources, targets):
+        """Lower and upper bounds for arrays of node id pairs.
+
+        Upper is -1 when no landmark reaches both nodes. Lower is the largest
+        difference of landmark distances, or -1 when one node is reachable from a landmark
+        that cannot reach the other, meaning the nodes are not connected.
+        :rtype tuple: lower, upper int32 arrays
+        """
+        sources, targets = np.atleast_1d(sources), np.atleast_1d(targets)
+        source_distance = self.distances[:, sources].astype(np.int32)
+        target_distance = self.distances[:, targets].astype(np.int32)
+        source_reached, target_reached = source_distance < UNREACHABLE, target_distance < UNREACHABLE
+        both = source_reached & target_reached
+        upper = np.where(both, source_distance + target_distance, np.iinfo(np.int32).max).min(axis=0) \
+            if len(self.landmarks) else np.zeros(len(sources), dtype=np.int32)
+        upper = np.where(both.any(axis=0), upper, -1)
+        lower = np.where(both, np.abs(source_distance - target_distance), 0).max(axis=0) \
+            if len(self.landmarks) else np.zeros(len(sources), dtype=np.int32)
+        lower = np.maximum(lower, (sources != targets).astype(np.int32))
+        lower = np.where(sources == targets, 0, lower)
+        upper = np.where(sources == targets, 0, upper)
+        disconnected = (source_reached != target_reached).any(axis=0)
+        lower[disconnected], upper[disconnected] = -1, -1
+        return lower.astype(np.int32), upper.astype(np.int32)
+
+    def bounds(self, source, targets):
+        """Hop distance bounds from one permalink to a list of permalinks.
+
+        :rtype list: (target, lower, upper), -1 for both if not connected, upper -1 if unknown
+        """
+        targets = list(targets)
+        target_ids = self.graph.node_ids(targets)
+        source_ids = np.empty(len(targets), dtype=np.int32)
+        source_ids.fill(self.graph.node_id(source))
+        lower, upper = self.bounds_by_id(source_ids, target_ids)
+        return zip(targets, lower.tolist(), upper.tolist())
+
+    def estimate(self, source, target):
+        """Upper bound on the hops between two permalinks (exact if either is a landmark), -1 if not known."""
+        return int(self.bounds_by_id(self.graph.node_id(source), self.graph.node_id(target))[1][0])
+
+    def update(self, graph):
+        """Bring the oracle up to date with a changed graph, keeping the same landmarks.
+
+        Nodes are matched by permalink. Distances are lowered from the endpoints of added
+        relationships, and only landmarks with a removed relationship on one of their shortest
+        path trees are recomputed.
+        :param CompactGraph graph: the changed graph
+        :rtype dict: counts of added and removed pairs, landmarks recomputed, and distances lowered
+        """
+        t0 = time.time()
+        old_graph, old_ptr, old_nbr = self.graph, self.ptr, self.nbr
+        new_id = np.array([graph.index.get(permalink, -1) for permalink in old_graph.permalinks.tolist()],
+                          dtype=np.int64)
+        self.set_graph(graph)
+        n = graph.n_nodes
+        # Distances in the new numbering, new nodes start unreachable
+        distances = np.empty((len(self.landmarks), n), dtype=np.int16)
+        distances.fill(UNREACHABLE)
+        kept = new_id >= 0
+        distances[:, new_id[kept]] = self.distances[:, kept]
+        landmarks = new_id[self.landmarks]
+        # Pairs of neighbors before and after, as keys in the new numbering
+        old_rows = np.repeat(np.arange(old_graph.n_nodes), np.diff(old_ptr))
+        old_keep = kept[old_rows] & kept[old_nbr]
+        old_keys = np.unique(new_id[old_rows[old_keep]] * n + new_id[old_nbr[old_keep]])
+        new_keys = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.ptr)) * n + self.nbr
+        added = new_keys[~np.in1d(new_keys, old_keys)]
+        removed = old_keys[~np.in1d(old_keys, new_keys)]
+        removed_a, removed_b = removed // n, removed % n
+        lost = ~kept
+        n_recomputed, n_lowered = 0, 0
+        for i, landmark in enumerate(landmarks):
+            distance = distances[i]
+            on_tree = np.abs(distance[removed_a].astype(np.int32) - distance[removed_b]) == 1
+            lost_reached = (self.distances[i, lost] < UNREACHABLE).any()
+            if landmark < 0 or on_tree.any() or lost_reached:
+                landmark = landmark if landmark >= 0 else self.choose_replacement(landmarks)
+                landmarks[i] = landmark
+                distances[i] = bfs_distances(self.ptr, self.nbr, landmark)
+                n_recomputed += 1
+            elif len(added):
+                n_lowered += relax(self.ptr, self.nbr, distance, np.unique(np.concatenate([added // n, added % n])))
+        self.landmarks = landmarks.astype(np.int32)
+        self.distances = distances
+        summary = {'added': len(added) // 2, 'removed': len(removed) // 2, 'recomputed': n_recomputed,
+                   'lowered': n_lowered}
+        print 'Distance oracle updated: {added} pairs added, {removed} removed, {recomputed} landmarks ' \
+              'recomputed, {lowered} distances lowered'.format(**summary), '{:.1f} s'.format(time.time() - t0)
+        return summary
+
+    def choose_replacement(self, landmarks):
+        """Highest degree node that is not already a landmark, for a landmark removed from the graph."""
+        degree = np.diff(self.ptr)
+        degree[landmarks[landmarks >= 0]] = -1
+        return int(np.argmax(degree))
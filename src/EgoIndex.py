@@ -0,0 +1,161 @@
+"""
+Name:       EgoIndex.py
+Purpose:    Precomputed neighborhoods for fast ego network extraction. For every
+            node the distinct 1 hop and 2 hop neighbors are stored as sorted
+            int32 arrays in compressed form, built in row blocks with a sparse
+            matrix product. Blocks are sized from a bound on each row's product
+            (degree plus the degrees of its neighbors), and rows whose bound is
+            too large are left out before the product. Larger radii are assembled from the 2 hop sets of
+            each frontier, two hops per step, so extracting an investor's or
+            founder's network never traverses the whole graph.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/15/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import time
+import numpy as np
+from scipy import sparse
+
+
+class EgoIndex(object):
+    """1 and 2 hop neighbor sets for every node of a CompactGraph, ignoring edge direction.
+
+    Nodes whose 2 hop set may be larger than max_two_hop (large funds and their
+    neighbors), judged by the sum of their and their neighbors' degrees, are not
+    stored, their 2 hop set is assembled from 1 hop sets when needed.
+    """
+
+    def __init__(self, graph, types=None, max_two_hop=100000, block_rows=50000, block_entries=20000000):
+        """Build the index.
+
+        :param CompactGraph graph: graph to index
+        :param list types: relationship types to follow, all if None
+        :param int max_two_hop: largest 2 hop set stored for a node, by its degree bound
+        :param int block_rows: most rows per block when computing 2 hop sets
+        :param int block_entries: most product entries per block, by the rows' degree bounds
+        :rtype EgoIndex:
+        """
+        self.graph = graph
+        self.types = types
+        self.max_two_hop = max_two_hop
+        t0 = time.time()
+        one_hop = self.adjacency_matrix()
+        self.ptr1, self.nbr1 = one_hop.indptr.astype(np.int64), one_hop.indices.astype(np.int32)
+        self.ptr2, self.nbr2, self.stored2 = self.two_hop(one_hop, block_rows, block_entries)
+        print 'Ego index: {} nodes, {} 1 hop and {} 2 hop entries, {} nodes not stored, {:.1f} s'.format(
+            graph.n_nodes, len(self.nbr1), len(self.nbr2), (~self.stored2).sum(), time.time() - t0)
+
+    def adjacency_matrix(self):
+        """Symmetric 0/1 CSR matrix of distinct neighbors, no self loops, sorted indices."""
+        ptr, nbr = self.graph.simple_adjacency(self.types)
+        n = self.graph.n_nodes
+        return sparse.csr_matrix((np.ones(len(nbr), dtype=np.int32), nbr, ptr), shape=(n, n))
+
+    def two_hop(self, one_hop, block_rows, block_entries=20000000):
+        """Compressed sorted sets of nodes within 2 hops (excluding the node itself).
+
+        A row of the product has at most degree + sum of neighbor degrees entries. Rows whose
+        bound exceeds max_two_hop are not stored and are left out of the product, and blocks
+        end where the bounds of their rows reach block_entries, so no block's product is large.
+
+        :rtype tuple: ptr, neighbors, and a bool array, False where the set was not stored
+        """
+        n = one_hop.shape[0]
+        degree = np.diff(one_hop.indptr).astype(np.int64)
+        bound = one_hop.dot(degree) + degree
+        stored = bound <= self.max_two_hop
+        cost = np.cumsum(np.where(stored, bound, 0))
+        counts = np.zeros(n, dtype=np.int64)
+        blocks = []
+        lo = 0
+        while lo < n:
+            start = cost[lo - 1] if lo else 0
+            hi = min(n, lo + block_rows, max(lo + 1, np.searchsorted(cost, start + block_entries, side='right')))
+            ids = lo + np.nonzero(stored[lo:hi])[0]
+            lo = hi
+            if not len(ids):
+                continue
+            rows = one_hop[ids]
+            within = (rows.dot(one_hop) + rows).tocoo()
+            keep = ids[within.row] != within.col
+            rows_kept, cols_kept = within.row[keep], within.col[keep]
+            order = np.lexsort((cols_kept, rows_kept))
+            blocks.append(cols_kept[order].astype(np.int32))
+            counts[ids] = np.bincount(rows_kept, minlength=len(ids))
+        ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=ptr[1:])
+        nbr = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int32)
+        return ptr, nbr, stored
+
+    def neighbors(self, node):
+        """Sorted distinct 1 hop neighbors of a node id."""
+        return self.nbr1[self.ptr1[node]:self.ptr1[node + 1]]
+
+    def within_two(self, node):
+        """Sorted distinct nodes within 2 hops of a node id, not including the node."""
+        if self.stored2[node]:
+            return self.nbr2[self.ptr2[node]:self.ptr2[node + 1]]
+        first = self.neighbors(node)
+        second = [self.neighbors(other) for other in first]
+        return np.setdiff1d(np.unique(np.concatenate([first] + second)), [node])
+
+    def _gather(self, nodes, two_hops):
+        """Union of the 1 or 2 hop sets of nodes."""
+        if two_hops:
+            sets = [self.within_two(node) for node in nodes]
+        else:
+            sets = [self.neighbors(node) for node in nodes]
+        if not sets:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(sets))
+
+    def ego_nodes(self, center, radius=2, max_nodes=0):
+        """Node ids within radius hops of center, including center, sorted.
+
+        :param str center: permalink of the center node
+        :param int radius: hops from center
+        :param int max_nodes: if > 0, stop growing once this many nodes are found and keep the
+                              highest degree nodes of the last ring
+        :rtype ndarray:
+        """
+        center = self.graph.node_id(center)
+        found = np.array([center], dtype=np.int32)
+        frontier = found
+        distance = 0
+        while distance < radius and len(frontier):
+            step = 2 if radius - distance >= 2 else 1
+            ring = np.setdiff1d(self._gather(frontier, step == 2), found)
+            if max_nodes and len(found) + len(ring) > max_nodes:
+                degree = self.ptr1[ring + 1] - self.ptr1[ring]
+                ring = np.sort(ring[np.argsort(-degree, kind='mergesort')[:max_nodes - len(found)]])
+                found = np.union1d(found, ring)
+                break
+            found = np.union1d(found, ring)
+            if step == 2:
+                # Next frontier is the nodes exactly two hops further out
+                frontier = np.setdiff1d(ring, self._gather(frontier, False))
+            else:
+                frontier = ring
+            distance += step
+        return found
+
+    def ego_graph(self, center, radius=2, max_nodes=0):
+        """CompactGraph induced by the ego network, see ego_nodes. Use to_networkx() for display.
+
+        Only relationships of the index's types are included.
+        """
+        nodes = self.ego_nodes(center, radius, max_nodes)
+        if self.types is None:
+            return self.graph.subgraph(nodes=nodes)
+        inside = np.zeros(self.graph.n_nodes, dtype=bool)
+        inside[nodes] = True
+        edges = inside[self.graph.sources] & inside[self.graph.targets] & self.graph.edge_type_mask(self.types)
+        if not edges.any():
+            return self.graph.subgraph(nodes=[self.graph.node_id(center)])
+        return self.graph.subgraph(edges=np.nonzero(edges)[0])
+
+    def nbytes(self):
+        """Bytes held in the index arrays."""
+        return sum(a.nbytes for a in (self.ptr1, self.nbr1, self.ptr2, self.nbr2, self.stored2))
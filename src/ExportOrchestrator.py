@@ -0,0 +1,90 @@
+"""
+Name:       ExportOrchestrator.py
+Purpose:    Runs GraphBuilder exports (per node label and per relationship type)
+            in parallel threads with a configurable number of workers and a
+            bounded pool of Neo4j connections, then prints one combined summary.
+            Exports spend most of their time waiting on Neo4j, so a full export
+            takes roughly as long as the largest single export.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/9/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import time
+import Queue
+from concurrent import futures
+
+from src.GraphBuilder import GraphBuilder
+
+# Default exports: name, GraphBuilder method, keyword arguments
+default_exports = [('person nodes', 'export_person_nodes_to_csv', {'out_file_name': 'person_nodes.tab'}),
+                   ('company nodes', 'export_company_node_to_csv', {'out_file_name': 'company_nodes.tab'}),
+                   ('financial nodes', 'export_financial_nodes_to_csv', {'out_file_name': 'financial_nodes.tab'}),
+                   ('funded relationships', 'export_funded_relationships_to_csv',
+                    {'out_file_name': 'funded_relations.tab'})]
+
+
+class ExportOrchestrator(object):
+    """Runs exports concurrently, each borrowing a GraphBuilder from a shared pool."""
+
+    def __init__(self, uri=GraphBuilder.neo4j_uri, workers=4, pool_size=None):
+        """Create the connection pool.
+
+        :param str uri: Neo4j URI
+        :param int workers: number of exports run at the same time
+        :param int pool_size: number of GraphBuilder connections, defaults to workers
+        :rtype ExportOrchestrator:
+        """
+        self.uri = uri
+        self.workers = workers
+        self.pool = Queue.Queue()
+        for i in xrange(pool_size or workers):
+            self.pool.put(GraphBuilder(uri))
+        self.results = []
+
+    def run_export(self, name, method_name, kwargs):
+        """Run one export with a pooled connection, return (name, rows, seconds)."""
+        graph = self.pool.get()
+        try:
+            t0 = time.time()
+            rows = getattr(graph, method_name)(**kwargs)
+            return name, rows, time.time() - t0
+        finally:
+            self.pool.put(graph)
+
+    def run(self, exports=None):
+        """Run exports in parallel, print progress as each finishes and a combined summary.
+
+        :param list exports: (name, GraphBuilder method name, kwargs) tuples, defaults to default_exports
+        :rtype list: (name, rows, seconds, error) for each export
+        """
+        if exports is None:
+            exports = default_exports
+        self.results = []
+        t0 = time.time()
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = dict((executor.submit(self.run_export, name, method_name, kwargs), name)
+                           for name, method_name, kwargs in exports)
+            for i, future in enumerate(futures.as_completed(running)):
+                name = running[future]
+                if future.exception() is not None:
+                    self.results.append((name, 0, 0.0, future.exception()))
+                    print 'Export {} of {}: {} failed: {}'.format(i + 1, len(running), name, future.exception())
+                else:
+                    name, rows, seconds = future.result()
+                    self.results.append((name, rows, seconds, None))
+                    print 'Export {} of {}: {} done, {} rows in {:.1f} s'.format(i + 1, len(running), name,
+                                                                                rows, seconds)
+        self.print_summary(time.time() - t0)
+        return self.results
+
+    def print_summary(self, wall_seconds):
+        """Print rows and time for each export, totals, and the time saved by running in parallel."""
+        print '\nExport summary ({} workers)'.format(self.workers)
+        for name, rows, seconds, error in sorted(self.results):
+            status = 'FAILED' if error is not None else ''
+            print '   {:<25} {:>10} rows {:>8.1f} s {}'.format(name, rows, seconds, status)
+        busy = sum(result[2] for result in self.results)
+        print '   Total {} rows, {:.1f} s elapsed, {:.1f} s if run one after another'.format(
+            sum(result[1] or 0 for result in self.results), wall_seconds, busy)
@@ -0,0 +1,257 @@
+"""
+Name:       ForceLayout.py
+Purpose:    Force directed layout of a CompactGraph for drawing large networks.
+            Node repulsion uses a Barnes-Hut quadtree built and walked with
+            NumPy, one tree level at a time for blocks of nodes, so a step
+            costs about n log n rather than the n^2 of the networkx layouts.
+            Attraction along relationships and gravity follow ForceAtlas2.
+            Layouts are seeded, can start from the coordinates of an earlier
+            snapshot (only new nodes need placing), and are cached on disk
+            keyed on the graph's contents so a graph is laid out once. The
+            coordinates are written as x/y node attributes (and GEXF viz
+            positions) in the Gephi exports.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/23/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import hashlib, json, os, time
+import numpy as np
+
+from src.GephiWriter import open_writer
+
+
+def quadtree(positions, masses, depth):
+    """Occupied cells of a quadtree at each level.
+
+    :param ndarray positions: n x 2 coordinates
+    :param ndarray masses: mass of each point
+    :param int depth: deepest level, level L has 2^L x 2^L cells
+    :rtype tuple: size of the root cell, list per level of (sorted occupied cell keys, cell of each
+                  point as an index into the keys, cell mass, cell center of mass, points in cell)
+    """
+    low = positions.min(axis=0)
+    span = float((positions.max(axis=0) - low).max()) * (1 + 1e-9) or 1.0
+    scaled = (positions - low) / span
+    levels = []
+    for level in xrange(depth + 1):
+        cells = 1 << level
+        ij = np.minimum((scaled * cells).astype(np.int64), cells - 1)
+        keys, inverse = np.unique(ij[:, 0] * cells + ij[:, 1], return_inverse=True)
+        mass = np.bincount(inverse, weights=masses)
+        center = np.column_stack([np.bincount(inverse, weights=masses * positions[:, 0]),
+                                  np.bincount(inverse, weights=masses * positions[:, 1])]) / mass[:, None]
+        levels.append((keys, inverse, mass, center, np.bincount(inverse)))
+    return span, levels
+
+
+def barnes_hut_repulsion(positions, masses, theta=1.0, depth=12, block_rows=20000, scaling=1.0):
+    """ForceAtlas2 repulsion scaling * m_i * m_j / d between all points, approximated with Barnes-Hut.
+
+    A cell is treated as one mass at its center when its size is less than theta times the
+    distance to it, otherwise its occupied children are visited at the next level. Cells at
+    the deepest level are always treated as one mass. A point's own mass is taken out of the
+    cells that contain it.
+
+    :param int block_rows: points walked through the tree together, bounds memory
+    :rtype ndarray: n x 2 forces
+    """
+    n = len(positions)
+    forces = np.zeros((n, 2))
+    if n < 2:
+        return forces
+    span, levels = quadtree(positions, masses, depth)
+    floor = (span * 1e-9) ** 2
+    for lo in xrange(0, n, block_rows):
+        points = np.arange(lo, min(lo + block_rows, n))
+        cells = np.zeros(len(points), dtype=np.int64)
+        for level in xrange(depth + 1):
+            keys, inverse, mass, center, count = levels[level]
+            own = inverse[points] == cells
+            point_mass = masses[points]
+            alone = own & (count[cells] == 1)
+            other_mass = np.where(alone, 0.0, np.where(own, mass[cells] - point_mass, mass[cells]))
+            weighted = center[cells] * mass[cells][:, None] - np.where(own, point_mass, 0.0)[:, None] * \
+                positions[points]
+            other_center = weighted / np.maximum(other_mass, 1e-300)[:, None]
+            delta = positions[points] - other_center
+            distance2 = np.maximum((delta * delta).sum(axis=1), floor)
+            size = span / (1 << level)
+            present = other_mass > 0
+            accept = present & ((size * size < theta * theta * distance2) | (count[cells] - own <= 1) |
+                                (level == depth))
+            strength = scaling * point_mass * other_mass / distance2
+            forces[:, 0] += np.bincount(points[accept], weights=(strength * delta[:, 0])[accept], minlength=n)
+            forces[:, 1] += np.bincount(points[accept], weights=(strength * delta[:, 1])[accept], minlength=n)
+            # Everything else is opened: pair each point with the occupied children of its cell
+            opened = present & ~accept
+            if level == depth or not opened.any():
+                break
+            points, cells = points[opened], keys[cells[opened]]
+            width = 1 << level
+            i, j = cells // width, cells % width
+            child_keys = levels[level + 1][0]
+            child_points, child_cells = [], []
+            for di in (0, 1):
+                for dj in (0, 1):
+                    wanted = (2 * i + di) * (2 * width) + 2 * j + dj
+                    found = np.minimum(np.searchsorted(child_keys, wanted), len(child_keys) - 1)
+                    hit = child_keys[found] == wanted
+                    child_points.append(points[hit])
+                    child_cells.append(found[hit])
+            points, cells = np.concatenate(child_points), np.concatenate(child_cells)
+    return forces
+
+
+def graph_digest(graph, types=None):
+    """Hex digest of a graph's nodes and the relationships of the given types, the layout cache key."""
+    digest = hashlib.sha1()
+    digest.update(u'\n'.join(graph.permalinks).encode('utf-8'))
+    mask = graph.edge_type_mask(types)
+    digest.update(np.ascontiguousarray(graph.sources[mask], dtype=np.int32).tostring())
+    digest.update(np.ascontiguousarray(graph.targets[mask], dtype=np.int32).tostring())
+    return digest.hexdigest()
+
+
+class ForceLayout(object):
+    """Seeded ForceAtlas2 style layout of a CompactGraph with Barnes-Hut repulsion."""
+
+    def __init__(self, graph, types=None, iterations=200, theta=1.0, scaling=2.0, gravity=1.0, seed=0,
+                 previous=None, fixed=False, block_rows=20000):
+        """Lay out the graph, edge direction and parallel edges are ignored.
+
+        :param CompactGraph graph: graph
+        :param list types: relationship types that attract, all if None
+        :param int iterations: layout steps
+        :param float theta: Barnes-Hut accuracy, smaller is more exact and slower
+        :param float scaling: repulsion strength, larger spreads the layout
+        :param float gravity: pull toward the origin, keeps components together
+        :param int seed: random seed for the starting positions
+        :param dict previous: permalink -> (x, y) from an earlier layout (e.g. of an earlier
+                              snapshot), those nodes start there and only new nodes are placed
+        :param bool fixed: if True nodes in previous do not move
+        :param int block_rows: nodes walked through the quadtree together
+        """
+        self.graph = graph
+        self.theta, self.scaling, self.gravity = theta, scaling, gravity
+        self.block_rows = block_rows
+        t0 = time.time()
+        ptr, nbr = graph.simple_adjacency(types)
+        rows = np.repeat(np.arange(graph.n_nodes, dtype=np.int32), np.diff(ptr))
+        upper = rows < nbr
+        self.edge_a, self.edge_b = rows[upper], nbr[upper]
+        self.masses = np.diff(ptr).astype(np.float64) + 1.0
+        random = np.random.RandomState(seed)
+        self.positions, known = self.initial_positions(previous, random)
+        self.movable = ~known if fixed else np.ones(graph.n_nodes, dtype=bool)
+        # Starting from a previous layout only needs refining, so start cooler
+        self.run(iterations, 0.02 if known.any() else 0.1)
+        print 'Force layout: {} nodes, {} edges, {} iterations, {} placed before, {:.1f} s'.format(
+            graph.n_nodes, len(self.edge_a), iterations, known.sum(), time.time() - t0)
+
+    def initial_positions(self, previous, random):
+        """Random positions, or previous positions with new nodes at the mean of placed neighbors.
+
+        :rtype tuple: n x 2 positions, mask of nodes taken from previous
+        """
+        n = self.graph.n_nodes
+        radius = np.sqrt(self.masses.sum())
+        positions = (random.rand(n, 2) - 0.5) * radius
+        known = np.zeros(n, dtype=bool)
+        if previous:
+            for node, permalink in enumerate(self.graph.permalinks):
+                xy = previous.get(permalink)
+                if xy is not None:
+                    positions[node] = xy
+                    known[node] = True
+            if known.any() and not known.all():
+                # New nodes next to their placed neighbors, jittered so they do not coincide
+                a = np.concatenate([self.edge_a, self.edge_b])
+                b = np.concatenate([self.edge_b, self.edge_a])
+                use = ~known[a] & known[b]
+                count = np.bincount(a[use], minlength=n)
+                sums = np.column_stack([np.bincount(a[use], weights=positions[b[use], 0], minlength=n),
+                                        np.bincount(a[use], weights=positions[b[use], 1], minlength=n)])
+                near = ~known & (count > 0)
+                scale = positions[known].std() or 1.0
+                positions[near] = sums[near] / count[near][:, None] + (random.rand(near.sum(), 2) - 0.5) * 0.05 * scale
+        return positions, known
+
+    def forces(self, positions):
+        """Repulsion, attraction along relationships, and gravity on every node."""
+        forces = barnes_hut_repulsion(positions, self.masses, self.theta, block_rows=self.block_rows,
+                                      scaling=self.scaling)
+        delta = positions[self.edge_b] - positions[self.edge_a]
+        n = len(positions)
+        for k in (0, 1):
+            forces[:, k] += np.bincount(self.edge_a, weights=delta[:, k], minlength=n)
+            forces[:, k] -= np.bincount(self.edge_b, weights=delta[:, k], minlength=n)
+        distance = np.sqrt((positions * positions).sum(axis=1))
+        forces -= (self.gravity * self.masses / np.maximum(distance, 1e-9))[:, None] * positions
+        return forces
+
+    def run(self, iterations, temperature=0.1):
+        """Move nodes along their forces divided by mass, step capped by a temperature that cools linearly.
+
+        :param float temperature: largest first step as a fraction of the layout's extent
+        """
+        if not self.graph.n_nodes:
+            return
+        for iteration in xrange(iterations):
+            extent = float((self.positions.max(axis=0) - self.positions.min(axis=0)).max()) or 1.0
+            cap = temperature * extent * (1.0 - iteration / float(iterations)) + 1e-3 * extent / iterations
+            step = self.forces(self.positions) / self.masses[:, None]
+            length = np.sqrt((step * step).sum(axis=1))
+            step *= (np.minimum(length, cap) / np.maximum(length, 1e-300))[:, None]
+            self.positions[self.movable] += step[self.movable]
+
+    def position_dict(self):
+        """Permalink -> (x, y)."""
+        return dict(zip(self.graph.permalinks.tolist(), map(tuple, self.positions.tolist())))
+
+    def write_graph(self, out_file='layout_graph.gexf'):
+        """Write the graph with x/y node attributes (and viz positions in GEXF) for Gephi."""
+        graph = self.graph
+        labels = graph.node_attributes.get('label')
+        types = graph.edge_attributes.get('type')
+        node_attributes = [('type', 'string'), ('x', 'double'), ('y', 'double')]
+        with open_writer(out_file, node_attributes, [('type', 'string')]) as writer:
+            for node in xrange(graph.n_nodes):
+                label = graph.categories['label'][labels[node]] if labels is not None and labels[node] >= 0 \
+                    else None
+                x, y = self.positions[node]
+                writer.add_node(graph.permalinks[node], graph.permalinks[node], {'type': label, 'x': x, 'y': y},
+                                position=(x, y))
+            for edge in xrange(graph.n_edges):
+                edge_type = graph.categories['type'][types[edge]] if types is not None and types[edge] >= 0 \
+                    else None
+                writer.add_edge(graph.permalinks[graph.sources[edge]], graph.permalinks[graph.targets[edge]],
+                                {'type': edge_type})
+        print 'Layout written to', out_file
+        return writer.n_nodes, writer.n_edges
+
+    # Cache
+
+    @classmethod
+    def cached(cls, graph, cache_dir='layout_cache', **kwargs):
+        """Positions (permalink -> (x, y)) for the graph, from the cache or laid out and cached.
+
+        The cache file is named for graph_digest and the layout arguments, so each snapshot is laid
+        out once. Pass previous (e.g. the cached positions of the prior snapshot) to lay out a new
+        snapshot incrementally.
+        """
+        previous = kwargs.pop('previous', None)
+        settings = json.dumps(sorted(kwargs.items()))
+        key = hashlib.sha1(graph_digest(graph, kwargs.get('types')) + settings).hexdigest()
+        cache_file = os.path.join(cache_dir, key + '.npz')
+        if os.path.exists(cache_file):
+            stored = np.load(cache_file)
+            print 'Layout read from', cache_file
+            return dict(zip(stored['permalinks'].tolist(), map(tuple, stored['positions'].tolist())))
+        layout = cls(graph, previous=previous, **kwargs)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        np.savez(cache_file, permalinks=np.asarray(graph.permalinks, dtype=unicode), positions=layout.positions,
+                 settings=np.array(settings))
+        return layout.position_dict()
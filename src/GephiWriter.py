@@ -0,0 +1,200 @@
+"""
+Name:       GephiWriter.py
+Purpose:    Streaming GEXF and GraphML writers so a graph can be imported into
+            Gephi directly instead of through separate node and edge tab files.
+            Nodes and edges are written as they arrive, so memory does not grow
+            with the size of the graph. Attributes are declared once, and GEXF
+            edges may carry a start time (e.g. funded_year) for Gephi's timeline.
+            Nodes may carry a layout position (viz:position in GEXF).
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/8/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+# Attribute type names accepted by the writers, and their GEXF and GraphML equivalents
+gexf_types = {'string': 'string', 'int': 'integer', 'integer': 'integer', 'long': 'long', 'float': 'float',
+              'double': 'double', 'boolean': 'boolean'}
+graphml_types = {'string': 'string', 'int': 'int', 'integer': 'int', 'long': 'long', 'float': 'float',
+                 'double': 'double', 'boolean': 'boolean'}
+
+
+def _text(value):
+    """Unicode representation of an attribute value, booleans in lower case."""
+    if isinstance(value, bool):
+        return u'true' if value else u'false'
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return unicode(value)
+
+
+class GraphStreamWriter(object):
+    """Base class for writers, handles the file and attribute declarations.
+
+    Use as a context manager or call close() when done.
+    """
+
+    def __init__(self, out_file, node_attributes=(), edge_attributes=(), directed=True):
+        """Open out_file and write the header and attribute declarations.
+
+        :param str out_file: output file name
+        :param list node_attributes: (name, type) pairs for node attributes
+        :param list edge_attributes: (name, type) pairs for edge attributes
+        :param bool directed: if True edges are directed
+        """
+        self.fil = open(out_file, 'wb')
+        self.node_attributes = list(node_attributes)
+        self.edge_attributes = list(edge_attributes)
+        self.directed = directed
+        self.n_nodes = 0
+        self.n_edges = 0
+        self.write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, text):
+        self.fil.write(text.encode('utf-8'))
+
+    def attribute_values(self, attributes, declared):
+        """Yield (index, name, text) for declared attributes present in the attributes dict."""
+        for i, (name, atype) in enumerate(declared):
+            value = attributes.get(name)
+            if value is not None:
+                yield i, name, _text(value)
+
+    def close(self):
+        """Write the footer and close the file."""
+        if self.fil is not None:
+            self.write_footer()
+            self.fil.close()
+            self.fil = None
+            print 'Wrote {} nodes and {} edges'.format(self.n_nodes, self.n_edges)
+
+
+class GexfWriter(GraphStreamWriter):
+    """Streaming GEXF 1.2 writer.
+
+    All nodes must be added before the first edge. When dynamic is True the
+    graph is written in dynamic mode and edges added with a start (e.g. the
+    funded_year) appear from that time on in Gephi's timeline.
+    """
+
+    def __init__(self, out_file, node_attributes=(), edge_attributes=(), directed=True, dynamic=False):
+        self.dynamic = dynamic
+        self.in_edges = False
+        super(GexfWriter, self).__init__(out_file, node_attributes, edge_attributes, directed)
+
+    def write_header(self):
+        mode = u'mode="dynamic" timeformat="double"' if self.dynamic else u'mode="static"'
+        edge_type = 'directed' if self.directed else 'undirected'
+        self.write(u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                   u'<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:viz="http://www.gexf.net/1.2draft/viz" '
+                   u'version="1.2">\n'
+                   u'<graph {} defaultedgetype="{}">\n'.format(mode, edge_type))
+        for cls, declared in (('node', self.node_attributes), ('edge', self.edge_attributes)):
+            if declared:
+                mode = 'dynamic' if self.dynamic and cls == 'edge' else 'static'
+                self.write(u'<attributes class="{}" mode="{}">\n'.format(cls, mode))
+                for i, (name, atype) in enumerate(declared):
+                    self.write(u'<attribute id="{}" title={} type="{}"/>\n'.format(i, quoteattr(name), gexf_types[atype]))
+                self.write(u'</attributes>\n')
+        self.write(u'<nodes>\n')
+
+    def _attvalues(self, attributes, declared, start=None):
+        span = u'' if start is None else u' start="{}"'.format(start)
+        values = [u'<attvalue for="{}" value={}{}/>'.format(i, quoteattr(text), span)
+                  for i, name, text in self.attribute_values(attributes, declared)]
+        if values:
+            return u'<attvalues>' + u''.join(values) + u'</attvalues>'
+        return u''
+
+    def add_node(self, node_id, label='', attributes={}, position=None):
+        """Write a node, must be called before any add_edge. Position (x, y) is written as viz:position."""
+        if self.in_edges:
+            raise ValueError('GEXF nodes must be written before edges')
+        viz = u'' if position is None else u'<viz:position x="{}" y="{}" z="0.0"/>'.format(
+            float(position[0]), float(position[1]))
+        self.write(u'<node id={} label={}>{}{}</node>\n'.format(
+            quoteattr(_text(node_id)), quoteattr(_text(label)), self._attvalues(attributes, self.node_attributes),
+            viz))
+        self.n_nodes += 1
+
+    def add_edge(self, source, target, attributes={}, edge_id=None, weight=None, start=None):
+        """Write an edge, start (e.g. funded_year) is used only in dynamic mode."""
+        if not self.in_edges:
+            self.write(u'</nodes>\n<edges>\n')
+            self.in_edges = True
+        if edge_id is None:
+            edge_id = self.n_edges
+        extra = u''
+        if weight is not None:
+            extra += u' weight="{}"'.format(float(weight))
+        if not self.dynamic:
+            start = None
+        if start is not None:
+            extra += u' start="{}"'.format(start)
+        self.write(u'<edge id={} source={} target={}{}>{}</edge>\n'.format(
+            quoteattr(_text(edge_id)), quoteattr(_text(source)), quoteattr(_text(target)), extra,
+            self._attvalues(attributes, self.edge_attributes, start)))
+        self.n_edges += 1
+
+    def write_footer(self):
+        if not self.in_edges:
+            self.write(u'</nodes>\n<edges>\n')
+        self.write(u'</edges>\n</graph>\n</gexf>\n')
+
+
+class GraphMLWriter(GraphStreamWriter):
+    """Streaming GraphML writer, nodes and edges may be written in any order."""
+
+    def write_header(self):
+        self.write(u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                   u'<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        for cls, declared in (('node', self.node_attributes), ('edge', self.edge_attributes)):
+            for i, (name, atype) in enumerate(declared):
+                self.write(u'<key id="{}{}" for="{}" attr.name={} attr.type="{}"/>\n'.format(
+                    cls[0], i, cls, quoteattr(name), graphml_types[atype]))
+        self.write(u'<graph edgedefault="{}">\n'.format('directed' if self.directed else 'undirected'))
+
+    def _data(self, prefix, attributes, declared):
+        return u''.join(u'<data key="{}{}">{}</data>'.format(prefix, i, escape(text))
+                        for i, name, text in self.attribute_values(attributes, declared))
+
+    def add_node(self, node_id, label='', attributes={}, position=None):
+        """Write a node, label and position (x, y) are written as the label, x and y attributes if declared."""
+        if label and 'label' not in attributes:
+            attributes = dict(attributes, label=label)
+        if position is not None and 'x' not in attributes:
+            attributes = dict(attributes, x=position[0], y=position[1])
+        self.write(u'<node id={}>{}</node>\n'.format(quoteattr(_text(node_id)),
+                                                    self._data('n', attributes, self.node_attributes)))
+        self.n_nodes += 1
+
+    def add_edge(self, source, target, attributes={}, edge_id=None, weight=None, start=None):
+        """Write an edge, weight is written as the weight attribute if declared, start is ignored."""
+        if edge_id is None:
+            edge_id = self.n_edges
+        if weight is not None and 'weight' not in attributes:
+            attributes = dict(attributes, weight=weight)
+        self.write(u'<edge id={} source={} target={}>{}</edge>\n'.format(
+            quoteattr(_text(edge_id)), quoteattr(_text(source)), quoteattr(_text(target)),
+            self._data('e', attributes, self.edge_attributes)))
+        self.n_edges += 1
+
+    def write_footer(self):
+        self.write(u'</graph>\n</graphml>\n')
+
+
+def open_writer(out_file, node_attributes=(), edge_attributes=(), directed=True, dynamic=False):
+    """Return a GexfWriter or GraphMLWriter depending on the extension of out_file."""
+    if out_file.lower().endswith('.graphml'):
+        return GraphMLWriter(out_file, node_attributes, edge_attributes, directed)
+    return GexfWriter(out_file, node_attributes, edge_attributes, directed, dynamic)
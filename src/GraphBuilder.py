@@ -9,10 +9,16 @@ Licence:    Apache License, Version 2.0
 """
 
 
-import copy, csv, uuid, re
+import copy, csv, uuid, re, os, time
 import json
-import networkx as nx
-import matplotlib.pyplot as plt
+from py2neo import neo4j
+from pymongo import MongoClient
+from py2neo.neo4j import CypherQuery
+from src.PropertyCleanser import PropertyCleanser
+from src.RoleClassifier import RoleClassifier
+from src.BatchWriter import BatchWriter
+from src.GephiWriter import open_writer
+from src.ColumnarExport import ColumnarGraphWriter
 
 
 class GraphBuilder(neo4j.GraphDatabaseService):
@@ -25,6 +31,32 @@ class GraphBuilder(neo4j.GraphDatabaseService):
                             'tag_list', 'offices', 'partners', 'products', 'screenshots', 'competitions',
                             'acquisitions', 'acquisition', 'ipo',  'available_sizes']
 
+    # Keys of funding round and relationship dictionaries moved to the endpoints or into funded_date
+    nested_properties_to_delete = ['company', 'funded_month', 'funded_day', 'firm', 'person']
+
+    # Property schemas are compiled once and shared by all writers
+    cleanser = PropertyCleanser(drop=properties_to_delete + nested_properties_to_delete)
+
+    # Classifies person to company titles into relationship types, see set_role_classifier
+    role_classifier = RoleClassifier()
+
+    # Schema created by ensure_schema, a uniqueness constraint also indexes its property
+    unique_properties = {'funder': 'permalink', 'person': 'permalink', 'company': 'permalink'}
+    indexed_properties = {'funder': ['name'], 'company': ['name'], 'person': ['last_name']}
+    _schema_ready = False
+
+    # Initial size and limits for write batches, see new_batch
+    batch_ops = 500
+    batch_max_bytes = 2000000
+    batch_target_seconds = 2.0
+
+    # Sequence stamped as load_seq on nodes and relationships written by the current load, see start_load
+    load_seq = 0
+
+    # Properties identifying a relationship between the same two nodes, see relate_query. Types not
+    # listed are identified by their endpoints and type alone.
+    relationship_keys = {'funded': ['round_code', 'funded_date']}
+
     # Cypher Query
     def CypherQuery(self, cypher):
         """Returns a CypherQuery."""
@@ -32,6 +64,145 @@ class GraphBuilder(neo4j.GraphDatabaseService):
 
     # TODO: add acquisition and ipo to graphs
 
+    def new_batch(self, name=''):
+        """Return a BatchWriter that submits on operation count or payload size and adapts its size."""
+        return BatchWriter(self, name=name, target_ops=self.batch_ops, max_bytes=self.batch_max_bytes,
+                           target_seconds=self.batch_target_seconds)
+
+    def next_load_seq(self):
+        """Return a new load sequence, milliseconds since the epoch so it increases across runs."""
+        return int(time.time() * 1000)
+
+    def start_load(self):
+        """Start a load, nodes and relationships written from now on are stamped with a new load_seq."""
+        self.load_seq = self.next_load_seq()
+        return self.load_seq
+
+    def ensure_schema(self):
+        """Create uniqueness constraints and property indexes that do not already exist.
+
+        Safe to call repeatedly, node lookups and merges rely on these schema indexes.
+        py2neo 1.6 Schema only manages plain indexes, so constraints are created with Cypher.
+        A constraint's index is listed by get_indexed_property_keys, so an indexed key is skipped.
+        :rtype None:
+        """
+        n_created = 0
+        for label, key in self.unique_properties.iteritems():
+            if key not in self.schema.get_indexed_property_keys(label):
+                cypher = 'CREATE CONSTRAINT ON (n:' + label + ') ASSERT n.' + key + ' IS UNIQUE'
+                self.CypherQuery(cypher).execute()
+                n_created += 1
+        for label, keys in self.indexed_properties.iteritems():
+            existing = self.schema.get_indexed_property_keys(label)
+            for key in keys:
+                if key not in existing:
+                    self.schema.create_index(label, key)
+                    n_created += 1
+        self._schema_ready = True
+        print 'Schema ready, {} constraints or indexes created'.format(n_created)
+
+    def find_node(self, label, permalink):
+        """Return the node with label and permalink using the schema index, None if not found."""
+        for anode in self.find(label, 'permalink', permalink):
+            return anode
+        return None
+
+    def merge_query(self, label):
+        """Cypher merging a node on label and permalink, properties are set only on creation."""
+        return 'MERGE (n:' + label + ' {permalink: {permalink}}) ON CREATE SET n = {properties} RETURN n'
+
+    def merge_node(self, label, permalink, properties):
+        """Get or create the node with label and permalink, return it.
+
+        :param str label: node label (funder, person, or company)
+        :param str permalink: permalink, unique within label
+        :param dict properties: properties used if the node is created
+        :rtype Node:
+        """
+        properties['permalink'] = permalink
+        properties['load_seq'] = self.load_seq
+        return self.CypherQuery(self.merge_query(label)).execute_one(permalink=permalink, properties=properties)
+
+    def set_properties_query(self, label, fields):
+        """Cypher setting fields (parameters of the same names) and load_seq on the node with label and permalink."""
+        return 'MATCH (n:' + label + ' {permalink: {permalink}}) SET ' + \
+               ', '.join('n.' + field + ' = {' + field + '}' for field in fields) + ', n.load_seq = {seq}'
+
+    def write_node_properties(self, rows, fields, name='node properties'):
+        """Set computed properties (e.g. scores from analytics) on existing nodes, return the number of rows.
+
+        Nodes are stamped with load_seq like those from a load, so export_changes picks the new values up.
+        :param iterable rows: (label, permalink, [values in fields order]) tuples, rows without a label are skipped
+        :param list fields: property names
+        :param str name: name used in batch status messages
+        :rtype int:
+        """
+        if not self._schema_ready:
+            self.ensure_schema()
+        self.start_load()
+        batch = self.new_batch(name)
+        n_rows = 0
+        for label, permalink, values in rows:
+            if not label or not permalink:
+                continue
+            params = dict(zip(fields, values))
+            params['permalink'] = permalink
+            params['seq'] = self.load_seq
+            batch.append_cypher(self.set_properties_query(label, fields), params)
+            n_rows += 1
+        batch.close()
+        return n_rows
+
+    def write_relationships(self, rows, rel_type, fields, name='relationships'):
+        """Create or update relationships between existing nodes (e.g. from analytics), return the number of rows.
+
+        Relationships are stamped with load_seq like those from a load.
+        :param iterable rows: (source label, source permalink, target label, target permalink, [values in fields
+                              order]) tuples, rows missing a label are skipped
+        :param str rel_type: relationship type
+        :param list fields: relationship property names
+        :param str name: name used in batch status messages
+        :rtype int:
+        """
+        if not self._schema_ready:
+            self.ensure_schema()
+        self.start_load()
+        batch = self.new_batch(name)
+        n_rows = 0
+        for source_label, source, target_label, target, values in rows:
+            if not source_label or not target_label:
+                continue
+            query_str = 'MATCH (a:' + source_label + ' {permalink: {a}}), (b:' + target_label + \
+                        ' {permalink: {b}}) CREATE UNIQUE (a)-[r:' + rel_type + ']->(b) SET ' + \
+                        ', '.join('r.' + field + ' = {' + field + '}' for field in fields) + ', r.load_seq = {seq}'
+            params = dict(zip(fields, values))
+            params.update({'a': source, 'b': target, 'seq': self.load_seq})
+            batch.append_cypher(query_str, params)
+            n_rows += 1
+        batch.close()
+        return n_rows
+
+    def relate_query(self, rel_type):
+        """Cypher getting or creating a relationship between two node ids, then setting its properties and load_seq.
+
+        The unique match uses only the identifying properties in relationship_keys, so a reload with changed
+        properties (e.g. raised_amount) updates the relationship rather than creating a second one.
+        """
+        keys = self.relationship_keys.get(rel_type, [])
+        match = ' {' + ', '.join(key + ': {' + key + '}' for key in keys) + '}' if keys else ''
+        return 'START a=node({a}), b=node({b}) CREATE UNIQUE (a)-[r:' + rel_type + match + \
+               ']->(b) SET r += {properties}, r.load_seq = {seq}'
+
+    def add_relationship_to_batch(self, batch, source_node, rel_type, properties, target_node):
+        """Add get or create of a relationship, stamped with load_seq, to the batch.
+
+        Identifying properties missing from properties are matched as '', since Cypher cannot match on null.
+        """
+        params = {'a': source_node._id, 'b': target_node._id, 'properties': properties, 'seq': self.load_seq}
+        for key in self.relationship_keys.get(rel_type, []):
+            params[key] = properties.get(key, '')
+        return batch.append_cypher(self.relate_query(rel_type), params)
+
     def get_collection(self, db_name, collection_name, host='localhost', port=27017):
         """Given database and collection names returns a MongoDB collection.
 
@@ -55,21 +226,21 @@ class GraphBuilder(neo4j.GraphDatabaseService):
         :param int limit: if > 0, only limit records are added to the graph
         :rtype None:
         """
+        if not self._schema_ready:
+            self.ensure_schema()
+        self.start_load()
         c = self.get_collection(db_name, collection_name)
         cur = c.find(limit=limit)
 
-        # Create a write batch to add nodes to
-        batch = neo4j.WriteBatch(self)
+        # Create a write batch to add nodes to, it submits itself as it fills
+        batch = self.new_batch(label + ' nodes')
 
         # Iterate over all records in the collection and add corresponding node
         for i, d in enumerate(cur):
-            anode = self.get_or_add_node_to_batch(d, label_index=label, batch=batch, stub='False')
-            if (i % 100) == 0:
-                batch.submit()
-                batch = neo4j.WriteBatch(self)
-                print 'add_node_collection_to_graph', label, i, self.order
-        batch.submit()
-        #return anode
+            self.get_or_add_node_to_batch(d, label_index=label, batch=batch, stub='False', create=False)
+            if (i % 1000) == 0:
+                print 'add_node_collection_to_graph', label, i
+        batch.close()
 
     def get_permalink(self, adict):
         """Given a node or edge dictionary, tries to get or build the permalink, if not returns uuid."""
@@ -89,8 +260,8 @@ class GraphBuilder(neo4j.GraphDatabaseService):
           so visited is set to False.
 
         :param dict node_dict: dictionary of properties
-        :param str label_index: label for node and index used
-        :param BatchObject batch: BatchObject being constructed
+        :param str label_index: label for node, its permalink has a uniqueness constraint
+        :param BatchWriter batch: BatchWriter being constructed
         :param str stub: 'True' if being created without full properties (i.e., as part of a relationship),
                         otherwise 'False'
         :param bool create: if true the node is created immediately, otherwise it is added to the batch
@@ -103,52 +274,45 @@ class GraphBuilder(neo4j.GraphDatabaseService):
             return None
 
         # Attempt to get the node from Neo4j
-        anode = self.get_indexed_node(label_index, key, value)
+        anode = self.find_node(label_index, value)
 
         # If the node was found then update the properties
         if anode:
-            node_dict = self.cleanse_properties(node_dict)
+            node_dict = self.cleanse_properties(node_dict, label_index)
+            node_dict['load_seq'] = self.load_seq
             anode.update_properties(node_dict)
 
         # Node did not already exist, create it or add it to the batch
         if not anode:
-            node_properties = self.cleanse_properties(node_dict)
+            node_properties = self.cleanse_properties(node_dict, label_index)
+            node_properties.update({'visited': 'False', 'stub': stub, key: value, 'load_seq': self.load_seq})
             if create:
-                node_properties.update({'visited': 'False', 'stub': stub})
-                anode = self.get_or_create_indexed_node(label_index, key, value, node_properties)
-                anode.add_labels(label_index)
+                anode = self.merge_node(label_index, value, node_properties)
             else:
-                anode = batch.get_or_create_in_index(neo4j.Node, label_index, key, node(node_properties))
-                batch.add_labels(anode, label_index)
-                batch.set_properties(anode, {'visited': 'False', 'stub': stub})
+                anode = batch.append_cypher(self.merge_query(label_index),
+                                            {'permalink': value, 'properties': node_properties})
         return anode
 
-    def cleanse_properties(self, adict):
+    def cleanse_properties(self, adict, label=None):
         """Given a dictionary, strips lists and nulls, cleans some chars, returns properties dict for node creation.
 
-        Strips non-unicode characters from overview, name, and description.
-        Removes <p> and some non-printing characters.
+        Uses the compiled schema for label, keeping only known properties and coercing their types.
+        Without a schema, properties_to_delete are removed instead.
+        Strips <p> and some non-printing characters from text fields.
 
         :param dict adict: properties dictionary, probably from Mongo with list attributes.
+        :param str label: node label or relationship type (company, person, funder, funded, role)
         :rtype dict: dictionary with selected properties removed.
         """
-        new_dict = copy.copy(adict)
-        for key in self.properties_to_delete:
-            if new_dict.has_key(key):
-                del new_dict[key]
-        for key in new_dict.keys():
-            if new_dict[key] is None:
-                del new_dict[key]
-        new_dict = self.encode_chars(new_dict)
-        return new_dict
+        return self.cleanser.cleanse(adict, label)
+
+    def cleanse_properties_list(self, dict_list, label=None):
+        """Apply cleanse_properties to a list of dictionaries sharing a label, return list."""
+        return self.cleanser.cleanse_many(dict_list, label)
 
     def encode_chars(self, adict):
-        for key in ['name', 'first_name', 'last_name', 'overview', 'description',
-                    'address1', 'address2', 'source_description']:
-            if key in adict:
-                astr = re.sub('[\t\n\r\f\v]|</?p>', ' ', adict[key], count=20)
-                adict[key] = unicode(astr)
-        return adict
+        """Clean text fields of the dictionary in place using precompiled patterns, return it."""
+        return self.cleanser.encode_chars(adict)
 
 
     def add_edges_to_graph(self, db, collection, index='funder', edge_names=[], limit=0):
@@ -169,29 +333,28 @@ class GraphBuilder(neo4j.GraphDatabaseService):
                                    'company': ['investments']
                                    }
 
+        if not self._schema_ready:
+            self.ensure_schema()
+        self.start_load()
         c = self.get_collection(db, collection)
         cur = c.find(limit=limit)
         cur.batch_size(20)
-        batch = neo4j.WriteBatch(self)
+        batch = self.new_batch(index + ' relationships')
         print 'Number of Nodes to Investigate ', db, collection, ':', cur.count()
 
-        # Iterate over node collection
+        # Iterate over node collection, the batch submits itself as it fills
         for i, d in enumerate(cur):
             if 'permalink' not in d:
                 continue
             if (i % node_status_freq[index]) == 0:
-                batch.submit()
-                neo4j.WriteBatch(self)
                 print 'Adding', index, 'relationships, next iter: ', index, i
             ########item_list = d[index]
-            print 'adding {} relationships from {}.'.format(index, d['permalink'])
 
             # Get the source node, if it doesn't exist then create one using current properties
-            source_node = self.get_indexed_node(index, 'permalink', d['permalink'])
+            source_node = self.find_node(index, d['permalink'])
             if not source_node:
-                source_properties = self.cleanse_properties(d)
-                source_node = self.get_or_create_indexed_node(index, 'permalink', d['permalink'],
-                                                              properties=source_properties)
+                source_properties = self.cleanse_properties(d, index)
+                source_node = self.merge_node(index, d['permalink'], source_properties)
             for edge_type in edge_names_by_node_type[index]:
                 if not d.has_key(edge_type) or len(d[edge_type]) == 0:
                     continue
@@ -202,14 +365,14 @@ class GraphBuilder(neo4j.GraphDatabaseService):
                     elif edge_type == 'relationships':
                         self.add_relationships_to_graph(source_node, edge, batch)
 
-        batch.submit()
+        batch.close()
 
     def add_relationships_to_graph(self, source_node, prop_dict, batch):
         """Add relationships between people and companies/other.
 
         :param Node source_node: source node for relationship
         :param dict prop_dict: single dictionary from source's list
-        :param WriteBatch batch: neo4j WriteBatch
+        :param BatchWriter batch: BatchWriter from new_batch
         :rtype None:
         """
 
@@ -226,38 +389,45 @@ class GraphBuilder(neo4j.GraphDatabaseService):
         prop_dict['current'] = True
         if prop_dict['is_past'] == 'true':
             prop_dict['current'] = False
+        prop_dict = self.cleanse_properties(prop_dict, 'role')
 
 
-        founder = re.compile('founder', re.I)
-        ceo = re.compile('CEO|chief exec|president', re.I)
-        co_vp = re.compile('C.O|vp|director|vice president|partner|chief', re.I)
-        adviser = re.compile('adviser|board|consultant')
-
-        title_string = prop_dict['title']
-        if founder.search(title_string):
-            title = 'Founder'
-        elif ceo.search(title_string):
-            title = 'CEO'
-        elif co_vp.search(title_string):
-            title = 'VP'
-        elif adviser.search(title_string):
-            title = 'Adviser'
-        else:
-            title = None
-            print title_string
+        title = self.role_classifier.classify(prop_dict.get('title'))
         if title and source_node and target_node:
-            path = batch.get_or_create_path(source_node, (title, prop_dict), target_node)
+            self.add_relationship_to_batch(batch, source_node, title, prop_dict, target_node)
 
         return None
 
+    def set_role_classifier(self, role_file=None, classifier=None):
+        """Replace the role classifier, e.g. to add roles such as CTO or CFO.
+
+        :param str role_file: JSON file with an ordered list of [role, regex] pairs
+        :param RoleClassifier classifier: classifier to use, ignored if role_file is given
+        :rtype RoleClassifier:
+        """
+        if role_file:
+            classifier = RoleClassifier.from_json(role_file)
+        self.role_classifier = classifier or RoleClassifier()
+        return self.role_classifier
+
+    def write_role_report(self, out_file='unmatched_titles.tab'):
+        """Write titles that could not be classified into roles, with counts."""
+        return self.role_classifier.write_unmatched_report(out_file)
+
+    def write_dropped_report(self, out_file='dropped_properties.tab'):
+        """Write fields left out of node and relationship properties by the cleanser schemas, with counts."""
+        return self.cleanser.write_dropped_report(out_file)
+
     def add_funding_round_to_graph(self, funder_node, investment_dict, batch, relationship_type='funded'):
         """Add funding round relationships for one investor (financial org or person).
 
-        Assumes a company is receiving the funds.
+        Assumes a company is receiving the funds. A round with several investors is one
+        relationship per investor. An investment written again (a repeat in the list or a
+        reload) is merged by relate_query on (funder, company, round_code, funded_date).
 
         :param Node funder_node: source node for relationship
         :param dict investment_dict: single dictionary from investor's investment list
-        :param WriteBatch batch: neo4j WriterBatch
+        :param BatchWriter batch: BatchWriter from new_batch
         :param str relationship_type: Type for created relationship (e.g. funded)
         """
         company_dict = investment_dict['company']
@@ -265,13 +435,12 @@ class GraphBuilder(neo4j.GraphDatabaseService):
         # Add date string and delete unneeded information
         datestr = self.date_from_dictionary(investment_dict, 'funded')
         investment_dict['funded_date'] = datestr
+
         company_node = self.get_or_add_node_to_batch(company_dict, 'company', batch=batch, create=True)
         if company_node:
-            del investment_dict['funded_month']
-            del investment_dict['funded_day']
-            del investment_dict['company']          # leave d with properties for relationship
-
-            path = batch.get_or_create_path(funder_node, (relationship_type, investment_dict), company_node)
+            # Schema keeps only the properties for the relationship (drops company, funded_month, funded_day)
+            edge_properties = self.cleanse_properties(investment_dict, relationship_type)
+            self.add_relationship_to_batch(batch, funder_node, relationship_type, edge_properties, company_node)
         return None
 
     def date_from_dictionary(self, d, prefix):
@@ -334,29 +503,28 @@ class GraphBuilder(neo4j.GraphDatabaseService):
     # def get_relationship_index(self, index_name):
     #     return self.get_or_create_index(neo4j.Relationship, index_name)
 
-    def export_person_nodes_to_csv(self, out_file_name='person_nodes.tab', limit=9999999):
+    def export_person_nodes_to_csv(self, out_file_name='person_nodes.tab', limit=0, since=0, until=0):
         """Export person nodes to csv file to be read in with Gephi.
 
-        Abstraction layer for export_nodes_to_csv."""
+        Abstraction layer for export_nodes_to_csv. If since or until are given only nodes
+        with since < load_seq <= until are exported, see export_changes."""
         node_type = 'person'
-        query_str = 'match (n:' + node_type + ') ' + ' return n'
+        query_str = 'match (n:' + node_type + ') ' + self.changed_clause('n', since, until) + ' return n'
         initial_dict = {'label': node_type}
         person_fields = [u'nodes', u'id', u'label', u'first_name', u'last_name', u'affiliation_name', u'alias_list',
                         u'crunchbase_url',u'born_year']
         # Probably don't need: u'created_at', u'updated_at', u'twitter_username', u'blog_feed_url',
         #      u'blog_url', u'born_month', u'homepage_url', u'born_day',
-        result = CypherQuery(self, 'match (n:' + node_type + ') ' + ' return count(n);').execute()
-        count, = result.data[0].values
-        count = min(count, limit)
-        print '\nBeginning export of {} person nodes'.format(count)
-        self.export_nodes_to_csv(node_type, query_str, count, out_file_name, person_fields, initial_dict, sep='\n')
+        print '\nBeginning export of person nodes'
+        return self.export_nodes_to_csv(node_type, query_str, out_file_name, person_fields, initial_dict, sep='\n', limit=limit)
 
-    def export_company_node_to_csv(self, out_file_name='company_nodes.tab', limit=9999999):
+    def export_company_node_to_csv(self, out_file_name='company_nodes.tab', limit=0, since=0, until=0):
         """Export company nodes to csv file to be read in with Gephi.
 
-        Abstraction layer for export_nodes_to_csv."""
+        Abstraction layer for export_nodes_to_csv. If since or until are given only nodes
+        with since < load_seq <= until are exported, see export_changes."""
         node_type = 'company'
-        query_str = 'match (n:' + node_type + ') ' + ' return n '
+        query_str = 'match (n:' + node_type + ') ' + self.changed_clause('n', since, until) + ' return n '
         initial_dict = {'label': node_type}
         company_fields = [u'nodes', u'id', u'label', u'name', u'category_code', u'crunchbase_url', u'description',
                            u'number_of_employees', u'alias_list', u'deadpooled_year',
@@ -364,18 +532,16 @@ class GraphBuilder(neo4j.GraphDatabaseService):
         # Probably don't need:  u'deadpooled_month',u'created_at', u'updated_at', u'founded_day',
         #    u'deadpooled_day', u'deadpooled_url', u'twitter_username', u'homepage_url',
         #    u'blog_url', u'blog_feed_url', u'founded_month', u'email_address',
-        result = CypherQuery(self, 'match (n:' + node_type + ') ' + ' return count(n);').execute()
-        count, = result.data[0].values
-        count = min(count, limit)
-        print '\nBeginning export of {} company nodes'.format(count)
-        self.export_nodes_to_csv('company', query_str, count, out_file_name, company_fields, initial_dict, sep='\n')
+        print '\nBeginning export of company nodes'
+        return self.export_nodes_to_csv('company', query_str, out_file_name, company_fields, initial_dict, sep='\n', limit=limit)
 
-    def export_financial_nodes_to_csv(self, out_file_name='financial_nodes.tab', limit=9999999):
+    def export_financial_nodes_to_csv(self, out_file_name='financial_nodes.tab', limit=0, since=0, until=0):
         """Export financial institution nodes to csv file to be read in with Gephi.
 
-        Abstraction layer for export_nodes_to_csv."""
+        Abstraction layer for export_nodes_to_csv. If since or until are given only nodes
+        with since < load_seq <= until are exported, see export_changes."""
         node_type = 'funder'
-        query_str = 'match (n:' + node_type + ') ' + ' return n '
+        query_str = 'match (n:' + node_type + ') ' + self.changed_clause('n', since, until) + ' return n '
         initial_dict = {'label': node_type}
         funder_fields = [u'nodes', u'id', u'label', u'name', u'permalink', u'crunchbase_url', u'homepage_url',
                          u'description', u'overview', u'twitter_username', u'founded_year',
@@ -383,118 +549,270 @@ class GraphBuilder(neo4j.GraphDatabaseService):
                          u'deadpooled_year', u'total_money_raised', u'error']
         # Don't need:  u'blog_url', u'blog_feed_url', u'phone_number', u'email_address', u'founded_month',
         #   u'created_at', u'updated_at', u'founded_day', u'deadpooled_day', u'deadpooled_url',
-        result = CypherQuery(self, 'match (n:' + node_type + ') ' + ' return count(n);').execute()
-        count, = result.data[0].values
-        count = min(count, limit)
-        print '\nBeginning export of {} financial-institution nodes'.format(count)
-        self.export_nodes_to_csv(node_type, query_str, count, out_file_name, funder_fields, initial_dict, sep='\n')
+        print '\nBeginning export of financial-institution nodes'
+        return self.export_nodes_to_csv(node_type, query_str, out_file_name, funder_fields, initial_dict, sep='\n', limit=limit)
 
-    def export_funded_relationships_to_csv(self, out_file_name='funded_relations.tab', limit=9999999):
+    # Columns computed from the relationship and its endpoints, any other field is a relationship property
+    relation_columns = {'source': 'a.{key}', 'target': 'b.{key}', 'type': 'type(r)', 'label': 'type(r)',
+                        'rel_id': 'id(r)', 'id': "a.permalink + '__' + b.permalink"}
+
+    def export_funded_relationships_to_csv(self, out_file_name='funded_relations.tab', limit=0, fields=None,
+                                           endpoint_key='id', since=0, until=0):
         """Export edges to csv file to be read in with Gephi.
 
-        Abstraction layer for export_relationships_to_csv."""
+        Abstraction layer for export_relations_to_csv.
+        :param list fields: columns to export, defaults to funded_fields below
+        :param str endpoint_key: 'id' (the id column of the node files) or 'permalink', identifies the endpoints
+        :param int since: if > 0 only relationships with load_seq > since are exported
+        :param int until: if > 0 only relationships with load_seq <= until are exported"""
         rel_type = 'funded'
-        query_str = 'match (a)-[r:' + rel_type + ']->(b) ' + ' return a.permalink as source, r, b.permalink as target, id(r) as id'
-        initial_dict = {'label': rel_type, 'source_id': ''}
-        funded_fields = [u'source', u'target', u'type', u'source_id', u'id', u'label', u'name', u'category_code',
-                         u'crunchbase_url',  u'round_code', u'raised_amount',
-                         u'permalink', u'source_url', u'raised_currency_code', u'funded_year']
+        funded_fields = [u'source', u'target', u'type', u'id', u'label', u'round_code', u'raised_amount',
+                         u'source_url', u'raised_currency_code', u'funded_year']
         # Source descriptions has lots of non-standard characters--u'source_description',
         # Probably don't need: u'funded_month', u'funded_day'
-        result = CypherQuery(self, 'match ()-[r:' + rel_type + ']->() ' + ' return count(r);').execute()
-        count, = result.data[0].values
-        count = min(count, limit)
-        print 'Count rels', count
-        self.export_relations_to_csv('funded', query_str, count, out_file_name, funded_fields, initial_dict, sep='\n')
+        print '\nBeginning export of {} relationships'.format(rel_type)
+        return self.export_relations_to_csv(rel_type, out_file_name, fields or funded_fields, sep='\n', limit=limit,
+                                            endpoint_key=endpoint_key, since=since, until=until)
 
+    def changed_clause(self, var, since=0, until=0):
+        """Cypher where clause selecting entities stamped with since < load_seq <= until, '' if neither given.
 
-    def export_relations_to_csv(self, type, query_str, count, out_file, fields, initial_dict={}, sep=','):
+        Entities written before load_seq was stamped count as load_seq 0, so they are in every
+        range starting at 0 and in no later one.
+        """
+        conditions = []
+        stamp = 'coalesce(' + var + '.load_seq, 0)'
+        if since:
+            conditions.append(stamp + ' > ' + str(int(since)))
+        if until:
+            conditions.append(stamp + ' <= ' + str(int(until)))
+        if not conditions:
+            return ''
+        return ' where ' + ' and '.join(conditions) + ' '
+
+    def read_watermark(self, watermark_file):
+        """Return the load_seq recorded by the last export_changes, 0 if there is none."""
+        if not os.path.exists(watermark_file):
+            return 0
+        with open(watermark_file, 'rb') as fil:
+            return json.load(fil)['load_seq']
+
+    def export_changes(self, out_dir='.', watermark_file='export_watermark.json'):
+        """Export nodes and funded relationships written since the last export_changes as change set files.
+
+        Files are named like person_nodes_<since>_<until>.tab, and the new watermark is recorded
+        once all exports finish. Should not run while a load is in progress, since a load stamps
+        everything it writes with the load_seq from its start. Without a watermark the first export
+        is a full export, including entities written before load_seq was stamped.
+
+        Deletions are not exported. Change sets hold only nodes and relationships that exist and were
+        written since the watermark, and nothing records what was deleted, so consumers applying change
+        sets keep deleted entities until they take a full export.
+
+        :param str out_dir: directory for the change set files
+        :param str watermark_file: JSON file holding the load_seq of the last export
+        :rtype dict: rows exported by file name
+        """
+        since = self.read_watermark(watermark_file)
+        until = self.next_load_seq()
+        suffix = '_{}_{}.tab'.format(since, until)
+        print '\nExporting changes with {} < load_seq <= {}'.format(since, until)
+        exported = dict()
+        for name, export in [('person_nodes', self.export_person_nodes_to_csv),
+                             ('company_nodes', self.export_company_node_to_csv),
+                             ('financial_nodes', self.export_financial_nodes_to_csv),
+                             ('funded_relations', self.export_funded_relationships_to_csv)]:
+            out_file = os.path.join(out_dir, name + suffix)
+            # A first export has no lower bound, so it is a full export with no load_seq predicate
+            exported[out_file] = export(out_file_name=out_file, since=since, until=until if since else 0)
+        with open(watermark_file, 'wb') as fil:
+            json.dump({'load_seq': until}, fil)
+        return exported
+
+    def relation_query(self, rel_type, fields, endpoint_key='id', since=0, until=0):
+        """Cypher returning one column per field for relationships of rel_type.
+
+        :param str rel_type: relationship type, e.g. funded
+        :param list fields: columns, see relation_columns, others are read from relationship properties
+        :param str endpoint_key: 'id' (the id column of the node files) or 'permalink', identifies the endpoints
+        :param int since: if > 0 only relationships with load_seq > since are returned
+        :param int until: if > 0 only relationships with load_seq <= until are returned
+        :rtype str:
+        """
+        key = 'permalink' if endpoint_key == 'permalink' else 'id'
+        columns = []
+        for field in fields:
+            expression = self.relation_columns.get(field, 'r.' + field)
+            if key == 'id':
+                expression = expression.replace('a.{key}', 'id(a)').replace('b.{key}', 'id(b)')
+            columns.append(expression.format(key=key) + ' as ' + field)
+        return 'match (a)-[r:' + rel_type + ']->(b)' + self.changed_clause('r', since, until) + \
+               ' return ' + ', '.join(columns)
+
+    def export_relations_to_csv(self, type, out_file, fields, initial_dict={}, sep=',', limit=0,
+                                endpoint_key='id', since=0, until=0):
         """Export general relationships to csv for import to Gephi.
 
-        :param str type: person, funder, or company
-        :param str query_str: cypher query string to return the nodes or relations
+        Only the requested columns are returned by Cypher, endpoints are permalinks or ids, not nodes.
+        Rows are read from one streamed query rather than skip/limit pages, which rescan all earlier rows.
+
+        :param str type: relationship type, e.g. funded
         :param str out_file: output file
-        :param list fields: fields to write
-        :param dict initial_dict: dict with any vars not in node
+        :param list fields: fields to write, see relation_query
+        :param dict initial_dict: dict with any vars not returned by the query
         :param str sep: separator to use in output file
-        :rtype None:
+        :param int limit: if > 0, only limit rows are exported
+        :param str endpoint_key: 'id' (the id column of the node files) or 'permalink', identifies the endpoints
+        :param int since: if > 0 only relationships with load_seq > since are exported
+        :param int until: if > 0 only relationships with load_seq <= until are exported
+        :rtype int: number of relationships exported
         """
-
-        field_set = set()
-        header_set = set()
         n_exported = 0
         n_errors = 0
-        query_size = 2000
+        query_str = self.relation_query(type, fields, endpoint_key, since, until)
+        if limit:
+            query_str += ' limit ' + str(limit)
 
         with open(out_file, 'wb') as fil:
             dw = csv.DictWriter(fil, fields, extrasaction='ignore', dialect='excel-tab')
-
-            # Generate and write the header line
-            header = dict()
-            for txt in fields:
-                header[txt] = txt
-                header_set.add(txt)
-            dw.writerow(header)
-
-            for first in xrange(0, count, query_size):
-                query_str_with_limits = query_str + ' skip ' + str(first) + ' limit ' + str(query_size) + ';'
-
-
-                query = CypherQuery(self, query_str_with_limits)
-                for relationship in query.stream():
-
-                    #print 'try to pull out rels parts', len(relationship)
-                    rel_parts = relationship.values[1]
-                    d = initial_dict
-                    d['label'] = rel_parts.type
-                    d['type'] = rel_parts.type
-                    d['source'] = self.encode_chars(rel_parts.start_node)
-                    d['target'] = self.encode_chars(rel_parts.end_node)
-                    d['permalink'] = rel_parts.start_node['permalink'] + '__' + rel_parts.end_node['permalink']
-                    edge_properties = self.encode_chars(rel_parts.get_properties())
-                    d['source']['overview'] = ''
-                    d['target']['overview'] = ''
-                    print 'Edge_props (cleaned)', edge_properties
-                    print '  Source props (cleaned)', d['permalink']
-                    #print '  Source', d['source']
-                   # TODO: unicode errors are in source or target node information
-
-                    try:
-                        d['id'] = d['permalink']
-                        for key in d:
-                            field_set.add(key)
-                        d.update(edge_properties)
-
-                        dw.writerow(self.encode_chars(d))
-                        n_exported += 1
-                        if (n_exported % 1000) == 0:
-                            print 'Relationships exported: ', n_exported
-                    except UnicodeEncodeError as uee:
-                        n_errors += 1
-                        print 'Unicode Error Inside in Export Relationships', uee.args
-                    except ValueError as err:
-                        n_errors += 1
-                        print 'Unknown Error Inside in Export Relationships', err.args
+            dw.writerow(dict(zip(fields, fields)))
+
+            for record in CypherQuery(self, query_str + ';').stream():
+                try:
+                    d = dict(initial_dict)
+                    for field, value in zip(fields, record.values):
+                        if value is not None:
+                            d[field] = value
+                    dw.writerow(self.encode_chars(d))
+                    n_exported += 1
+                    if (n_exported % 10000) == 0:
+                        print 'Relationships exported: ', n_exported
+                except UnicodeEncodeError as uee:
+                    n_errors += 1
+                    print 'Unicode Error Inside in Export Relationships', uee.args
+                except ValueError as err:
+                    n_errors += 1
+                    print 'Unknown Error Inside in Export Relationships', err.args
 
         print '\nExport of {} {} relationships complete. There were {} errors.'.format(n_exported, type, n_errors)
-        print '   Unexported fields: {}'.format(field_set - header_set)
-
-    def export_nodes_to_csv(self, type, query_str, count, out_file, fields, initial_dict={}, sep=','):
+        return n_exported
+
+    # Typed attributes written by export_funding_graph
+    graph_node_attributes = {'company': [('name', 'string'), ('category_code', 'string'), ('founded_year', 'int'),
+                                         ('total_money_raised', 'string'), ('number_of_employees', 'int')],
+                             'funder': [('name', 'string'), ('founded_year', 'int')],
+                             'person': [('first_name', 'string'), ('last_name', 'string'),
+                                        ('affiliation_name', 'string'), ('born_year', 'int')]}
+    # Computed by the analytics modules and written with write_node_properties, exported when present
+    analytics_node_attributes = [('pagerank', 'double'), ('hub', 'double'), ('authority', 'double'),
+                                 ('weighted_in_degree', 'double'), ('weighted_out_degree', 'double'),
+                                 ('community', 'int')]
+    graph_edge_attributes = [('round_code', 'string'), ('raised_amount', 'double'),
+                             ('raised_currency_code', 'string'), ('funded_year', 'int')]
+
+    def export_funding_graph(self, out_file='funding_graph.gexf', labels=('funder', 'person', 'company'),
+                             rel_type='funded', dynamic=True, limit=0, layout=None):
+        """Stream nodes and funding relationships to a GEXF or GraphML file for direct import to Gephi.
+
+        Replaces the separate node and relationship tab files. Node ids are Neo4j ids, node labels
+        are permalinks. In dynamic GEXF, edges start at their funded_year for Gephi's timeline.
+
+        :param str out_file: output file, .graphml for GraphML, otherwise GEXF
+        :param tuple labels: node labels to export
+        :param str rel_type: relationship type to export
+        :param bool dynamic: if True edges are given a start time from funded_year (GEXF only)
+        :param int limit: if > 0, at most limit nodes per label and limit edges are exported
+        :param dict layout: permalink -> (x, y), e.g. from ForceLayout.cached, written as x/y attributes
+                            and GEXF viz positions
+        :rtype tuple: number of nodes and edges written
+        """
+        node_attributes = [('type', 'string'), ('permalink', 'string')]
+        if layout is not None:
+            node_attributes += [('x', 'double'), ('y', 'double')]
+        for label in labels:
+            for attribute in self.graph_node_attributes.get(label, []) + self.analytics_node_attributes:
+                if attribute not in node_attributes:
+                    node_attributes.append(attribute)
+        limit_str = ' limit ' + str(limit) if limit else ''
+
+        with open_writer(out_file, node_attributes, self.graph_edge_attributes, dynamic=dynamic) as writer:
+            for label in labels:
+                fields = ['permalink'] + [name for name, atype in self.graph_node_attributes.get(label, []) +
+                                          self.analytics_node_attributes]
+                query_str = 'match (n:' + label + ') return id(n), ' + \
+                            ', '.join('n.' + field for field in fields) + limit_str + ';'
+                for record in CypherQuery(self, query_str).stream():
+                    values = record.values
+                    attributes = dict(zip(fields, values[1:]))
+                    attributes['type'] = label
+                    position = layout.get(attributes['permalink']) if layout is not None else None
+                    if position is not None:
+                        attributes['x'], attributes['y'] = position
+                    writer.add_node(values[0], attributes['permalink'] or values[0], self.encode_chars(attributes),
+                                    position=position)
+                print 'Nodes written:', label, writer.n_nodes
+
+            fields = [name for name, atype in self.graph_edge_attributes]
+            query_str = 'match (a)-[r:' + rel_type + ']->(b) return id(r), id(a), id(b), ' + \
+                        ', '.join('r.' + field for field in fields) + limit_str + ';'
+            for record in CypherQuery(self, query_str).stream():
+                values = record.values
+                attributes = dict(zip(fields, values[3:]))
+                writer.add_edge(values[1], values[2], attributes, edge_id=values[0],
+                                start=attributes.get('funded_year'))
+        return writer.n_nodes, writer.n_edges
+
+    def export_columnar(self, out_file='funding_graph.npz', labels=('funder', 'person', 'company'),
+                        rel_type='funded', parquet=False):
+        """Export nodes and relationships as typed columns for analytics, see ColumnarExport.
+
+        Nodes become permalink, label, name, founded_year (born_year for people), total_money_raised,
+        and category_code columns. Edges become int32 source/target indexes into the node columns with
+        raised_amount, funded_year, round_code, and raised_currency_code columns. Categorical columns are
+        stored as integer codes with a *_categories lookup array.
+
+        :param str out_file: .npz file, Parquet files are written alongside if parquet is True
+        :param tuple labels: node labels to export
+        :param str rel_type: relationship type to export
+        :param bool parquet: also write Parquet files, needs pyarrow
+        :rtype dict: the columns written
+        """
+        writer = ColumnarGraphWriter()
+        for label in labels:
+            query_str = 'match (n:' + label + ') return id(n), n.permalink, n.name, n.first_name, n.last_name, ' \
+                        'n.founded_year, n.born_year, n.total_money_raised, n.category_code;'
+            for record in CypherQuery(self, query_str).stream():
+                key, permalink, name, first_name, last_name, founded, born, money, category = record.values
+                if name is None and (first_name or last_name):
+                    name = u' '.join(part for part in (first_name, last_name) if part)
+                writer.add_node(key, permalink, label, name, founded if founded is not None else born, money,
+                                category)
+            print 'Columnar export nodes:', label, len(writer.permalinks)
+
+        query_str = 'match (a)-[r:' + rel_type + ']->(b) return id(a), id(b), r.raised_amount, r.funded_year, ' \
+                    'r.round_code, r.raised_currency_code;'
+        for record in CypherQuery(self, query_str).stream():
+            writer.add_edge(*record.values)
+        return writer.save(out_file, parquet=parquet)
+
+    def export_nodes_to_csv(self, type, query_str, out_file, fields, initial_dict={}, sep=',', limit=0):
         """Export general nodes to csv for import to Gephi.
 
+        Rows are read from one streamed query rather than skip/limit pages, which rescan all earlier rows.
+
         :param str type: person, funder, or company
         :param str query_str: cypher query string to return the nodes or relations
         :param str out_file: output file
         :param list fields: fields to write
         :param dict initial_dict: dict with any vars not in node
         :param str sep: separator to use in output file
-        :rtype None:
+        :param int limit: if > 0, only limit rows are exported
+        :rtype int: number of nodes exported
         """
         field_set = set()
         header_set = set()
         n_exported = 0
         n_errors = 0
-        query_size = 5000
 
         with open(out_file, 'wb') as fil:
             dw = csv.DictWriter(fil, fields, extrasaction='ignore', dialect='excel-tab')
@@ -506,36 +824,32 @@ class GraphBuilder(neo4j.GraphDatabaseService):
                 header_set.add(txt)
             dw.writerow(header)
 
-            for first in xrange(0, count, query_size):
-                query_str_with_limits = query_str + ' skip ' + str(first) + ' limit ' + str(query_size) + ';'
-
-                query = CypherQuery(self, query_str_with_limits)
-                for item in query.stream():
-                    for anode in item:
-                        anode = item.values[0]
-                        try:
-                            d = copy.copy(initial_dict)
-                            anode['permalink'] = self.get_permalink(anode)
-                            d['nodes'] = anode['permalink']
-                            d['id'] = anode._id
-                            nd = dict()
-
-                            for key, val in anode.get_properties().iteritems():
-                                field_set.add(key)
-                                nd[key] = val
-                            d.update(nd)
-                            dw.writerow(d)
-
-                            n_exported += 1
-                            if (n_exported % 1000) == 0:
-                                print 'Nodes exported ', n_exported
-                        except UnicodeEncodeError as uee:
-                            n_errors += 1
-                            print 'Unicode Error Inside on Nodes', uee.args
-                        except ValueError as ve:
-                            n_errors += 1
-                            print 'Value Error Inside on Nodes', ve.args
+            if limit:
+                query_str += ' limit ' + str(limit)
+            query = CypherQuery(self, query_str + ';')
+            for item in query.stream():
+                anode = item.values[0]
+                try:
+                    d = copy.copy(initial_dict)
+                    properties = anode.get_cached_properties()         # no round trip per node
+                    d['nodes'] = self.get_permalink(properties)
+                    d['id'] = anode._id
+                    for key in properties:
+                        field_set.add(key)
+                    d.update(properties)
+                    dw.writerow(d)
+
+                    n_exported += 1
+                    if (n_exported % 1000) == 0:
+                        print 'Nodes exported ', n_exported
+                except UnicodeEncodeError as uee:
+                    n_errors += 1
+                    print 'Unicode Error Inside on Nodes', uee.args
+                except ValueError as ve:
+                    n_errors += 1
+                    print 'Value Error Inside on Nodes', ve.args
 
         print '\nExport of {} {} nodes complete. There were {} errors.'.format(n_exported, type, n_errors)
         print '   Unexported fields: {}'.format(field_set - header_set)
+        return n_exported
 
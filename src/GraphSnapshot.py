@@ -0,0 +1,119 @@
+"""
+Name:       GraphSnapshot.py
+Purpose:    Versioned binary snapshots of a CompactGraph. A snapshot is one file
+            with a fixed header, a JSON table of contents and the raw adjacency
+            and attribute arrays, each aligned so it can be memory mapped.
+            Loading reads only the header and maps the arrays, so nothing is
+            deserialized and pages are read from disk as they are used.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/14/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import json, struct, time
+import numpy as np
+
+from src.CompactGraph import CompactGraph
+
+MAGIC = 'CBGRAPH\x00'
+SCHEMA_VERSION = 1
+ALIGNMENT = 64
+
+# Magic, schema version, length of the JSON table of contents
+_header = struct.Struct('<8sII')
+
+
+def _arrays(graph):
+    """(name, array) pairs for everything stored in a snapshot."""
+    arrays = [('permalinks', graph.permalinks), ('sources', graph.sources), ('targets', graph.targets)]
+    arrays += [(name, getattr(graph, name)) for name in CompactGraph.adjacency_names]
+    arrays += [('node:' + name, values) for name, values in sorted(graph.node_attributes.iteritems())]
+    arrays += [('edge:' + name, values) for name, values in sorted(graph.edge_attributes.iteritems())]
+    return arrays
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_snapshot(graph, out_file, metadata=None):
+    """Write graph to out_file.
+
+    :param CompactGraph graph: graph to save
+    :param str out_file: snapshot file name, e.g. funding_graph.cbg
+    :param dict metadata: JSON serializable values stored in the header (e.g. source, load_seq)
+    :rtype dict: the table of contents written
+    """
+    arrays = [(name, np.ascontiguousarray(values)) for name, values in _arrays(graph)]
+    contents = {'schema_version': SCHEMA_VERSION,
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'n_nodes': graph.n_nodes,
+                'n_edges': graph.n_edges,
+                'categories': dict((name, values.tolist()) for name, values in graph.categories.iteritems()),
+                'metadata': metadata or dict(),
+                'arrays': []}
+    # Offsets depend on the length of the table of contents, so lay it out until it stops growing
+    data_start = 0
+    while True:
+        offset = data_start
+        contents['arrays'] = []
+        for name, values in arrays:
+            offset = _aligned(offset)
+            contents['arrays'].append({'name': name, 'dtype': values.dtype.str, 'shape': list(values.shape),
+                                       'offset': offset})
+            offset += values.nbytes
+        toc = json.dumps(contents, sort_keys=True)
+        if _aligned(_header.size + len(toc)) <= data_start:
+            break
+        data_start = _aligned(_header.size + len(toc))
+    with open(out_file, 'wb') as fil:
+        fil.write(_header.pack(MAGIC, SCHEMA_VERSION, len(toc)))
+        fil.write(toc)
+        for (name, values), entry in zip(arrays, contents['arrays']):
+            fil.write('\x00' * (entry['offset'] - fil.tell()))
+            fil.write(values.tostring())
+    print 'Snapshot: {} nodes, {} edges written to {}'.format(graph.n_nodes, graph.n_edges, out_file)
+    return contents
+
+
+def read_contents(in_file):
+    """Read and check the header of a snapshot, return its table of contents."""
+    with open(in_file, 'rb') as fil:
+        magic, version, toc_length = _header.unpack(fil.read(_header.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a graph snapshot'.format(in_file))
+        if version > SCHEMA_VERSION:
+            raise ValueError('{} has schema version {}, this code reads up to {}'.format(in_file, version,
+                                                                                        SCHEMA_VERSION))
+        return json.loads(fil.read(toc_length))
+
+
+def load_snapshot(in_file, mmap=True):
+    """Load a CompactGraph from a snapshot.
+
+    :param str in_file: snapshot file name
+    :param bool mmap: if True arrays are read only memory maps of the file, otherwise they are read into memory
+    :rtype CompactGraph:
+    """
+    contents = read_contents(in_file)
+    arrays = dict()
+    with open(in_file, 'rb') as fil:
+        for entry in contents['arrays']:
+            dtype, shape = np.dtype(str(entry['dtype'])), tuple(entry['shape'])
+            count = int(np.prod(shape))
+            if count == 0:
+                values = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                values = np.memmap(in_file, dtype=dtype, mode='r', offset=entry['offset'], shape=shape)
+            else:
+                fil.seek(entry['offset'])
+                values = np.fromfile(fil, dtype=dtype, count=count).reshape(shape)
+            arrays[entry['name']] = values
+    node_attributes = dict((name[5:], values) for name, values in arrays.iteritems() if name.startswith('node:'))
+    edge_attributes = dict((name[5:], values) for name, values in arrays.iteritems() if name.startswith('edge:'))
+    categories = dict((name, np.array(values, dtype=unicode)) for name, values in contents['categories'].iteritems())
+    graph = CompactGraph(arrays['permalinks'], arrays['sources'], arrays['targets'], node_attributes,
+                         edge_attributes, categories, [arrays[name] for name in CompactGraph.adjacency_names])
+    graph.metadata = contents['metadata']
+    return graph
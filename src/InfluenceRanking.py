@@ -0,0 +1,168 @@
+"""
+Name:       InfluenceRanking.py
+Purpose:    Investor and company rankings over the funding graph. PageRank,
+            HITS hub and authority scores and weighted degree are computed by
+            power iteration on a SciPy sparse matrix built from a CompactGraph,
+            with edges weighted by raised_amount and optionally decayed by the
+            age of the round. Scores can be written to a tab file for Gephi or
+            back to Neo4j as node properties.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/16/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import csv, time
+import numpy as np
+from scipy import sparse
+
+# Scores computed by InfluenceRanking.compute, in output column order
+score_names = ['pagerank', 'hub', 'authority', 'weighted_in_degree', 'weighted_out_degree']
+
+
+def edge_weights(graph, edges, weight='raised_amount', half_life=0, reference_year=None):
+    """Weight of each edge.
+
+    Edges with no amount get the median of the known amounts, so a round with an
+    unreported amount still counts as a typical round.
+
+    :param CompactGraph graph: graph holding the edges
+    :param ndarray edges: edge ids
+    :param str weight: edge attribute used as weight, None for 1.0 on every edge
+    :param float half_life: if > 0, weights halve every half_life years before reference_year
+    :param int reference_year: year with no decay, defaults to the latest funded_year
+    :rtype ndarray:
+    """
+    if weight is None:
+        weights = np.ones(len(edges))
+    else:
+        weights = graph.edge_attributes[weight][edges].astype(np.float64)
+        known = np.isfinite(weights) & (weights > 0)
+        weights[~known] = np.median(weights[known]) if known.any() else 1.0
+    if half_life > 0:
+        years = graph.edge_attributes['funded_year'][edges].astype(np.float64)
+        dated = years > 0
+        if reference_year is None:
+            reference_year = years[dated].max() if dated.any() else 0
+        age = np.where(dated, np.maximum(reference_year - years, 0), 0)
+        weights *= 0.5 ** (age / half_life)
+    return weights
+
+
+def weighted_matrix(graph, types=('funded',), weight='raised_amount', half_life=0, reference_year=None):
+    """n x n CSR matrix with the summed weight of edges from row to column."""
+    edges = np.nonzero(graph.edge_type_mask(types))[0]
+    weights = edge_weights(graph, edges, weight, half_life, reference_year)
+    return sparse.coo_matrix((weights, (graph.sources[edges], graph.targets[edges])),
+                             shape=(graph.n_nodes, graph.n_nodes)).tocsr()
+
+
+def pagerank(matrix, alpha=0.85, tol=1e-10, max_iter=200):
+    """Weighted PageRank by power iteration, dangling nodes spread their rank evenly.
+
+    :param csr_matrix matrix: weighted adjacency, rank flows from row to column
+    :rtype tuple: scores summing to 1, number of iterations
+    """
+    n = matrix.shape[0]
+    out_weight = np.asarray(matrix.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    inverse = np.where(dangling, 0.0, 1.0 / np.where(dangling, 1.0, out_weight))
+    transpose = matrix.T.tocsr()
+    rank = np.ones(n) / n
+    for i in xrange(1, max_iter + 1):
+        new_rank = alpha * (transpose.dot(rank * inverse) + rank[dangling].sum() / n) + (1 - alpha) / n
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tol * n:
+            break
+    return rank / rank.sum(), i
+
+
+def hits(matrix, tol=1e-10, max_iter=200):
+    """Weighted HITS by power iteration.
+
+    :param csr_matrix matrix: weighted adjacency, rows are hubs (funders), columns authorities (companies)
+    :rtype tuple: hub scores, authority scores (each summing to 1), number of iterations
+    """
+    n = matrix.shape[0]
+    transpose = matrix.T.tocsr()
+    hub = np.ones(n) / n
+    authority = hub
+    for i in xrange(1, max_iter + 1):
+        authority = transpose.dot(hub)
+        authority /= authority.sum() or 1.0
+        new_hub = matrix.dot(authority)
+        new_hub /= new_hub.sum() or 1.0
+        change = np.abs(new_hub - hub).sum()
+        hub = new_hub
+        if change < tol * n:
+            break
+    return hub, authority, i
+
+
+class InfluenceRanking(object):
+    """PageRank, HITS and weighted degree for the nodes of a CompactGraph."""
+
+    def __init__(self, graph, types=('funded',), weight='raised_amount', half_life=0, reference_year=None,
+                 alpha=0.85, reverse=True):
+        """
+        :param CompactGraph graph: graph to rank
+        :param tuple types: relationship types used
+        :param str weight: edge attribute used as weight, None for unweighted
+        :param float half_life: if > 0, round weights halve every half_life years before reference_year
+        :param int reference_year: year with no decay, defaults to the latest funded_year
+        :param float alpha: PageRank damping factor
+        :param bool reverse: if True PageRank flows from companies to their funders, ranking
+                             investors by the companies they backed, otherwise funders to companies
+        """
+        self.graph = graph
+        self.types = types
+        self.weight = weight
+        self.half_life = half_life
+        self.reference_year = reference_year
+        self.alpha = alpha
+        self.reverse = reverse
+        self.scores = dict()
+
+    def compute(self):
+        """Compute all scores, return a dict of score name -> array indexed by node id."""
+        t0 = time.time()
+        matrix = weighted_matrix(self.graph, self.types, self.weight, self.half_life, self.reference_year)
+        self.scores['pagerank'], n_pagerank = pagerank(matrix.T.tocsr() if self.reverse else matrix, self.alpha)
+        self.scores['hub'], self.scores['authority'], n_hits = hits(matrix)
+        self.scores['weighted_out_degree'] = np.asarray(matrix.sum(axis=1)).ravel()
+        self.scores['weighted_in_degree'] = np.asarray(matrix.sum(axis=0)).ravel()
+        print 'Influence ranking: {} nodes, {} edges, PageRank {} and HITS {} iterations, {:.1f} s'.format(
+            self.graph.n_nodes, matrix.nnz, n_pagerank, n_hits, time.time() - t0)
+        return self.scores
+
+    def top(self, name='pagerank', k=20, label=None):
+        """The k highest scoring (permalink, score) pairs, optionally only nodes with a label."""
+        scores = self.scores[name]
+        nodes = np.arange(self.graph.n_nodes)
+        if label is not None:
+            nodes = nodes[self.graph.node_attributes['label'] == self.graph.category_code('label', label)]
+        best = nodes[np.argsort(-scores[nodes], kind='mergesort')[:k]]
+        return [(self.graph.permalinks[node], scores[node]) for node in best]
+
+    def rows(self):
+        """Yield (label, permalink, [scores in score_names order]) for every node."""
+        labels = self.graph.node_attributes.get('label')
+        for node in xrange(self.graph.n_nodes):
+            label = self.graph.categories['label'][labels[node]] if labels is not None and labels[node] >= 0 \
+                else None
+            yield label, self.graph.permalinks[node], [float(self.scores[name][node]) for name in score_names]
+
+    def write_tab(self, out_file='influence_scores.tab'):
+        """Write one row per node to a tab file keyed on permalink (nodes column, as in the Gephi exports)."""
+        with open(out_file, 'wb') as fil:
+            writer = csv.writer(fil, dialect='excel-tab')
+            writer.writerow(['nodes', 'label'] + score_names)
+            for label, permalink, values in self.rows():
+                writer.writerow([permalink.encode('utf-8'), label or ''] + ['{:.6g}'.format(v) for v in values])
+        print 'Influence scores written to', out_file
+        return self.graph.n_nodes
+
+    def write_to_neo4j(self, graph_builder):
+        """Set the scores as node properties in Neo4j, see GraphBuilder.write_node_properties."""
+        return graph_builder.write_node_properties(self.rows(), score_names, name='influence scores')
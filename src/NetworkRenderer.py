@@ -0,0 +1,352 @@
+"""
+Name:       NetworkRenderer.py
+Purpose:    Level of detail drawing of large networks, e.g. ego networks from
+            EgoIndex, where drawing every node and edge with networkx and
+            matplotlib grinds to a halt. The most important nodes (by degree,
+            PageRank or any score) and pinned nodes such as a path's ends are
+            drawn individually. The rest are merged into clusters per cell of a
+            grid over the layout (and per community if given). Edges are merged
+            between the drawn items and thinned to the heaviest. Finer grids
+            and larger node budgets give the deeper levels. Views are written
+            as a static image, as image tiles per zoom level, or as one HTML
+            file with pan and zoom that switches levels as it zooms. Positions
+            come from the ForceLayout cache so the layout is computed once.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/24/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import json, os, time
+from xml.sax.saxutils import escape
+import numpy as np
+
+from src.ForceLayout import ForceLayout
+
+# Node colors by label, clusters and unlabeled nodes are grey, pinned nodes orange
+label_colors = {'company': '#1f77b4', 'funder': '#d62728', 'financial_org': '#d62728', 'person': '#2ca02c'}
+cluster_color = '#aaaaaa'
+pinned_color = '#ff7f0e'
+
+# Page for write_html, __TITLE__ and __DATA__ are replaced
+html_template = u"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>__TITLE__</title>
+<style>
+body {margin: 0; overflow: hidden; font: 12px sans-serif;}
+#info {position: absolute; left: 8px; top: 8px; color: #444;}
+#tip {position: absolute; display: none; background: #fff; border: 1px solid #999; padding: 2px 4px;}
+</style></head>
+<body><canvas id="canvas"></canvas><div id="info"></div><div id="tip"></div>
+<script>
+var data = __DATA__;
+var canvas = document.getElementById('canvas'), ctx = canvas.getContext('2d');
+var info = document.getElementById('info'), tip = document.getElementById('tip');
+var view = {zoom: 1, cx: data.center[0], cy: data.center[1]}, drag = null;
+
+function level() {
+    return Math.max(0, Math.min(data.levels.length - 1, Math.floor(Math.log(view.zoom) / Math.LN2)));
+}
+function scale() { return view.zoom * Math.min(canvas.width, canvas.height) / data.span; }
+function toScreen(node) {
+    var s = scale();
+    return [canvas.width / 2 + (node[0] - view.cx) * s, canvas.height / 2 - (node[1] - view.cy) * s];
+}
+function draw() {
+    var lod = data.levels[level()], points = lod.nodes.map(toScreen), i, p, q, node;
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.strokeStyle = 'rgba(0, 0, 0, 0.25)';
+    for (i = 0; i < lod.edges.length; i++) {
+        p = points[lod.edges[i][0]];
+        q = points[lod.edges[i][1]];
+        ctx.lineWidth = 0.3 + 2 * lod.edges[i][2] / lod.max_weight;
+        ctx.beginPath(); ctx.moveTo(p[0], p[1]); ctx.lineTo(q[0], q[1]); ctx.stroke();
+    }
+    for (i = 0; i < lod.nodes.length; i++) {
+        node = lod.nodes[i]; p = points[i];
+        if (p[0] < -20 || p[1] < -20 || p[0] > canvas.width + 20 || p[1] > canvas.height + 20) continue;
+        ctx.fillStyle = data.colors[node[3]];
+        ctx.beginPath(); ctx.arc(p[0], p[1], node[2], 0, 2 * Math.PI); ctx.fill();
+    }
+    ctx.fillStyle = '#000';
+    for (i = 0; i < lod.labeled.length; i++) {
+        node = lod.nodes[lod.labeled[i]]; p = points[lod.labeled[i]];
+        ctx.fillText(node[4], p[0] + node[2] + 2, p[1] + 4);
+    }
+    info.textContent = data.title + ': level ' + level() + ', ' + lod.nodes.length + ' nodes and clusters, ' +
+        lod.edges.length + ' edges';
+}
+function resize() { canvas.width = window.innerWidth; canvas.height = window.innerHeight; draw(); }
+canvas.onmousedown = function (e) { drag = [e.clientX, e.clientY]; };
+window.onmouseup = function () { drag = null; };
+canvas.onmousemove = function (e) {
+    var s = scale(), lod, best = -1, bestDistance = Infinity, i, p, d;
+    if (drag) {
+        view.cx -= (e.clientX - drag[0]) / s;
+        view.cy += (e.clientY - drag[1]) / s;
+        drag = [e.clientX, e.clientY];
+        draw();
+        return;
+    }
+    lod = data.levels[level()];
+    for (i = 0; i < lod.nodes.length; i++) {
+        p = toScreen(lod.nodes[i]);
+        d = (p[0] - e.clientX) * (p[0] - e.clientX) + (p[1] - e.clientY) * (p[1] - e.clientY);
+        if (d < bestDistance && d <= (lod.nodes[i][2] + 3) * (lod.nodes[i][2] + 3)) { best = i; bestDistance = d; }
+    }
+    tip.style.display = best < 0 ? 'none' : 'block';
+    if (best >= 0) {
+        tip.textContent = lod.nodes[best][4];
+        tip.style.left = (e.clientX + 12) + 'px';
+        tip.style.top = (e.clientY + 12) + 'px';
+    }
+};
+canvas.onwheel = function (e) {
+    var s = scale(), dx = e.clientX - canvas.width / 2, dy = e.clientY - canvas.height / 2;
+    var x = view.cx + dx / s, y = view.cy - dy / s;
+    e.preventDefault();
+    view.zoom = Math.max(0.25, view.zoom * (e.deltaY < 0 ? 1.25 : 0.8));
+    s = scale();
+    view.cx = x - dx / s;
+    view.cy = y + dy / s;
+    draw();
+};
+window.onresize = resize;
+resize();
+</script></body></html>
+"""
+
+
+class NetworkRenderer(object):
+    """Draws a CompactGraph at levels of detail from a cached layout."""
+
+    def __init__(self, graph, positions=None, importance=None, pinned=(), membership=None, weight=None,
+                 types=None, node_budget=2000, edge_budget=5000, cluster_bits=4, cache_dir='layout_cache'):
+        """Prepare the layout and the node and edge arrays.
+
+        :param CompactGraph graph: graph to draw, e.g. EgoIndex.ego_graph
+        :param dict positions: permalink -> (x, y), from ForceLayout.cached(graph, cache_dir) if None
+        :param ndarray importance: score per node deciding which nodes are drawn individually, degree if None
+        :param list pinned: permalinks always drawn individually and labeled (e.g. a path)
+        :param ndarray membership: community per node (Communities.membership), clusters do not mix communities
+        :param str weight: edge attribute summed into merged edge weights, 1 per relationship if None
+        :param list types: relationship types drawn, all if None
+        :param int node_budget: nodes drawn individually at level 0
+        :param int edge_budget: edges drawn at each level, the heaviest are kept
+        :param int cluster_bits: level 0 clusters on a 2^cluster_bits square grid, each level doubles it
+        :param str cache_dir: ForceLayout cache directory
+        """
+        self.graph = graph
+        t0 = time.time()
+        if positions is None:
+            positions = ForceLayout.cached(graph, cache_dir, types=types)
+        self.positions = np.array([positions.get(permalink, (np.nan, np.nan)) for permalink in
+                                   graph.permalinks.tolist()], dtype=np.float64).reshape(graph.n_nodes, 2)
+        missing = np.isnan(self.positions).any(axis=1)
+        if missing.any():
+            self.positions[missing] = self.positions[~missing].mean(axis=0) if (~missing).any() else 0.0
+        self.importance = np.asarray(importance if importance is not None else graph.degree(), dtype=np.float64)
+        self.pinned = np.zeros(graph.n_nodes, dtype=bool)
+        self.pinned[[graph.index[p] for p in pinned if p in graph.index]] = True
+        self.membership = membership
+        edges = np.nonzero(graph.edge_type_mask(types))[0]
+        self.edge_a, self.edge_b = graph.sources[edges], graph.targets[edges]
+        self.edge_weight = np.ones(len(edges)) if weight is None else \
+            np.nan_to_num(graph.edge_attributes[weight][edges].astype(np.float64))
+        self.node_budget, self.edge_budget, self.cluster_bits = node_budget, edge_budget, cluster_bits
+        self.low = self.positions.min(axis=0) if graph.n_nodes else np.zeros(2)
+        self.span = float((self.positions.max(axis=0) - self.low).max()) if graph.n_nodes else 0.0
+        self.span = self.span or 1.0
+        print 'Renderer: {} nodes, {} edges, {:.1f} s'.format(graph.n_nodes, len(edges), time.time() - t0)
+
+    def detail(self, level=0, bounds=None, node_budget=None):
+        """Items (nodes and clusters) and merged edges for one level of detail.
+
+        :param int level: clusters use a grid of 2^(cluster_bits + level) cells per side
+        :param tuple bounds: (x0, y0, x1, y1), only nodes inside are included, all if None
+        :param int node_budget: nodes drawn individually, the renderer's node_budget if None
+        :rtype dict: per item x, y, count, importance, label, color, pinned; edges a, b, weight;
+                     item of each node (-1 outside bounds)
+        """
+        graph = self.graph
+        n = graph.n_nodes
+        x, y = self.positions[:, 0], self.positions[:, 1]
+        if bounds is None:
+            view = np.arange(n)
+        else:
+            view = np.nonzero((x >= bounds[0]) & (y >= bounds[1]) & (x <= bounds[2]) & (y <= bounds[3]))[0]
+        budget = self.node_budget if node_budget is None else node_budget
+        shown = np.zeros(n, dtype=bool)
+        shown[view[np.argsort(-self.importance[view], kind='mergesort')[:budget]]] = True
+        shown[view[self.pinned[view]]] = True
+        individual = view[shown[view]]
+        rest = view[~shown[view]]
+        # Clusters are the occupied grid cells (within a community) of the nodes not drawn individually
+        cells = 1 << (self.cluster_bits + level)
+        ij = np.clip(((self.positions[rest] - self.low) / self.span * cells).astype(np.int64), 0, cells - 1)
+        keys = ij[:, 0] * cells + ij[:, 1]
+        if self.membership is not None:
+            keys += np.asarray(self.membership, dtype=np.int64)[rest] * cells * cells
+        cluster_keys, cluster_of = np.unique(keys, return_inverse=True)
+        k, n_clusters = len(individual), len(cluster_keys)
+        item = np.empty(n, dtype=np.int64)
+        item.fill(-1)
+        item[individual] = np.arange(k)
+        item[rest] = k + cluster_of
+        counts = np.bincount(cluster_of, minlength=n_clusters)
+        cluster_x = np.bincount(cluster_of, weights=x[rest], minlength=n_clusters) / np.maximum(counts, 1)
+        cluster_y = np.bincount(cluster_of, weights=y[rest], minlength=n_clusters) / np.maximum(counts, 1)
+        cluster_importance = np.bincount(cluster_of, weights=self.importance[rest], minlength=n_clusters)
+        # Clusters are labeled by their most important member
+        order = np.lexsort((-self.importance[rest], cluster_of))
+        first = order[np.concatenate([[True], cluster_of[order][1:] != cluster_of[order][:-1]])] \
+            if len(rest) else order
+        labels = graph.node_attributes.get('label')
+        colors = [pinned_color if self.pinned[node] else
+                  label_colors.get(graph.categories['label'][labels[node]] if labels is not None and
+                                   labels[node] >= 0 else None, cluster_color) for node in individual]
+        # Edges between items, merged and thinned to the heaviest, edges of pinned nodes are kept
+        a, b = item[self.edge_a], item[self.edge_b]
+        keep = (a >= 0) & (b >= 0) & (a != b)
+        m = np.int64(k + n_clusters)
+        pair_keys, inverse = np.unique(np.minimum(a[keep], b[keep]) * m + np.maximum(a[keep], b[keep]),
+                                       return_inverse=True)
+        weights = np.bincount(inverse, weights=self.edge_weight[keep]) if len(pair_keys) else np.zeros(0)
+        edge_a, edge_b = pair_keys // max(m, 1), pair_keys % max(m, 1)
+        pinned_item = np.zeros(k + n_clusters, dtype=bool)
+        pinned_item[:k] = self.pinned[individual]
+        required = pinned_item[edge_a] | pinned_item[edge_b]
+        order = np.lexsort((-weights, ~required))[:max(self.edge_budget, required.sum())]
+        return {'x': np.concatenate([x[individual], cluster_x]), 'y': np.concatenate([y[individual], cluster_y]),
+                'count': np.concatenate([np.ones(k, dtype=np.int64), counts]),
+                'importance': np.concatenate([self.importance[individual], cluster_importance]),
+                'label': [graph.permalinks[node] for node in individual] +
+                         [u'{} +{}'.format(graph.permalinks[rest[i]], counts[c] - 1) if counts[c] > 1
+                          else graph.permalinks[rest[i]] for c, i in enumerate(first)],
+                'color': colors + [cluster_color] * n_clusters,
+                'pinned': pinned_item,
+                'edges': (edge_a[order], edge_b[order], weights[order]),
+                'item': item}
+
+    def radii(self, detail):
+        """Marker radius in pixels of each item, by importance for nodes and member count for clusters."""
+        importance = detail['importance']
+        scale = importance.max() if len(importance) and importance.max() > 0 else 1.0
+        radius = 2.0 + 8.0 * np.sqrt(np.maximum(importance, 0) / scale)
+        clusters = detail['count'] > 1
+        radius[clusters] = np.minimum(2.0 + 2.0 * np.log2(detail['count'][clusters] + 1), 14.0)
+        return radius
+
+    def labeled(self, detail, n_labels):
+        """Items to label: pinned items, then the most important up to n_labels."""
+        order = np.lexsort((-detail['importance'], ~detail['pinned']))
+        return order[:max(n_labels, detail['pinned'].sum())]
+
+    def draw(self, axes, detail, n_labels=20, alpha=0.6):
+        """Draw one level of detail on matplotlib axes, edges as a single LineCollection."""
+        from matplotlib.collections import LineCollection
+        x, y = detail['x'], detail['y']
+        edge_a, edge_b, weights = detail['edges']
+        if len(edge_a):
+            segments = np.dstack([np.column_stack([x[edge_a], x[edge_b]]), np.column_stack([y[edge_a], y[edge_b]])])
+            axes.add_collection(LineCollection(segments, colors=(0, 0, 0, 0.25),
+                                               linewidths=0.3 + 2.0 * weights / weights.max()))
+        radius = self.radii(detail)
+        axes.scatter(x, y, s=(2 * radius) ** 2, c=detail['color'], alpha=alpha, linewidths=0, zorder=2)
+        for i in self.labeled(detail, n_labels):
+            axes.text(x[i], y[i], u' ' + detail['label'][i], fontsize=8, zorder=3)
+        axes.set_axis_off()
+
+    def render(self, out_file='network.png', level=0, bounds=None, figsize=(18, 12), dpi=75, n_labels=20,
+               title=None):
+        """Write a static image of one level of detail, format from the file extension (png, pdf, svg).
+
+        :rtype tuple: number of items and edges drawn
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        t0 = time.time()
+        detail = self.detail(level, bounds)
+        figure = Figure(figsize=figsize)
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot(111)
+        self.draw(axes, detail, n_labels)
+        if bounds is not None:
+            axes.set_xlim(bounds[0], bounds[2])
+            axes.set_ylim(bounds[1], bounds[3])
+        else:
+            axes.autoscale_view()
+        if title:
+            axes.set_title(title)
+        figure.savefig(out_file, dpi=dpi)
+        print 'Rendered {} items and {} edges to {} in {:.1f} s'.format(len(detail['x']), len(detail['edges'][0]),
+                                                                        out_file, time.time() - t0)
+        return len(detail['x']), len(detail['edges'][0])
+
+    def render_tiles(self, out_dir='tiles', max_zoom=3, tile_pixels=512, n_labels=10):
+        """Write square image tiles out_dir/zoom/column_row.png, zoom z splits the layout into 2^z x 2^z tiles.
+
+        Rows count from the top and each zoom is drawn at the level of detail of the same number.
+        Nodes just outside a tile are included so edges continue across tile edges. Empty tiles
+        are not written.
+        :rtype int: tiles written
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        t0 = time.time()
+        high_y = self.low[1] + self.span
+        n_tiles = 0
+        for zoom in xrange(max_zoom + 1):
+            tiles = 1 << zoom
+            size = self.span / tiles
+            directory = os.path.join(out_dir, str(zoom))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for column in xrange(tiles):
+                for row in xrange(tiles):
+                    x0, y1 = self.low[0] + column * size, high_y - row * size
+                    bounds = (x0, y1 - size, x0 + size, y1)
+                    margin = 0.25 * size
+                    detail = self.detail(zoom, (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin,
+                                                bounds[3] + margin))
+                    if not len(detail['x']):
+                        continue
+                    figure = Figure(figsize=(tile_pixels / 100.0, tile_pixels / 100.0))
+                    FigureCanvasAgg(figure)
+                    axes = figure.add_axes([0, 0, 1, 1])
+                    self.draw(axes, detail, n_labels)
+                    axes.set_xlim(bounds[0], bounds[2])
+                    axes.set_ylim(bounds[1], bounds[3])
+                    figure.savefig(os.path.join(directory, '{}_{}.png'.format(column, row)), dpi=100)
+                    n_tiles += 1
+        print 'Rendered {} tiles to {} in {:.1f} s'.format(n_tiles, out_dir, time.time() - t0)
+        return n_tiles
+
+    def write_html(self, out_file='network.html', max_level=3, n_labels=30, title='Network'):
+        """Write one HTML file with pan (drag) and zoom (wheel) that switches level of detail as it zooms.
+
+        Level L is drawn with node_budget * 2^L individual nodes.
+        :rtype int: number of levels written
+        """
+        t0 = time.time()
+        colors = sorted(set(label_colors.values() + [cluster_color, pinned_color]))
+        color_index = dict((color, i) for i, color in enumerate(colors))
+        levels = []
+        for level in xrange(max_level + 1):
+            detail = self.detail(level, node_budget=self.node_budget << level)
+            radius = self.radii(detail)
+            nodes = [[round(x, 2), round(y, 2), round(r, 1), color_index[color], label] for x, y, r, color, label in
+                     zip(detail['x'].tolist(), detail['y'].tolist(), radius.tolist(), detail['color'],
+                         detail['label'])]
+            edge_a, edge_b, weights = detail['edges']
+            levels.append({'nodes': nodes,
+                           'edges': [[a, b, round(w, 3)] for a, b, w in zip(edge_a.tolist(), edge_b.tolist(),
+                                                                            weights.tolist())],
+                           'max_weight': float(weights.max()) if len(weights) else 1.0,
+                           'labeled': self.labeled(detail, n_labels).tolist()})
+        data = {'title': title, 'colors': colors, 'span': self.span * 1.05, 'levels': levels,
+                'center': (self.low + self.span / 2.0).tolist()}
+        page = html_template.replace(u'__TITLE__', escape(title)).replace(u'__DATA__', json.dumps(data).replace('</', '<\\/'))
+        with open(out_file, 'wb') as fil:
+            fil.write(page.encode('utf-8'))
+        print 'Wrote {} levels to {} in {:.1f} s'.format(len(levels), out_file, time.time() - t0)
+        return len(levels)
@@ -0,0 +1,196 @@
+"""
+Name:       PathFinder.py
+Purpose:    Connection path queries between two permalinks over a CompactGraph.
+            Shortest paths use a bidirectional breadth first search, expanding
+            whole levels with NumPy from whichever side has the smaller
+            frontier, and k shortest paths use Yen's algorithm on top of it.
+            Relationships are followed in either direction and may be limited
+            to types such as funded, Founder, CEO, VP and Adviser.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/13/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import numpy as np
+
+
+def expand(ptr, nbr, eid, frontier):
+    """All adjacency entries of the frontier nodes.
+
+    :param ndarray frontier: node ids
+    :rtype tuple: (from node, to node, edge id) arrays with one entry per adjacency entry
+    """
+    starts = ptr[frontier]
+    counts = (ptr[frontier + 1] - starts).astype(np.int64)
+    total = counts.sum()
+    if total == 0:
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty, empty
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    return np.repeat(frontier, counts), nbr[offsets], eid[offsets]
+
+
+class PathFinder(object):
+    """Shortest and k shortest connection paths, ignoring edge direction.
+
+    Adjacency for each set of relationship types is built once and cached, so
+    repeated queries only pay for the search itself.
+    """
+
+    def __init__(self, graph):
+        """
+        :param CompactGraph graph: graph to search
+        """
+        self.graph = graph
+        self._adjacency = dict()
+
+    def adjacency(self, types=None):
+        """Undirected (ptr, neighbor, edge id) arrays for the relationship types, cached."""
+        key = tuple(sorted(types)) if types else None
+        if key not in self._adjacency:
+            self._adjacency[key] = self.graph.undirected(types)
+        return self._adjacency[key]
+
+    def shortest_path(self, source, target, types=None, max_hops=0, details=True):
+        """Shortest connection between two permalinks.
+
+        :param str source: source permalink
+        :param str target: target permalink
+        :param list types: relationship types to follow, all if None
+        :param int max_hops: if > 0, paths longer than this are not searched
+        :param bool details: if True return path details (see path_details), otherwise (nodes, edges) id lists
+        :rtype dict: None if there is no path
+        """
+        path = self._search(self.graph.node_id(source), self.graph.node_id(target), self.adjacency(types),
+                            max_hops=max_hops)
+        if path is None or not details:
+            return path
+        return self.path_details(path)
+
+    def k_shortest_paths(self, source, target, k=3, types=None, max_hops=0, details=True):
+        """Up to k shortest loopless connections, shortest first (Yen's algorithm).
+
+        Paths differ in at least one node, parallel relationships between the same
+        two nodes (e.g. several funding rounds) do not make separate paths.
+
+        :param str source: source permalink
+        :param str target: target permalink
+        :param int k: number of paths
+        :param list types: relationship types to follow, all if None
+        :param int max_hops: if > 0, paths longer than this are not searched
+        :param bool details: if True return path details, otherwise (nodes, edges) id lists
+        :rtype list:
+        """
+        adjacency = self.adjacency(types)
+        source_id, target_id = self.graph.node_id(source), self.graph.node_id(target)
+        first = self._search(source_id, target_id, adjacency, max_hops=max_hops)
+        paths = [first] if first is not None else []
+        candidates = []
+        while paths and len(paths) < k:
+            nodes, edges = paths[-1]
+            for i in xrange(len(nodes) - 1):
+                root = nodes[:i + 1]
+                blocked_nodes = np.zeros(self.graph.n_nodes, dtype=bool)
+                blocked_nodes[root[:-1]] = True
+                blocked_steps = set(path_nodes[i + 1] for path_nodes, path_edges in paths
+                                    if path_nodes[:i + 1] == root)
+                hops = max_hops - i if max_hops else 0
+                if max_hops and hops <= 0:
+                    break
+                blocked_edges = self._edges_between(adjacency, root[-1], blocked_steps)
+                spur = self._search(root[-1], target_id, adjacency, blocked_nodes, blocked_edges, hops)
+                if spur is None:
+                    continue
+                candidate = (root[:-1] + spur[0], edges[:i] + spur[1])
+                if candidate not in candidates and candidate[0] not in [p[0] for p in paths]:
+                    candidates.append(candidate)
+            if not candidates:
+                break
+            candidates.sort(key=lambda path: len(path[1]))
+            paths.append(candidates.pop(0))
+        if not details:
+            return paths
+        return [self.path_details(path) for path in paths]
+
+    def _edges_between(self, adjacency, node, neighbors):
+        """Edge ids joining node to any of neighbors, as a set."""
+        ptr, nbr, eid = adjacency
+        start, end = ptr[node], ptr[node + 1]
+        if not neighbors or start == end:
+            return set()
+        mask = np.in1d(nbr[start:end], list(neighbors))
+        return set(eid[start:end][mask].tolist())
+
+    def _search(self, source, target, adjacency, blocked_nodes=None, blocked_edges=None, max_hops=0):
+        """Bidirectional BFS, return ([node ids], [edge ids]) of a shortest path or None."""
+        if source == target:
+            return [source], []
+        ptr, nbr, eid = adjacency
+        n = self.graph.n_nodes
+        if blocked_edges:
+            edge_ok = np.ones(self.graph.n_edges, dtype=bool)
+            edge_ok[list(blocked_edges)] = False
+        else:
+            edge_ok = None
+        # Per side: hops from its start (-1 unvisited), parent node and edge
+        hops = [np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32)]
+        parent = [np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32)]
+        parent_edge = [np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32)]
+        for side, start in ((0, source), (1, target)):
+            hops[side].fill(-1)
+            if blocked_nodes is not None:
+                hops[side][blocked_nodes] = -2
+            hops[side][start] = 0
+        frontiers = [np.array([source], dtype=np.int32), np.array([target], dtype=np.int32)]
+        depth = [0, 0]
+        while len(frontiers[0]) and len(frontiers[1]):
+            if max_hops and depth[0] + depth[1] >= max_hops:
+                return None
+            side = 0 if self._frontier_size(ptr, frontiers[0]) <= self._frontier_size(ptr, frontiers[1]) else 1
+            other = 1 - side
+            from_nodes, to_nodes, edges = expand(ptr, nbr, eid, frontiers[side])
+            keep = hops[side][to_nodes] == -1
+            if edge_ok is not None:
+                keep &= edge_ok[edges]
+            from_nodes, to_nodes, edges = from_nodes[keep], to_nodes[keep], edges[keep]
+            to_nodes, first = np.unique(to_nodes, return_index=True)
+            depth[side] += 1
+            hops[side][to_nodes] = depth[side]
+            parent[side][to_nodes] = from_nodes[first]
+            parent_edge[side][to_nodes] = edges[first]
+            met = to_nodes[hops[other][to_nodes] >= 0]
+            if len(met):
+                middle = met[np.argmin(hops[other][met])]
+                return self._join(middle, source, target, parent, parent_edge)
+            frontiers[side] = to_nodes.astype(np.int32)
+        return None
+
+    def _frontier_size(self, ptr, frontier):
+        return (ptr[frontier + 1] - ptr[frontier]).sum()
+
+    def _join(self, middle, source, target, parent, parent_edge):
+        """Follow parents from the meeting node back to both ends."""
+        nodes, edges = [int(middle)], []
+        node = middle
+        while node != source:
+            edges.insert(0, int(parent_edge[0][node]))
+            node = parent[0][node]
+            nodes.insert(0, int(node))
+        node = middle
+        while node != target:
+            edges.append(int(parent_edge[1][node]))
+            node = parent[1][node]
+            nodes.append(int(node))
+        return nodes, edges
+
+    def path_details(self, path):
+        """Node and edge attributes for a (node ids, edge ids) path.
+
+        :rtype dict: permalinks, nodes (attribute dicts), edges (attribute dicts with source and target), hops
+        """
+        nodes, edges = path
+        return {'permalinks': [self.graph.permalinks[node] for node in nodes],
+                'nodes': [self.graph.node_data(node) for node in nodes],
+                'edges': [self.graph.edge_data(edge) for edge in edges],
+                'hops': len(edges)}
@@ -0,0 +1,208 @@
+"""
+Name:       PortfolioSimilarity.py
+Purpose:    MinHash signatures of investor portfolios (the companies in each
+            funder's or angel's investments) indexed with locality sensitive
+            hashing. Finds the investors most similar to a given one and sweeps
+            for all pairs of near duplicate portfolios while comparing only
+            investors that share an LSH bucket, never all pairs. Portfolios can
+            come from Mongo, the JSON page files, the funded_relations export,
+            or any CompactGraph.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/21/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import json, time
+import numpy as np
+
+from src.CompactGraph import CompactGraph
+
+# Hash functions are (a * x + b) mod MERSENNE_PRIME, x is a company index
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def investment_permalinks(doc):
+    """Permalinks of the companies in a Crunchbase document's investments."""
+    permalinks = []
+    for investment in doc.get('investments') or []:
+        company = (investment.get('funding_round') or {}).get('company') or {}
+        if company.get('permalink'):
+            permalinks.append(company['permalink'])
+    return permalinks
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / float(len(a | b))
+
+
+class PortfolioIndex(object):
+    """MinHash/LSH index over investor portfolios."""
+
+    def __init__(self, portfolios, num_perm=128, bands=32, seed=1, block_items=100000):
+        """Compute signatures and LSH buckets.
+
+        With bands b and rows r = num_perm / b, pairs with Jaccard similarity above about
+        (1/b) ** (1/r) are likely to share a bucket (0.42 for the defaults).
+
+        :param dict portfolios: investor permalink -> iterable of company permalinks
+        :param int num_perm: number of hash functions in a signature
+        :param int bands: LSH bands, must divide num_perm
+        :param int seed: seed for the hash functions
+        :param int block_items: portfolio entries hashed at a time, bounds memory
+        """
+        if num_perm % bands:
+            raise ValueError('bands ({}) must divide num_perm ({})'.format(bands, num_perm))
+        t0 = time.time()
+        self.num_perm = num_perm
+        self.bands = bands
+        self.investors = sorted(p for p in portfolios if portfolios[p])
+        self.index = dict((p, i) for i, p in enumerate(self.investors))
+        self.portfolios = [frozenset(portfolios[p]) for p in self.investors]
+        companies = dict()
+        items = [[companies.setdefault(c, len(companies)) for c in portfolio] for portfolio in self.portfolios]
+        random = np.random.RandomState(seed)
+        self.a = random.randint(1, MERSENNE_PRIME, num_perm).astype(np.int64)
+        self.b = random.randint(0, MERSENNE_PRIME, num_perm).astype(np.int64)
+        self.signatures = self.minhash(items, block_items)
+        self.band_keys, self.band_order = self.buckets()
+        print 'Portfolio index: {} investors, {} companies, {} bands of {} rows, {:.1f} s'.format(
+            len(self.investors), len(companies), bands, num_perm // bands, time.time() - t0)
+
+    def minhash(self, items, block_items):
+        """Signature matrix (investors x num_perm, uint32) from lists of company indexes."""
+        signatures = np.empty((len(items), self.num_perm), dtype=np.uint32)
+        start = 0
+        while start < len(items):
+            stop, size = start, 0
+            while stop < len(items) and (size == 0 or size + len(items[stop]) <= block_items):
+                size += len(items[stop])
+                stop += 1
+            values = np.concatenate([np.array(item, dtype=np.int64) for item in items[start:stop]])
+            offsets = np.concatenate([[0], np.cumsum([len(item) for item in items[start:stop - 1]])])
+            hashed = (self.a[:, None] * values[None, :] + self.b[:, None]) % MERSENNE_PRIME
+            signatures[start:stop] = np.minimum.reduceat(hashed, offsets.astype(np.int64), axis=1).T
+            start = stop
+        return signatures
+
+    def band_hashes(self, signatures):
+        """One uint64 key per band for each signature row."""
+        rows = self.num_perm // self.bands
+        bands = signatures.reshape(len(signatures), self.bands, rows).astype(np.uint64)
+        multipliers = np.array([1000003 ** i % (1 << 61) for i in xrange(rows)], dtype=np.uint64)
+        return (bands * multipliers).sum(axis=2)
+
+    def buckets(self):
+        """Band keys sorted within each band, with the investor order that sorts them."""
+        keys = self.band_hashes(self.signatures).T
+        order = np.argsort(keys, axis=1, kind='mergesort')
+        return keys[np.arange(self.bands)[:, None], order], order
+
+    def estimate(self, i, others):
+        """MinHash estimate of the Jaccard similarity of investor i with each of others (indexes)."""
+        return (self.signatures[others] == self.signatures[i]).mean(axis=1)
+
+    def candidates(self, i):
+        """Indexes of investors sharing at least one LSH bucket with investor i."""
+        keys = self.band_hashes(self.signatures[i:i + 1])[0]
+        found = []
+        for band in xrange(self.bands):
+            lo = np.searchsorted(self.band_keys[band], keys[band], side='left')
+            hi = np.searchsorted(self.band_keys[band], keys[band], side='right')
+            found.append(self.band_order[band, lo:hi])
+        found = np.unique(np.concatenate(found))
+        return found[found != i]
+
+    def similar(self, investor, k=10, exact=True):
+        """Top k investors most similar to investor.
+
+        :param str investor: investor permalink
+        :param int k: number of results
+        :param bool exact: if True rank candidates by exact Jaccard, otherwise by the MinHash estimate
+        :rtype list: (permalink, similarity) pairs, best first
+        """
+        i = self.index[investor]
+        others = self.candidates(i)
+        if exact:
+            scores = np.array([jaccard(self.portfolios[i], self.portfolios[j]) for j in others])
+        else:
+            scores = self.estimate(i, others)
+        best = np.argsort(-scores, kind='mergesort')[:k]
+        return [(self.investors[others[j]], float(scores[j])) for j in best]
+
+    def similar_pairs(self, threshold=0.5, max_bucket=1000, exact=True):
+        """All pairs of investors with portfolio similarity at least threshold.
+
+        Only pairs sharing an LSH bucket are compared. Buckets with more than max_bucket
+        investors (e.g. many one company portfolios) are skipped.
+
+        :rtype list: (permalink, permalink, similarity), most similar first
+        """
+        t0 = time.time()
+        pairs = []
+        for band in xrange(self.bands):
+            keys, order = self.band_keys[band], self.band_order[band]
+            starts = np.concatenate([[0], np.nonzero(keys[1:] != keys[:-1])[0] + 1])
+            sizes = np.diff(np.concatenate([starts, [len(keys)]]))
+            for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+                if size > max_bucket:
+                    continue
+                members = np.sort(order[start:start + size]).astype(np.int64)
+                first, second = np.triu_indices(size, 1)
+                pairs.append(members[first] * len(self.investors) + members[second])
+        if not pairs:
+            return []
+        pairs = np.unique(np.concatenate(pairs))
+        first, second = pairs // len(self.investors), pairs % len(self.investors)
+        estimates = (self.signatures[first] == self.signatures[second]).mean(axis=1)
+        results = []
+        for i, j, estimate in zip(first, second, estimates):
+            score = jaccard(self.portfolios[i], self.portfolios[j]) if exact else estimate
+            if score >= threshold:
+                results.append((self.investors[i], self.investors[j], float(score)))
+        results.sort(key=lambda result: -result[2])
+        print 'Similar portfolios: {} candidate pairs, {} at least {}, {:.1f} s'.format(len(pairs), len(results),
+                                                                                     threshold, time.time() - t0)
+        return results
+
+    # Builders
+
+    @classmethod
+    def from_graph(cls, graph, **kwargs):
+        """Portfolios from the funded relationships of a CompactGraph (e.g. built from Neo4j)."""
+        edges = np.nonzero(graph.edge_type_mask(['funded']))[0]
+        portfolios = dict()
+        for source, target in zip(graph.sources[edges], graph.targets[edges]):
+            portfolios.setdefault(graph.permalinks[source], set()).add(graph.permalinks[target])
+        return cls(portfolios, **kwargs)
+
+    @classmethod
+    def from_tab_file(cls, relation_file='funded_relations.tab', **kwargs):
+        """Portfolios from the funded_relations export."""
+        return cls.from_graph(CompactGraph.from_tab_files([], [relation_file]), **kwargs)
+
+    @classmethod
+    def from_page_files(cls, page_files, **kwargs):
+        """Portfolios from JSON page files (permalink -> Crunchbase document) of funders or people."""
+        portfolios = dict()
+        for page_file in page_files:
+            with open(page_file, 'rb') as fil:
+                for permalink, doc in json.load(fil).iteritems():
+                    portfolios[doc.get('permalink') or permalink] = investment_permalinks(doc)
+        return cls(portfolios, **kwargs)
+
+    @classmethod
+    def from_mongo(cls, db_name='crunchbase', collection_names=('financial_organizations', 'people'),
+                   host='localhost', port=27017, **kwargs):
+        """Portfolios from the Crunchbase collections in Mongo, only permalink and investments are read."""
+        from pymongo import MongoClient
+        client = MongoClient(host, port)
+        portfolios = dict()
+        for collection_name in collection_names:
+            for doc in client[db_name][collection_name].find({'investments.0': {'$exists': True}},
+                                                             {'permalink': 1, 'investments': 1}):
+                portfolios[doc['permalink']] = investment_permalinks(doc)
+        return cls(portfolios, **kwargs)
@@ -0,0 +1,234 @@
+"""
+Name:       PropertyCleanser.py
+Purpose:    Per-entity-type property schemas for nodes and edges, compiled once
+            into a single pass transformer used by GraphBuilder during the ETL
+            from MongoDB to Neo4j.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/4/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import re
+from collections import Counter
+
+_missing = object()
+
+# Tabs, newlines, other non-printing characters and paragraph tags are replaced with spaces
+_text_pattern = re.compile('[\t\n\r\f\v]|</?p>')
+_space_pattern = re.compile('[\t\n\r\f\v]')
+_paragraph_pattern = re.compile('</?p>')
+
+
+def encode_text(value):
+    """Replace non-printing characters and <p> tags with spaces, return unicode string.
+
+    Most values need no change and cost one search. Otherwise the character class
+    and the tags are replaced separately, which is faster than the alternation.
+    """
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    if _text_pattern.search(value):
+        value = _space_pattern.sub(u' ', value)
+        if u'<' in value:
+            value = _paragraph_pattern.sub(u' ', value)
+    return value
+
+
+def to_int(value):
+    """Coerce value to an int, None if it cannot be converted."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value):
+    """Coerce value to a float, None if it cannot be converted."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bool(value):
+    """Coerce Crunchbase booleans (True, 'true', 'false') to a bool."""
+    if isinstance(value, basestring):
+        return value.strip().lower() == 'true'
+    return bool(value)
+
+
+# Coercions that can be named in a schema
+coercions = {'text': encode_text, 'int': to_int, 'float': to_float, 'bool': to_bool, 'raw': None}
+
+# Values already of these types are kept without calling the coercion
+_coerced_types = {'int': int, 'float': float, 'bool': bool}
+
+# Fields shared by all Crunchbase entities
+_common_fields = {'permalink': 'raw', 'crunchbase_url': 'raw', 'homepage_url': 'raw', 'blog_url': 'raw',
+                  'blog_feed_url': 'raw', 'twitter_username': 'raw', 'alias_list': 'raw', 'created_at': 'raw',
+                  'updated_at': 'raw', 'overview': 'text', 'description': 'text', 'visited': 'raw', 'stub': 'raw',
+                  'error': 'raw'}
+
+_organization_fields = dict(_common_fields, **{
+    'name': 'text', 'phone_number': 'raw', 'email_address': 'raw', 'number_of_employees': 'int',
+    'founded_year': 'int', 'founded_month': 'int', 'founded_day': 'int', 'deadpooled_year': 'int',
+    'deadpooled_month': 'int', 'deadpooled_day': 'int', 'deadpooled_url': 'raw',
+    'total_money_raised': 'raw', 'category_code': 'raw'})
+
+default_schema = {
+    'company': _organization_fields,
+    'funder': _organization_fields,
+    'person': dict(_common_fields, **{
+        'first_name': 'text', 'last_name': 'text', 'affiliation_name': 'text', 'birthplace': 'text',
+        'born_year': 'int', 'born_month': 'int', 'born_day': 'int'}),
+    'funded': {
+        'round_code': 'raw', 'source_url': 'raw', 'source_description': 'text', 'raised_amount': 'float',
+        'raised_currency_code': 'raw', 'funded_year': 'int', 'funded_date': 'raw'},
+    'role': {'title': 'text', 'is_past': 'bool', 'current': 'bool'},
+}
+
+# Fields that are always cleaned when a document does not have a schema
+default_text_fields = ['name', 'first_name', 'last_name', 'overview', 'description',
+                       'address1', 'address2', 'source_description']
+
+
+class PropertyCleanser(object):
+    """Builds Neo4j property dictionaries from Crunchbase documents.
+
+    Each schema maps a label (node label or relationship type) to a dictionary
+    of field name and coercion ('text', 'int', 'float', 'bool', or 'raw').
+    Only fields in the schema are kept. Fields left out, other than those in
+    drop, are counted per label, see dropped and write_dropped_report. Documents
+    whose label has no schema keep every field except those in drop, with text
+    fields cleaned.
+    """
+
+    def __init__(self, schema=None, drop=(), text_fields=default_text_fields):
+        """Compile schemas into field to converter lookups.
+
+        :param dict schema: label -> {field: coercion name}, defaults to default_schema
+        :param list drop: fields removed from documents without a schema
+        :param list text_fields: fields cleaned in documents without a schema
+        :rtype PropertyCleanser:
+        """
+        if schema is None:
+            schema = default_schema
+        self.drop = frozenset(unicode(key) for key in drop)
+        self.converters = dict()
+        for label, fields in schema.iteritems():
+            self.converters[label] = self.compile_fields(fields)
+        self.text_fields = dict((unicode(key), encode_text) for key in text_fields)
+        # Sets of fields left out, counted once per document, see dropped
+        self.dropped_field_sets = Counter()
+
+    def compile_fields(self, fields):
+        """Given {field: coercion name}, return the fields grouped for cleanse.
+
+        :rtype tuple: raw fields (frozenset), text fields, (field, converter, type kept as is) for the
+                      other coercions, and the fields not counted as dropped (schema and drop)
+        """
+        raw, text, other = [], [], []
+        for key, coercion in fields.iteritems():
+            if coercion not in coercions:
+                raise ValueError('Unknown coercion {} for field {}'.format(coercion, key))
+            # Mongo documents have unicode keys, str keys would be compared by decoding on every lookup
+            key = unicode(key)
+            if coercion == 'raw':
+                raw.append(key)
+            elif coercion == 'text':
+                text.append(key)
+            else:
+                other.append((key, coercions[coercion], _coerced_types[coercion]))
+        known = frozenset(raw + text + [field[0] for field in other]) | self.drop
+        return frozenset(raw), tuple(text), tuple(other), known
+
+    def add_schema(self, label, fields):
+        """Add or replace the schema for a label."""
+        self.converters[label] = self.compile_fields(fields)
+
+    def cleanse(self, adict, label=None):
+        """Return a new properties dictionary built from the schema's fields of adict.
+
+        The loop is over the schema, not the document. Nulls, fields outside the schema, and
+        values that fail coercion are dropped. The set of fields outside the schema, other than
+        those in drop, is counted once per document.
+
+        :param dict adict: document, probably from Mongo with list attributes
+        :param str label: node label or relationship type selecting the schema
+        :rtype dict: cleaned properties
+        """
+        compiled = self.converters.get(label)
+        if compiled is None:
+            return self._cleanse_without_schema(adict)
+        raw, text, other, known = compiled
+
+        new_dict = {key: adict[key] for key in raw.intersection(adict) if adict[key] is not None}
+        get = adict.get
+        for key in text:
+            value = get(key)
+            if value is not None:
+                new_dict[key] = encode_text(value)
+        for key, convert, kept_type in other:
+            value = get(key)
+            if value is None:
+                continue
+            if value.__class__ is not kept_type:
+                value = convert(value)
+                if value is None:
+                    continue
+            new_dict[key] = value
+        left_out = adict.viewkeys() - known
+        if left_out:
+            self.dropped_field_sets[(label, frozenset(left_out))] += 1
+        return new_dict
+
+    def _cleanse_without_schema(self, adict):
+        """Drop listed fields and nulls, clean text fields."""
+        drop = self.drop
+        text_fields = self.text_fields
+        new_dict = dict()
+        for key, value in adict.iteritems():
+            if value is None or key in drop:
+                continue
+            if key in text_fields:
+                value = encode_text(value)
+            new_dict[key] = value
+        return new_dict
+
+    def cleanse_many(self, docs, label=None):
+        """Cleanse an iterable of documents sharing a label, return a list of dicts."""
+        cleanse = self.cleanse
+        return [cleanse(d, label) for d in docs]
+
+    @property
+    def dropped(self):
+        """Counter of documents with each (label, field) left out by the schema, null or not."""
+        counts = Counter()
+        for (label, fields), count in self.dropped_field_sets.iteritems():
+            for key in fields:
+                counts[(label, key)] += count
+        return counts
+
+    def write_dropped_report(self, out_file, top=0):
+        """Write fields left out by a schema, by label, with counts, most frequent first.
+
+        :param str out_file: report file name
+        :param int top: if > 0 only the top most common fields are written
+        :rtype int: number of distinct (label, field) pairs dropped
+        """
+        dropped = self.dropped
+        with open(out_file, 'wb') as fil:
+            fil.write('label\tfield\tcount\n')
+            for (label, key), count in dropped.most_common(top or None):
+                fil.write(u'{}\t{}\t{}\n'.format(label, key, count).encode('utf-8'))
+        print 'Fields dropped by schema: {} distinct, {} total, written to {}'.format(
+            len(dropped), sum(dropped.values()), out_file)
+        return len(dropped)
+
+    def encode_chars(self, adict):
+        """Clean the text fields of adict in place and return it."""
+        for key in self.text_fields:
+            if key in adict and adict[key] is not None:
+                adict[key] = encode_text(adict[key])
+        return adict
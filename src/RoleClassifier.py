@@ -0,0 +1,106 @@
+"""
+Name:       RoleClassifier.py
+Purpose:    Classifies person to company relationship titles (e.g. Co-Founder,
+            CEO, Board Member) into relationship types used in Neo4j.
+            Patterns are compiled once, results for normalized titles are cached,
+            and titles that cannot be classified are counted for a report.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/4/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import re, json
+from collections import OrderedDict, Counter
+
+# Roles are tested in order, the first matching pattern wins
+default_roles = [('Founder', 'founder'),
+                 ('CEO', 'CEO|chief exec|president'),
+                 ('VP', 'C.O|vp|director|vice president|partner|chief'),
+                 ('Adviser', 'adviser|advisor|board|consultant')]
+
+_whitespace = re.compile('\s+')
+
+
+class RoleClassifier(object):
+    """Compiled, memoizing classifier from relationship title to role."""
+
+    def __init__(self, roles=None, cache_size=10000):
+        """Compile role patterns.
+
+        :param list roles: ordered (role, regex) pairs, defaults to default_roles
+        :param int cache_size: maximum number of normalized titles kept in the cache
+        :rtype RoleClassifier:
+        """
+        if roles is None:
+            roles = default_roles
+        self.roles = [(role, re.compile(pattern, re.I)) for role, pattern in roles]
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.unmatched = Counter()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_json(cls, json_file, cache_size=10000):
+        """Build a classifier from a JSON file holding a list of [role, regex] pairs.
+
+        Allows roles such as CTO or CFO to be added without changing code. Order matters,
+        so specific roles should come before general ones (e.g. CTO before VP).
+        """
+        with open(json_file, 'rb') as fil:
+            roles = json.load(fil)
+        return cls(roles=[(role, pattern) for role, pattern in roles], cache_size=cache_size)
+
+    def normalize(self, title):
+        """Lower case title with collapsed whitespace, used as the cache key."""
+        return _whitespace.sub(' ', title).strip().lower()
+
+    def classify(self, title):
+        """Return the role for a title, None if no role matches.
+
+        :param str title: title from a Crunchbase relationship, e.g. 'Co-Founder & CEO'
+        :rtype str or None:
+        """
+        if not title:
+            return None
+        key = self.normalize(title)
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            role = cache.pop(key)
+            cache[key] = role                   # move to most recently used
+        else:
+            self.misses += 1
+            role = None
+            for name, pattern in self.roles:
+                if pattern.search(key):
+                    role = name
+                    break
+            cache[key] = role
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        if role is None:
+            self.unmatched[key] += 1
+        return role
+
+    def classify_many(self, titles):
+        """Classify a list of titles, return a list of roles."""
+        classify = self.classify
+        return [classify(title) for title in titles]
+
+    def write_unmatched_report(self, out_file, top=0):
+        """Write unclassified titles and their counts, most frequent first, tab separated.
+
+        :param str out_file: report file name
+        :param int top: if > 0 only the top most common titles are written
+        :rtype int: number of distinct unmatched titles
+        """
+        common = self.unmatched.most_common(top or None)
+        with open(out_file, 'wb') as fil:
+            fil.write('title\tcount\n')
+            for title, count in common:
+                fil.write(u'{}\t{}\n'.format(title, count).encode('utf-8'))
+        print 'Unmatched titles: {} distinct, {} total, written to {}'.format(
+            len(self.unmatched), sum(self.unmatched.values()), out_file)
+        return len(self.unmatched)
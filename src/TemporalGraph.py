@@ -0,0 +1,242 @@
+"""
+Name:       TemporalGraph.py
+Purpose:    Time sliced views of a CompactGraph keyed on funding dates. Dated
+            edges are sorted once by funded_date (funded_year where the full
+            date is not known), so the graph as of any date, or within any
+            window of dates, is a binary search for a range of the sorted
+            arrays. Views are slices of those arrays and are not copied until
+            a CompactGraph is asked for. Year over year analytics (edges, nodes
+            and degree added each year, new co-investment ties) run in one pass
+            over the sorted edges instead of rebuilding a graph per year.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/22/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import csv, time
+import numpy as np
+from scipy import sparse
+
+from src.CompactGraph import date_key
+
+
+def edge_dates(graph):
+    """yyyymmdd key of every edge, from funded_date if known, otherwise funded_year, else -1."""
+    dates = np.empty(graph.n_edges, dtype=np.int32)
+    dates.fill(-1)
+    if 'funded_year' in graph.edge_attributes:
+        years = graph.edge_attributes['funded_year'].astype(np.int32)
+        dates = np.where(years > 0, years * 10000, dates)
+    if 'funded_date' in graph.edge_attributes:
+        known = graph.edge_attributes['funded_date'] > 0
+        dates[known] = graph.edge_attributes['funded_date'][known]
+    return dates
+
+
+class TemporalView(object):
+    """Edges of a TemporalGraph between two positions of its date order.
+
+    The arrays are slices of the TemporalGraph's sorted arrays, so no edge data is copied.
+    """
+
+    def __init__(self, temporal, start, stop):
+        self.temporal = temporal
+        self.start, self.stop = start, stop
+        self.edges = temporal.edges[start:stop]
+        self.sources = temporal.sources[start:stop]
+        self.targets = temporal.targets[start:stop]
+        self.dates = temporal.dates[start:stop]
+
+    @property
+    def n_edges(self):
+        return self.stop - self.start
+
+    def nodes(self):
+        """Ids of the nodes with at least one edge in the view."""
+        return np.unique(np.concatenate([self.sources, self.targets]))
+
+    def out_degree(self):
+        return np.bincount(self.sources, minlength=self.temporal.graph.n_nodes)
+
+    def in_degree(self):
+        return np.bincount(self.targets, minlength=self.temporal.graph.n_nodes)
+
+    def degree(self):
+        return self.out_degree() + self.in_degree()
+
+    def to_graph(self, undated=False):
+        """CompactGraph of the edges in the view (a copy), optionally with the undated edges as well."""
+        edges = np.concatenate([self.edges, self.temporal.undated]) if undated else self.edges
+        return self.temporal.graph.subgraph(edges=np.sort(edges))
+
+    def __repr__(self):
+        first = self.dates[0] if self.n_edges else None
+        last = self.dates[-1] if self.n_edges else None
+        return 'TemporalView({} edges, {} to {})'.format(self.n_edges, first, last)
+
+
+class TemporalGraph(object):
+    """Edges of a CompactGraph sorted by date, with as of and windowed views."""
+
+    def __init__(self, graph, types=('funded',)):
+        """Sort the dated edges.
+
+        :param CompactGraph graph: graph with funded_date and/or funded_year edge attributes
+        :param list types: relationship types included, all if None. Role edges have no dates.
+        """
+        self.graph = graph
+        t0 = time.time()
+        edges = np.nonzero(graph.edge_type_mask(types))[0]
+        dates = edge_dates(graph)[edges]
+        dated = dates > 0
+        order = np.argsort(dates[dated], kind='mergesort')
+        self.edges = edges[dated][order].astype(np.int32)
+        self.dates = dates[dated][order]
+        self.sources = graph.sources[self.edges]
+        self.targets = graph.targets[self.edges]
+        self.undated = edges[~dated].astype(np.int32)
+        print 'Temporal graph: {} dated edges from {} to {}, {} undated, {:.1f} s'.format(
+            len(self.edges), self.dates[0] if len(self.dates) else None,
+            self.dates[-1] if len(self.dates) else None, len(self.undated), time.time() - t0)
+
+    def position(self, date, side='right'):
+        """Number of edges dated before date (side='left') or on or before it (side='right')."""
+        return int(np.searchsorted(self.dates, date_key(date), side=side))
+
+    def as_of(self, date):
+        """Cumulative view, every edge dated on or before date (see date_key, a year alone is its start)."""
+        return TemporalView(self, 0, self.position(date))
+
+    def window(self, start, end):
+        """View of the edges dated from start to end inclusive.
+
+        A year alone as end covers only edges with no month, use (year, 12, 31) for the whole year.
+        """
+        return TemporalView(self, self.position(start, 'left'), self.position(end))
+
+    def year(self, year):
+        """View of the edges funded in one year."""
+        return self.window(year, (year, 12, 31))
+
+    def years(self):
+        """Years with at least one dated edge."""
+        return np.unique(self.dates // 10000)
+
+    def year_bounds(self):
+        """Years and the position where each year's edges start, with the end position last."""
+        years = self.years()
+        return years, np.searchsorted(self.dates, np.append(years, years[-1] + 1 if len(years) else 0) * 10000)
+
+    def first_seen(self):
+        """Date of each node's first dated edge, -1 for nodes with none."""
+        ends = np.column_stack([self.sources, self.targets]).ravel()
+        nodes, first = np.unique(ends, return_index=True)
+        dates = np.empty(self.graph.n_nodes, dtype=np.int32)
+        dates.fill(-1)
+        dates[nodes] = self.dates[first // 2]
+        return dates
+
+    def degree_by_year(self, direction='both'):
+        """Edges added to each node in each year.
+
+        :param str direction: 'out', 'in' or 'both'
+        :rtype tuple: years, CSR matrix (nodes x years) of edges added, cumsum along axis 1 for degree
+        """
+        years, bounds = self.year_bounds()
+        columns = np.repeat(np.arange(len(years)), np.diff(bounds))
+        ends = {'out': [self.sources], 'in': [self.targets], 'both': [self.sources, self.targets]}[direction]
+        rows = np.concatenate(ends)
+        columns = np.tile(columns, len(ends))
+        matrix = sparse.coo_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                   shape=(self.graph.n_nodes, len(years))).tocsr()
+        return years, matrix
+
+    def degree_growth(self, year, k=20, direction='out', label=None):
+        """Nodes that added the most edges in year, with their degree before it.
+
+        :rtype list: (permalink, degree before year, edges added in year)
+        """
+        years, added = self.degree_by_year(direction)
+        column = np.searchsorted(years, year)
+        if column == len(years) or years[column] != year:
+            return []
+        during = np.asarray(added[:, column].todense()).ravel()
+        before = np.asarray(added[:, :column].sum(axis=1)).ravel()
+        nodes = np.arange(self.graph.n_nodes)
+        if label is not None:
+            nodes = nodes[self.graph.node_attributes['label'] == self.graph.category_code('label', label)]
+        best = nodes[np.lexsort((before[nodes], -during[nodes]))[:k]]
+        return [(self.graph.permalinks[node], int(before[node]), int(during[node])) for node in best
+                if during[node] > 0]
+
+    def coinvestment_ties(self, max_funders=0):
+        """Funder pairs and the date they first shared a portfolio company.
+
+        A pair is tied at the date the second of them first funded a company both funded.
+        First investments are found in one pass over the sorted edges, pairs are formed per
+        company and the earliest date kept for each pair.
+
+        :param int max_funders: if > 0, companies with more funders are ignored (as in CoInvestment)
+        :rtype tuple: pairs (n x 2 node ids, smaller first), date each pair was tied
+        """
+        n = np.int64(self.graph.n_nodes)
+        # Edges are in date order, so the first occurrence of a (company, funder) key is the first investment
+        keys, first = np.unique(self.targets.astype(np.int64) * n + self.sources, return_index=True)
+        companies, funders, dates = keys // n, keys % n, self.dates[first]
+        order = np.lexsort((dates, companies))
+        companies, funders, dates = companies[order], funders[order], dates[order]
+        starts = np.concatenate([[0], np.nonzero(companies[1:] != companies[:-1])[0] + 1, [len(companies)]])
+        pair_keys, pair_dates = [], []
+        for lo, hi in zip(starts[:-1], starts[1:]):
+            size = hi - lo
+            if size < 2 or (max_funders and size > max_funders):
+                continue
+            first_i, second_i = np.triu_indices(size, 1)
+            a, b = funders[lo:hi][first_i], funders[lo:hi][second_i]
+            pair_keys.append(np.minimum(a, b) * n + np.maximum(a, b))
+            pair_dates.append(dates[lo:hi][second_i])
+        if not pair_keys:
+            return np.zeros((0, 2), dtype=np.int32), np.zeros(0, dtype=np.int32)
+        pair_keys, pair_dates = np.concatenate(pair_keys), np.concatenate(pair_dates)
+        order = np.lexsort((pair_dates, pair_keys))
+        pair_keys, pair_dates = pair_keys[order], pair_dates[order]
+        first = np.concatenate([[True], pair_keys[1:] != pair_keys[:-1]])
+        pair_keys, pair_dates = pair_keys[first], pair_dates[first]
+        pairs = np.column_stack([pair_keys // n, pair_keys % n]).astype(np.int32)
+        return pairs, pair_dates.astype(np.int32)
+
+    def yearly_summary(self, max_funders=0):
+        """Edges, nodes, new nodes, and new co-investment ties for each year, with cumulative totals.
+
+        :rtype list: dicts with year, edges, total_edges, nodes, new_nodes, total_nodes, new_ties, total_ties
+        """
+        years, bounds = self.year_bounds()
+        first_year = self.first_seen() // 10000
+        new_nodes = np.bincount(np.searchsorted(years, first_year[first_year > 0]), minlength=len(years))
+        pairs, tie_dates = self.coinvestment_ties(max_funders)
+        new_ties = np.bincount(np.searchsorted(years, tie_dates // 10000), minlength=len(years))
+        edges = np.diff(bounds)
+        year_of = np.repeat(np.arange(len(years)), edges)
+        ends = np.concatenate([self.sources, self.targets]).astype(np.int64)
+        active = np.unique(np.tile(year_of, 2) * np.int64(self.graph.n_nodes) + ends) // self.graph.n_nodes
+        nodes = np.bincount(active, minlength=len(years))
+        rows = []
+        for i, year in enumerate(years):
+            rows.append({'year': int(year), 'edges': int(edges[i]), 'total_edges': int(bounds[i + 1]),
+                         'nodes': int(nodes[i]), 'new_nodes': int(new_nodes[i]),
+                         'total_nodes': int(new_nodes[:i + 1].sum()), 'new_ties': int(new_ties[i]),
+                         'total_ties': int(new_ties[:i + 1].sum())})
+        return rows
+
+    def write_tab(self, out_file='yearly_summary.tab', max_funders=0):
+        """Write yearly_summary to a tab file."""
+        fields = ['year', 'edges', 'total_edges', 'nodes', 'new_nodes', 'total_nodes', 'new_ties', 'total_ties']
+        rows = self.yearly_summary(max_funders)
+        with open(out_file, 'wb') as fil:
+            writer = csv.writer(fil, dialect='excel-tab')
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow([row[field] for field in fields])
+        print 'Yearly summary written to', out_file
+        return len(rows)
@@ -0,0 +1,96 @@
+"""
+Name:       cleanse_benchmark.py
+Purpose:    Times property cleansing per document, the copy and delete cleanser
+            GraphBuilder used before PropertyCleanser against the compiled
+            schemas, on the Crunchbase examples in Data. Also lists the fields
+            the schemas drop that the old cleanser kept.
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/25/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import copy, json, re, time, timeit
+
+from src.PropertyCleanser import PropertyCleanser
+
+example_files = ['Data/crunchbase_JSON_lengthy_examples.txt', 'Data/crunchbase_JSON_examples.txt',
+                 'Data/company_pages.json', 'Data/person_pages.json']
+
+# GraphBuilder.properties_to_delete before the schemas
+properties_to_delete = ['_id', 'video_embeds', 'web_presences', 'degrees', 'relationships', 'external_links',
+                        'milestones', 'investments', 'image', 'funds', 'funding_rounds', 'providerships',
+                        'tag_list', 'offices', 'partners', 'products', 'screenshots', 'competitions',
+                        'acquisitions', 'acquisition', 'ipo', 'available_sizes']
+
+
+def legacy_cleanse(adict):
+    """GraphBuilder.cleanse_properties before PropertyCleanser."""
+    new_dict = copy.copy(adict)
+    for key in properties_to_delete:
+        if new_dict.has_key(key):
+            del new_dict[key]
+    for key in new_dict.keys():
+        if new_dict[key] is None:
+            del new_dict[key]
+    for key in ['name', 'first_name', 'last_name', 'overview', 'description',
+                'address1', 'address2', 'source_description']:
+        if key in new_dict:
+            new_dict[key] = unicode(re.sub('[\t\n\r\f\v]|</?p>', ' ', new_dict[key], count=20))
+    return new_dict
+
+
+def load_examples(files=example_files):
+    """Crunchbase entity documents found anywhere in the example files, with their label."""
+    decoder = json.JSONDecoder()
+    docs = []
+    for name in files:
+        with open(name, 'rb') as fil:
+            text = fil.read().decode('utf-8')
+        i = text.find('{')
+        while i >= 0:
+            try:
+                value, end = decoder.raw_decode(text, i)
+            except ValueError:
+                i = text.find('{', i + 1)
+                continue
+            stack = [value]
+            while stack:
+                item = stack.pop()
+                if isinstance(item, dict):
+                    label = 'person' if 'first_name' in item else 'funder' if 'funds' in item else \
+                        'company' if 'funding_rounds' in item else None
+                    if label and 'permalink' in item and 'created_at' in item:
+                        docs.append((label, item))
+                    stack.extend(item.values())
+                elif isinstance(item, list):
+                    stack.extend(item)
+            i = text.find('{', end)
+    return docs
+
+
+def time_per_document(cleanse, docs, number, repeat):
+    """Fastest of repeat timings of number passes over docs, CPU seconds per document."""
+    def run():
+        for label, doc in docs:
+            cleanse(doc, label)
+    return min(timeit.Timer(run, timer=time.clock).repeat(repeat, number)) / (number * len(docs))
+
+
+def main(number=500, repeat=9):
+    docs = load_examples()
+    cleanser = PropertyCleanser(drop=properties_to_delete)
+    legacy = time_per_document(lambda doc, label: legacy_cleanse(doc), docs, number, repeat)
+    compiled = time_per_document(cleanser.cleanse, docs, number, repeat)
+    print '{} documents, legacy {:.1f} us, schema {:.1f} us per document ({:.2f}x)'.format(
+        len(docs), legacy * 1e6, compiled * 1e6, legacy / compiled)
+    kept_before = set()
+    kept_after = set()
+    for label, doc in docs:
+        kept_before.update((label, key) for key in legacy_cleanse(doc))
+        kept_after.update((label, key) for key in cleanser.cleanse(doc, label))
+    print 'Fields kept before and dropped by the schemas:', sorted(kept_before - kept_after) or 'none'
+
+
+if __name__ == '__main__':
+    main()
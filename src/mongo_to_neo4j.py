@@ -16,6 +16,7 @@ def main():
 
     # uncomment to start with fresh database
     g.clear()
+    g.ensure_schema()
     #
     # print 'Neo4j Version', g.neo4j_version
     #
@@ -28,6 +29,8 @@ def main():
     g.add_edges_to_graph('crunchbase', 'companies', index='company', limit=200)  ##  relationship_type='funded', limit=200)
     g.add_edges_to_graph('crunchbase', 'financial_organizations', index='funder', limit=200)   ## relationship_type='funded', limit=200)
     g.add_edges_to_graph('crunchbase', 'people', index='person', limit=200)  ##  relationship_type='funded', limit=200)
+    g.write_role_report('unmatched_titles.tab')
+    g.write_dropped_report('dropped_properties.tab')
 
     print 'Nodes in graph', g.order
 
@@ -8,16 +8,18 @@ Licence:    Apache version 2.0
 """
 
 from src.GraphBuilder import GraphBuilder
+from src.ExportOrchestrator import ExportOrchestrator
 
 def main():
     # TODO Deal with unicode errors
-    # TODO Too much junk is going to export relationships
     # TODO Are there dates in the neo4j database (as opposed to year month day)
+    # Person, company, and financial nodes and funded relationships are exported in parallel
+    orchestrator = ExportOrchestrator('http://localhost:7474/db/data/', workers=4)
+    orchestrator.run()
+
+    # Single file for direct import to Gephi, use a .graphml extension for GraphML
     g = GraphBuilder('http://localhost:7474/db/data/')
-    # g.export_person_nodes_to_csv(out_file_name='person_nodes.tab')
-    # g.export_company_node_to_csv(out_file_name='company_nodes.tab')
-    # g.export_financial_nodes_to_csv(out_file_name='financial_nodes.tab')
-    g.export_funded_relationships_to_csv(out_file_name='funded_relations.tab')
+    g.export_funding_graph(out_file='funding_graph.gexf')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -8,7 +8,7 @@ License:    Apache version 2.0
 """
 
 
-import copy, re
+import copy, re, time, threading, Queue
 import src.GraphBuilder
 import py2neo
 from py2neo import neo4j
@@ -22,8 +22,13 @@ import cProfile
 import cPickle, pickletools
 import numpy as np
 import graphviz
+from concurrent import futures
 
 from src.GraphBuilder import GraphBuilder
+from src.CompactGraph import CompactGraph
+from src.PathFinder import PathFinder
+from src.EgoIndex import EgoIndex
+from src.NetworkRenderer import NetworkRenderer
 
 def main():
     source_name = "colin-rhodes"
@@ -31,62 +36,188 @@ def main():
 
     # py2neo graph representing neo4j
     neo_graph = GraphBuilder(uri=r'http://localhost:7474/db/data/')#[source]
-   # neo_graph = src.GraphBuilder(r'http://localhost:7474/db/data/')
 
+    # Load the relationships once as a compact graph, path queries then run in memory
+    t0 = time.time()
+    compact = CompactGraph.from_neo4j(neo_graph)
+    print 'Loaded', compact, 'in {:.1f} s'.format(time.time() - t0)
+    finder = PathFinder(compact)
 
-    # qry_str = 'match (' + source_name + ')-[r]-(' + target_name +' ), (t)-[c]-(a), (s)-[d]-(b) return * limit 100;'
-    # print 'query string', qry_str
-    # query2 = neo4j.CypherQuery(neo_graph, qry_str)
+    t0 = time.time()
+    paths = finder.k_shortest_paths(source_name, target_name, k=3)
+    print 'Found {} paths in {:.1f} ms'.format(len(paths), (time.time() - t0) * 1000)
+    for i, path in enumerate(paths):
+        print 'Path', i, path['hops'], 'hops:', ' - '.join(path['permalinks'])
+        for edge in path['edges']:
+            print '    {source} -[{type}]- {target}'.format(**edge)
 
+    # Investors and founders only
+    path = finder.shortest_path(source_name, target_name, types=['funded', 'Founder'])
+    if path:
+        print 'Funded/Founder path:', ' - '.join(path['permalinks'])
 
-    nl1 = nx.Graph()
-    nl1.add_path(['greg-mervine', 'bain-co', 'anne-bonaparte', 'hewlett-packard', 'ben-horowitz'])
-    nl2 = nx.Graph().add_path(['colin-rhodes', 'silicon-valley', 'atiq-raza', 'khosla-ventures', 'okta', 'ben-horowitz'])
-    nl3 = nx.Graph().add_path(['alex-popescu', 'rethinkdb', 'andreessen-horowitz', 'ben-horowitz'])
-    n14 = nx.Graph().add_path(['bain-co', 'anne-bonaparte'])
-    print 'nx.graph, nl1', type(nl1)
-
-
-    #ego = nx.ego_graph(gnx, 'ben-horowitz', radius=4, undirected=True, )
-    #print 'Bens Node Count ', nx.number_of_nodes(gnx)
-   #print 'Bens Edge Count ', nx.number_of_edges(gnx)
-    #with open(r'c:\users\casson\desktop\startups\data\ben4.pkl', 'w') as fil:
-     #   gnx = cPickle.dump(fil)
-    # Get data from neo4j and place in the networkX graph
-
-    query1 = neo_graph.CypherQuery("""match (n:person)-[r]-(p) return n, r, p;""") # was f*2..3
-
-    nxg = neo4j_to_networkx(neo_query=query1, nx_graph=nl1)     ######, source="s:company {name: 'Apptio'}", target="t:company {name: 'Eventbrite'}", limit=1000)
-        #gnx = neo4j_to_networkx(g, gnx, source="n", target=
-
-    nxgsub = nxg.subgraph(n14)
+    nxgsub = compact.to_networkx(nodes=compact.node_ids(paths[0]['permalinks'])) if paths else nx.MultiDiGraph()
     for i, edge in enumerate(nxgsub.edges_iter()):
         print 'networkX edges ', i, edge
 
     for i, node in enumerate (nxgsub.nodes_iter()):
         print 'networkX nodes ', i, node
 
+    # Neighborhood of the target without a traversal of the whole graph
+    egos = EgoIndex(compact)
+    ego = egos.ego_graph(target_name, radius=4, max_nodes=50000)
+    print 'Ego network of', target_name, ego
+
+    # Level of detail drawing, unimportant nodes are clustered and the layout is cached between runs
+    pinned = [source_name, target_name] + (paths[0]['permalinks'] if paths else [])
+    renderer = NetworkRenderer(ego, pinned=pinned)
+    renderer.render('ego_network.png', title='Ego network of ' + target_name)
+    renderer.write_html('ego_network.html', title='Ego network of ' + target_name)
 
 
-def neo4j_to_networkx(neo_query, nx_graph): ##, source, target, limit=1000):
 
-    cypher_results = neo_query.execute()
-    print 'nx graph ', type(nx_graph)
+def neo4j_to_networkx(neo_graph, nx_graph=None, match='match (a)-[r]->(b)', node_fields=('permalink', 'name'),
+                      edge_fields=('raised_amount', 'funded_year'), workers=1, labels=('funder', 'person', 'company'),
+                      limit=0):
+    """Load relationships from neo4j into networkx, returns the graph.
 
-    print '\nalist info', type(cypher_results), len(cypher_results)
-    for i, rec in enumerate(cypher_results):
-        n1 = rec[0].update_properties(rec[0].get_properties())##.encode('utf-8'))
-        n2 = rec[2].update_properties(rec[2].get_properties())##.encode('utf-8'))
-        edge = rec.values[1]
-        #if type(relation) not in (type([]), py2neo.neo4j.Node):
-        nx_graph = edge_to_networkx(nx_graph, edge)
-    #                 except TypeError as ty:
-    #                     print '\nTYPEERROR: i:', i, ty.args
-    #                     continue
-    # print nx_graph
+    Only the projected properties are returned by Cypher, as columns, so no
+    node or relationship objects are built and nothing is written back. One
+    query is streamed and each row added to the graph as it arrives. With
+    workers > 1 the match is split on the source node label, see
+    label_matches, and up to workers of the queries stream at once into a
+    bounded queue read by the main thread. Both modes load the same graph.
+
+    neo_graph: GraphBuilder or py2neo graph
+    nx_graph: networkX graph to add to, a new MultiDiGraph if None
+    match: Cypher match clause, must bind a, r and b, e.g. 'match (a:person)-[r]-(b)'
+    node_fields, edge_fields: properties copied to networkX, nodes are keyed by neo4j id
+    workers: number of label queries streamed at the same time
+    labels: source node labels the match is split on when workers > 1, match must contain '(a)'
+            (ValueError otherwise)
+    limit: if > 0, stop after this many relationships in total
+    """
+    if nx_graph is None:
+        nx_graph = nx.MultiDiGraph()
+    if workers > 1:
+        queries = [projection_query(label_match, node_fields, edge_fields, limit)
+                   for label_match in label_matches(match, labels)]
+        rows = stream_queries(neo_graph, queries, workers)
+    else:
+        queries = [projection_query(match, node_fields, edge_fields, limit)]
+        rows = stream_query(neo_graph, queries[0])
+    t0 = time.time()
+    n_edges = 0
+    try:
+        for row in rows:
+            add_row_to_networkx(nx_graph, row, node_fields, edge_fields)
+            n_edges += 1
+            if limit and n_edges >= limit:
+                break
+    finally:
+        rows.close()
+    print 'Loaded {} nodes, {} edges in {:.1f} s ({} queries)'.format(nx_graph.number_of_nodes(), n_edges,
+                                                                     time.time() - t0, len(queries))
     return nx_graph
 
 
+def label_matches(match, labels):
+    """Split a match clause into one clause per source label plus one for sources with none of them.
+
+    Each source node falls in exactly one clause: a node with several of the labels goes to the
+    first, and the last clause takes sources with none of the labels, so together the clauses
+    return the same rows as match.
+
+    match: Cypher match clause binding the source as '(a)', optionally with a where clause
+    labels: source node labels
+    """
+    if '(a)' not in match:
+        raise ValueError("match must bind the source node as '(a)' to be split on labels: " + match)
+    # Any where clause of match is kept in parentheses so an 'or' in it does not bind to the label tests
+    at = match.lower().find(' where ')
+    pattern, conditions = (match[:at], ['(' + match[at + 7:] + ')']) if at >= 0 else (match, [])
+
+    def clause(source, excluded):
+        tests = conditions + (['not (' + ' or '.join('a:' + label for label in excluded) + ')'] if excluded else [])
+        return source + (' where ' + ' and '.join(tests) if tests else '')
+
+    matches = [clause(pattern.replace('(a)', '(a:' + label + ')', 1), labels[:i]) for i, label in enumerate(labels)]
+    matches.append(clause(pattern, labels))
+    return matches
+
+
+def projection_query(match, node_fields, edge_fields, limit=0):
+    """Cypher for match returning ids, type and the projected properties only."""
+    columns = ['id(a)'] + ['a.' + f for f in node_fields] + ['id(b)'] + ['b.' + f for f in node_fields] + \
+              ['id(r)', 'type(r)'] + ['r.' + f for f in edge_fields]
+    return match + ' return ' + ', '.join(columns) + (' limit ' + str(limit) if limit else '') + ';'
+
+
+def stream_query(neo_graph, query_str):
+    """Generate the rows of a query as tuples as they are streamed."""
+    for record in neo4j.CypherQuery(neo_graph, query_str).stream():
+        yield tuple(record.values)
+
+
+def stream_queries(neo_graph, queries, workers, buffer_rows=10000):
+    """Generate the rows of several queries streamed in parallel threads, in arrival order.
+
+    At most workers queries run at once and at most buffer_rows rows wait in the queue, so
+    memory does not grow with the graph. Closing the generator stops the running queries.
+    """
+    rows = Queue.Queue(maxsize=buffer_rows)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                rows.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def produce(i):
+        try:
+            for row in stream_query(neo_graph, queries[i]):
+                if stop.is_set():
+                    break
+                put(row)
+        finally:
+            put(i)
+
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    running = dict()
+    pending = range(len(queries))
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                i = pending.pop(0)
+                running[i] = executor.submit(produce, i)
+            item = rows.get()
+            if isinstance(item, tuple):
+                yield item
+            else:
+                # A query finished, raise its error if any
+                running.pop(item).result()
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+def add_row_to_networkx(nx_graph, row, node_fields, edge_fields):
+    """Add the nodes and edge in one projection query row to networkX."""
+    n = len(node_fields)
+    source, target = row[0], row[n + 1]
+    for key, values in ((source, row[1:n + 1]), (target, row[n + 2:2 * n + 2])):
+        if key not in nx_graph:
+            nx_graph.add_node(key, dict((f, v) for f, v in zip(node_fields, values) if v is not None))
+    rel_id, rel_type = row[2 * n + 2], row[2 * n + 3]
+    attributes = dict((f, v) for f, v in zip(edge_fields, row[2 * n + 4:]) if v is not None)
+    attributes['id'] = rel_id
+    attributes['type'] = rel_type
+    nx_graph.add_edge(source, target, **attributes)
+
+
 
 
     #gnx = gnx.subgraph(nl2)
@@ -257,12 +388,14 @@ def node_to_networkx(nx_graph, neo_node):
 
 
 def get_nx_graph_from_pickle(pickle_file):
+    """Load a networkx graph pickled by save_nx_graph_as_pickle. For large graphs use
+    GraphSnapshot.load_snapshot and CompactGraph.to_networkx on the part needed."""
     with open(pickle_file, 'rb') as pickle:
-        return cPickle.dump(pickle)
+        return cPickle.load(pickle)
 
 def save_nx_graph_as_pickle(graph, pickle_file):
     with open(pickle_file, 'wb') as pickle:
-        cPickle.dump(graph, pickle)
+        cPickle.dump(graph, pickle, cPickle.HIGHEST_PROTOCOL)
 
 
 if __name__ == '__main__':
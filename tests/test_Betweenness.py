@@ -0,0 +1,61 @@
+"""
+Name:       test_Betweenness.py
+Purpose:    Checks ApproximateBetweenness against its exact mode: exact mode
+            matches networkx, and the sampled bounds cover the exact values.
+            Run from the repository root with python -m unittest discover tests
+Author:     Casson Stallings, CassonStallings@gmail.com
+Created:    8/19/2014
+Copyright:  Casson Stallings (c) 2014
+Licence:    Apache License, Version 2.0
+"""
+
+import unittest
+import networkx as nx
+import numpy as np
+
+from src.CompactGraph import CompactGraph
+from src.Betweenness import ApproximateBetweenness
+
+
+def small_graph():
+    """Preferential attachment graph of 400 nodes plus a path of 4 nodes, as funded relationships."""
+    nx_graph = nx.MultiDiGraph()
+    for a, b in nx.barabasi_albert_graph(400, 2, seed=3).edges():
+        nx_graph.add_edge(str(a), str(b), type='funded')
+    for a, b in [('p1', 'p2'), ('p2', 'p3'), ('p3', 'p4')]:
+        nx_graph.add_edge(a, b, type='funded')
+    return nx_graph
+
+
+class TestBetweenness(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.nx_graph = small_graph()
+        cls.graph = CompactGraph.from_networkx(cls.nx_graph)
+        cls.exact = ApproximateBetweenness(cls.graph, workers=1, exact_size=cls.graph.n_nodes)
+
+    def test_exact_mode(self):
+        expected = nx.betweenness_centrality(self.nx_graph.to_undirected(), normalized=False)
+        self.assertTrue(np.allclose([expected[permalink] for permalink in self.graph.permalinks],
+                                    self.exact.estimate))
+        self.assertTrue((self.exact.low == self.exact.estimate).all())
+        self.assertTrue((self.exact.high == self.exact.estimate).all())
+
+    def test_coverage(self):
+        confidence = 0.9
+        top = np.argsort(-self.exact.estimate)[:20]
+        for seed in xrange(5):
+            sampled = ApproximateBetweenness(self.graph, samples=40, seed=seed, workers=1, exact_size=100,
+                                             confidence=confidence)
+            inside = (sampled.low <= self.exact.estimate + 1e-9) & (self.exact.estimate <= sampled.high + 1e-9)
+            self.assertGreaterEqual(inside.mean(), confidence)
+            self.assertGreaterEqual(inside[top].mean(), confidence)
+            # The path component is below exact_size, so it is computed exactly
+            path = np.nonzero(sampled.component == sampled.component[self.graph.permalinks == 'p2'])[0]
+            self.assertTrue(np.allclose(sampled.estimate[path], self.exact.estimate[path]))
+            self.assertTrue((sampled.high[path] == sampled.low[path]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()